@@ -0,0 +1,262 @@
+"""
+跨期数据分析：把 periods/signups/checkins（含已归档期数）分批流式导出为 Parquet 列式文件，
+再用 pandas/NumPy 向量化计算留存曲线、最长连续打卡天数分布、打卡时段分布和达标率。
+依赖 numpy、pandas、pyarrow，仅在使用时导入，未安装时机器人其他功能不受影响。
+
+用法（在仓库根目录执行）：
+    python -m app.services.analytics export [--out ./analytics] [--batch-size 10000]
+    python -m app.services.analytics report [--out ./analytics]
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List
+from dotenv import load_dotenv
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+from app.models.database import Period, Signup, Checkin, PeriodArchive, engine, replica_engine
+from .archive_service import QUALIFIED_CHECKINS, load_archive_rows
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 导出文件所在目录
+ANALYTICS_DIR = os.getenv("ANALYTICS_DIR", "./analytics")
+# 每批从数据库读取并写入 Parquet 的行数
+ANALYTICS_BATCH_SIZE = int(os.getenv("ANALYTICS_BATCH_SIZE", "10000"))
+# #统计 的结果在该时间（秒）内直接复用，不重新导出全部期数
+ANALYTICS_REPORT_TTL = int(os.getenv("ANALYTICS_REPORT_TTL", "600"))
+# 留存曲线统计的天数（与活动周期一致）
+RETENTION_DAYS = 21
+
+STATS_COMMAND = "#统计"
+
+# 同一时刻只允许一次导出，避免并发的 #统计 写同一组文件
+_export_lock = threading.Lock()
+# 导出目录 -> (生成时间, 摘要)；并发的 #统计 排队等待，拿到同一份结果
+_report_cache: Dict[str, tuple] = {}
+_report_lock = threading.Lock()
+
+
+def _require():
+    try:
+        import numpy as np
+        import pandas as pd
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("数据分析需要安装 numpy、pandas 和 pyarrow：pip install numpy pandas pyarrow") from e
+    return np, pd, pa, pq
+
+
+def _schemas(pa) -> Dict[str, Any]:
+    return {
+        "periods": pa.schema([
+            ("id", pa.int64()), ("period_name", pa.string()), ("start_date", pa.timestamp("us")),
+            ("end_date", pa.timestamp("us")), ("status", pa.string()),
+        ]),
+        "signups": pa.schema([
+            ("id", pa.int64()), ("period_id", pa.int64()), ("nickname", pa.string()),
+            ("signup_time", pa.timestamp("us")),
+        ]),
+        "checkins": pa.schema([
+            ("id", pa.int64()), ("signup_id", pa.int64()), ("period_id", pa.int64()),
+            ("checkin_date", pa.date32()), ("created_at", pa.timestamp("us")), ("duplicate", pa.bool_()),
+        ]),
+    }
+
+
+def _hot_queries() -> Dict[str, Any]:
+    """热表的导出查询，只取分析需要的列（不读取打卡内容和 MinHash 签名）"""
+    return {
+        "periods": select(Period.id, Period.period_name, Period.start_date, Period.end_date, Period.status)
+        .order_by(Period.id),
+        "signups": select(Signup.id, Signup.period_id, Signup.nickname, Signup.signup_time)
+        .order_by(Signup.id),
+        "checkins": select(Checkin.id, Checkin.signup_id, Signup.period_id, Checkin.checkin_date,
+                           Checkin.created_at, Checkin.duplicate_of.isnot(None))
+        .join(Signup, Signup.id == Checkin.signup_id)
+        .order_by(Checkin.id),
+    }
+
+
+def export(source: Engine = None, out_dir: str = ANALYTICS_DIR, batch_size: int = ANALYTICS_BATCH_SIZE) -> Dict[str, int]:
+    """分批导出三张表到 out_dir/<表名>.parquet（已归档期数从归档中解压补齐），返回各表行数"""
+    np, pd, pa, pq = _require()
+    source = source or replica_engine or engine
+    schemas = _schemas(pa)
+    os.makedirs(out_dir, exist_ok=True)
+
+    def write(writer, schema, rows) -> int:
+        if not rows:
+            return 0
+        columns = list(zip(*rows))
+        writer.write_table(pa.Table.from_arrays(
+            [pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema))
+        return len(rows)
+
+    counts = {name: 0 for name in schemas}
+    paths = {name: os.path.join(out_dir, f"{name}.parquet") for name in schemas}
+    with _export_lock:
+        writers = {name: pq.ParquetWriter(f"{paths[name]}.tmp", schema, compression="zstd")
+                   for name, schema in schemas.items()}
+        try:
+            with source.connect() as conn:
+                conn = conn.execution_options(stream_results=True, yield_per=batch_size)
+                for name, stmt in _hot_queries().items():
+                    for rows in conn.execute(stmt).partitions(batch_size):
+                        counts[name] += write(writers[name], schemas[name], rows)
+
+                # 已归档期数的报名和打卡已从热表删除，逐个解压归档补齐
+                archives = conn.execute(select(PeriodArchive.period_id, PeriodArchive.payload))
+                for period_id, payload in archives:
+                    data = load_archive_rows(payload)
+                    counts["signups"] += write(writers["signups"], schemas["signups"], [
+                        (row["id"], row["period_id"], row["nickname"], row["signup_time"]) for row in data["signups"]])
+                    counts["checkins"] += write(writers["checkins"], schemas["checkins"], [
+                        (row["id"], row["signup_id"], period_id, row["checkin_date"], row["created_at"],
+                         row["duplicate_of"] is not None) for row in data["checkins"]])
+        finally:
+            for writer in writers.values():
+                writer.close()
+        for path in paths.values():
+            os.replace(f"{path}.tmp", path)
+    logger.info(f"分析数据已导出到 {out_dir}: {counts}")
+    return counts
+
+
+def compute_metrics(out_dir: str = ANALYTICS_DIR) -> Dict[str, Any]:
+    """读取导出的 Parquet，向量化计算各项指标"""
+    np, pd, _, _ = _require()
+    periods = pd.read_parquet(os.path.join(out_dir, "periods.parquet"), columns=["id", "period_name"])
+    signups = pd.read_parquet(os.path.join(out_dir, "signups.parquet"), columns=["id", "period_id"])
+    checkins = pd.read_parquet(os.path.join(out_dir, "checkins.parquet"),
+                               columns=["signup_id", "period_id", "checkin_date", "created_at", "duplicate"])
+    valid = checkins[~checkins["duplicate"]]
+    dates = pd.to_datetime(valid["checkin_date"]).to_numpy().astype("datetime64[D]").astype(np.int64)
+    signup_ids = valid["signup_id"].to_numpy()
+
+    # 达标率：每人有效打卡次数 >= QUALIFIED_CHECKINS
+    per_signup = pd.Series(np.ones(len(valid), dtype=np.int64)).groupby(signup_ids).sum()
+    counts = per_signup.reindex(signups["id"].to_numpy(), fill_value=0).to_numpy()
+    qualified = counts >= QUALIFIED_CHECKINS
+    by_period = pd.DataFrame({"period_id": signups["period_id"].to_numpy(), "qualified": qualified})\
+        .groupby("period_id")["qualified"].agg(["sum", "count"])
+    names = periods.set_index("id")["period_name"]
+    qualification = [
+        {"period_name": names.get(period_id, str(period_id)), "qualified": int(row["sum"]), "signups": int(row["count"])}
+        for period_id, row in by_period.iterrows()
+    ]
+
+    # 留存：以每期第一次打卡的日期为第 0 天，每人最后一次打卡落在第几天
+    period_start = pd.Series(dates).groupby(valid["period_id"].to_numpy()).transform("min").to_numpy()
+    day_index = dates - period_start
+    last_day = pd.Series(day_index).groupby(signup_ids).max()\
+        .reindex(signups["id"].to_numpy(), fill_value=-1).to_numpy()
+    histogram = np.bincount(np.clip(last_day, -1, RETENTION_DAYS) + 1, minlength=RETENTION_DAYS + 2)
+    # 第 k 天仍在打卡的人数 = 最后打卡日 >= k 的人数
+    survivors = np.cumsum(histogram[::-1])[::-1][1:RETENTION_DAYS + 1]
+    retention = (survivors / len(signups)).tolist() if len(signups) else []
+
+    # 最长连续打卡天数：同一人相邻打卡日相差 1 天时属于同一段
+    order = np.lexsort((dates, signup_ids))
+    sorted_ids, sorted_dates = signup_ids[order], dates[order]
+    distinct = np.ones(len(order), dtype=bool)
+    distinct[1:] = (sorted_ids[1:] != sorted_ids[:-1]) | (sorted_dates[1:] != sorted_dates[:-1])
+    sorted_ids, sorted_dates = sorted_ids[distinct], sorted_dates[distinct]
+    run_start = np.ones(len(sorted_ids), dtype=bool)
+    run_start[1:] = (sorted_ids[1:] != sorted_ids[:-1]) | (sorted_dates[1:] - sorted_dates[:-1] != 1)
+    run_lengths = np.diff(np.append(np.flatnonzero(run_start), len(sorted_ids)))
+    longest = pd.Series(run_lengths).groupby(sorted_ids[run_start]).max()\
+        .reindex(signups["id"].to_numpy(), fill_value=0).to_numpy()
+    streak_bins = [0, 1, 2, 3, 4, 7, 14, RETENTION_DAYS + 1]
+    streak_counts, _ = np.histogram(longest, bins=streak_bins + [np.iinfo(np.int64).max])
+
+    # 打卡时段：按小时统计
+    hours = np.bincount(pd.to_datetime(valid["created_at"]).dt.hour.dropna().to_numpy(dtype=np.int64), minlength=24)
+
+    return {
+        "periods": len(periods),
+        "signups": len(signups),
+        "checkins": len(valid),
+        "duplicates": int(checkins["duplicate"].sum()),
+        "qualification": qualification,
+        "qualified_rate": float(qualified.mean()) if len(qualified) else 0.0,
+        "retention": retention,
+        "streaks": list(zip(streak_bins, streak_bins[1:] + [None], streak_counts.tolist())),
+        "median_streak": float(np.median(longest)) if len(longest) else 0.0,
+        "hours": hours.tolist(),
+    }
+
+
+def render_summary(metrics: Dict[str, Any], max_periods: int = 10) -> str:
+    """把指标格式化成群消息"""
+    if not metrics["signups"]:
+        return "📊 暂无可统计的报名数据"
+    lines = [f"📊 跨期统计：{metrics['periods']} 期，{metrics['signups']} 人次报名，"
+             f"{metrics['checkins']} 条有效打卡（另有 {metrics['duplicates']} 条重复打卡未计入）"]
+
+    lines.append(f"\n🏆 达标率（有效打卡 ≥ {QUALIFIED_CHECKINS} 次）：总体 {metrics['qualified_rate'] * 100:.1f}%")
+    for row in metrics["qualification"][-max_periods:]:
+        rate = row["qualified"] / row["signups"] * 100 if row["signups"] else 0
+        lines.append(f"- {row['period_name']}：{row['qualified']}/{row['signups']}（{rate:.1f}%）")
+
+    retention = metrics["retention"]
+    if retention:
+        points = [day for day in (1, 3, 7, 14, RETENTION_DAYS) if day <= len(retention)]
+        lines.append("\n📉 留存（第 N 天后仍在打卡的比例）：" +
+                     "，".join(f"第{day}天 {retention[day - 1] * 100:.0f}%" for day in points))
+
+    lines.append(f"\n🔥 最长连续打卡天数（中位数 {metrics['median_streak']:.0f} 天）：")
+    for low, high, count in metrics["streaks"]:
+        if high is None:
+            label = f"{low}天及以上"
+        elif high - low == 1:
+            label = f"{low}天"
+        else:
+            label = f"{low}-{high - 1}天"
+        lines.append(f"- {label}：{count} 人")
+
+    hours = metrics["hours"]
+    if any(hours):
+        peak = max(hours)
+        bars = "▁▂▃▄▅▆▇█"
+        sparkline = "".join(bars[min(int(h / peak * (len(bars) - 1) + 0.5), len(bars) - 1)] for h in hours)
+        top = [h for h in sorted(range(24), key=lambda h: -hours[h])[:3] if hours[h]]
+        lines.append(f"\n🕐 打卡时段（0-23 点）：{sparkline}")
+        lines.append("高峰：" + "、".join(f"{h}点（{hours[h]} 条）" for h in top))
+    return "\n".join(lines)
+
+
+def build_report(out_dir: str = ANALYTICS_DIR, max_age: float = ANALYTICS_REPORT_TTL) -> str:
+    """导出最新数据并生成统计摘要（#统计 命令使用）；max_age 秒内生成过的摘要直接返回"""
+    with _report_lock:
+        cached = _report_cache.get(out_dir)
+        if cached and time.monotonic() - cached[0] < max_age:
+            return cached[1]
+        export(out_dir=out_dir)
+        report = render_summary(compute_metrics(out_dir))
+        _report_cache[out_dir] = (time.monotonic(), report)
+        return report
+
+
+def main(argv: List[str] = None) -> None:
+    arg_parser = argparse.ArgumentParser(description="跨期数据分析")
+    arg_parser.add_argument("action", choices=["export", "report"])
+    arg_parser.add_argument("--out", default=ANALYTICS_DIR, help="Parquet 文件目录")
+    arg_parser.add_argument("--batch-size", type=int, default=ANALYTICS_BATCH_SIZE)
+    args = arg_parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.action == "export":
+        counts = export(out_dir=args.out, batch_size=args.batch_size)
+        print(f"已导出: {counts}")
+    else:
+        print(render_summary(compute_metrics(args.out)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""
+已结束期数的冷归档：把报名和打卡行压缩存入 period_archives，从热表中删除；需要时可以原样恢复。
+
+用法（在仓库根目录执行）：
+    python -m app.services.archive_service archive            # 归档所有结束超过 ARCHIVE_AFTER_DAYS 天的期数
+    python -m app.services.archive_service archive 2024-05    # 立即归档指定期数
+    python -m app.services.archive_service restore 2024-05    # 恢复到热表（之后不再自动归档，需要时手动 archive）
+    python -m app.services.archive_service list
+"""
+import argparse
+import base64
+import json
+import logging
+import os
+import zlib
+from datetime import datetime, date, timedelta
+from typing import Any, Dict, List
+from dotenv import load_dotenv
+from sqlalchemy import Date, DateTime, LargeBinary, Table, delete, insert, select
+from sqlalchemy.orm import Session
+from app.models.database import Period, Signup, Checkin, PeriodArchive, SessionLocal, get_period_stats, init_db
+from app.services.search_service import index_checkin, index_signup, unindex
+from app.services.dedup_service import lsh_index
+from app.services.identity_service import sender_index
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 期数结束多少天后自动归档（留出查看结果、补发总结的时间）
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "7"))
+# 达标所需的有效打卡次数，与活动结束时的判定一致
+QUALIFIED_CHECKINS = 9
+
+
+def _dump_row(table: Table, row) -> Dict[str, Any]:
+    data = {}
+    for column in table.columns:
+        value = row[column.name]
+        if value is None:
+            pass
+        elif isinstance(column.type, (DateTime, Date)):
+            value = value.isoformat()
+        elif isinstance(column.type, LargeBinary):
+            value = base64.b64encode(value).decode("ascii")
+        data[column.name] = value
+    return data
+
+
+def _load_row(table: Table, data: Dict[str, Any]) -> Dict[str, Any]:
+    row = {}
+    for column in table.columns:
+        value = data.get(column.name)
+        if value is None:
+            pass
+        elif isinstance(column.type, DateTime):
+            value = datetime.fromisoformat(value)
+        elif isinstance(column.type, Date):
+            value = date.fromisoformat(value)
+        elif isinstance(column.type, LargeBinary):
+            value = base64.b64decode(value)
+        row[column.name] = value
+    return row
+
+
+def archive_period(db: Session, period: Period) -> PeriodArchive:
+    """归档一个已结束的期数：报名和打卡压缩存档，结果写入快照，热表中的行在同一事务中删除"""
+    if period.status != '已结束':
+        raise ValueError(f"期数 {period.period_name} 尚未结束（{period.status}），不能归档")
+    if db.query(PeriodArchive.id).filter(PeriodArchive.period_id == period.id).first():
+        raise ValueError(f"期数 {period.period_name} 已经归档")
+
+    # 读取和删除都在主库上进行，避免副本延迟导致漏归档的行被删除
+    db.info["use_primary"] = True
+    signups_table = Signup.__table__
+    checkins_table = Checkin.__table__
+    signup_ids = select(Signup.id).where(Signup.period_id == period.id)
+    signup_rows = db.execute(select(signups_table).where(signups_table.c.period_id == period.id)).mappings().all()
+    checkin_rows = db.execute(
+        select(checkins_table).where(checkins_table.c.signup_id.in_(signup_ids))
+    ).mappings().all()
+
+    stats = {row.nickname: row for row in get_period_stats(db, period.id)}
+    results = []
+    for row in signup_rows:
+        stat = stats.get(row["nickname"])
+        checkin_count = stat.checkin_count if stat else 0
+        results.append({
+            "nickname": row["nickname"],
+            "focus_area": row["focus_area"],
+            "checkin_count": checkin_count,
+            "last_checkin_date": stat.last_checkin_date.isoformat() if stat and stat.last_checkin_date else None,
+            "qualified": checkin_count >= QUALIFIED_CHECKINS,
+        })
+
+    payload = json.dumps({
+        "signups": [_dump_row(signups_table, row) for row in signup_rows],
+        "checkins": [_dump_row(checkins_table, row) for row in checkin_rows],
+    }, ensure_ascii=False).encode("utf-8")
+    archive = PeriodArchive(
+        period_id=period.id,
+        signup_count=len(signup_rows),
+        checkin_count=len(checkin_rows),
+        snapshot=json.dumps({"period_name": period.period_name, "results": results}, ensure_ascii=False),
+        payload=zlib.compress(payload, 9)
+    )
+    db.add(archive)
+    # 手动归档恢复过的期数时取消保留标记
+    period.keep_hot = False
+    db.execute(delete(Checkin).where(Checkin.signup_id.in_(signup_ids)))
+    db.execute(delete(Signup).where(Signup.period_id == period.id))
+    db.commit()
+    # 进程内由这些行派生的索引一并移除，长期运行时内存不随历史期数增长
+    unindex(db, [row["id"] for row in checkin_rows], [row["id"] for row in signup_rows])
+    lsh_index.forget(row["id"] for row in signup_rows)
+    sender_index.forget_period(period.id)
+    logger.info(f"归档期数 {period.period_name}：{len(signup_rows)} 条报名，{len(checkin_rows)} 条打卡，"
+                f"{len(payload)} -> {len(archive.payload)} 字节")
+    return archive
+
+
+def restore_period(db: Session, period: Period) -> None:
+    """把归档的报名和打卡按原 ID 写回热表，并删除归档；恢复的期数标记为保留在热表，不会被立即自动归档"""
+    archive = db.query(PeriodArchive).filter(PeriodArchive.period_id == period.id).first()
+    if not archive:
+        raise ValueError(f"期数 {period.period_name} 没有归档")
+    data = load_archive_rows(archive.payload)
+    if data["signups"]:
+        db.execute(insert(Signup.__table__), data["signups"])
+    if data["checkins"]:
+        db.execute(insert(Checkin.__table__), data["checkins"])
+    db.delete(archive)
+    period.keep_hot = True
+    db.commit()
+    # 去重索引和发送者绑定在下次使用时从热表重新加载，这里只清掉可能残留的旧条目；搜索索引直接补回
+    lsh_index.forget(row["id"] for row in data["signups"])
+    sender_index.forget_period(period.id)
+    for row in data["checkins"]:
+        index_checkin(db, row["id"], row["content"])
+    for row in data["signups"]:
+        index_signup(db, row["id"], row["goals"])
+    logger.info(f"恢复期数 {period.period_name}：{len(data['signups'])} 条报名，{len(data['checkins'])} 条打卡")
+
+
+def load_archive_rows(payload: bytes) -> Dict[str, List[Dict[str, Any]]]:
+    """解压归档内容，返回按列类型还原后的报名和打卡行"""
+    data = json.loads(zlib.decompress(payload))
+    return {
+        "signups": [_load_row(Signup.__table__, row) for row in data["signups"]],
+        "checkins": [_load_row(Checkin.__table__, row) for row in data["checkins"]],
+    }
+
+
+def archive_ended_periods(db: Session, after_days: int = ARCHIVE_AFTER_DAYS) -> List[str]:
+    """归档所有结束超过 after_days 天且尚未归档的期数（跳过从归档恢复的期数），返回归档的期数名称"""
+    cutoff = datetime.now() - timedelta(days=after_days)
+    archived = select(PeriodArchive.period_id)
+    periods = db.query(Period)\
+        .filter(Period.status == '已结束')\
+        .filter(Period.end_date <= cutoff)\
+        .filter(Period.id.notin_(archived))\
+        .filter(Period.keep_hot.isnot(True))\
+        .all()
+    names = []
+    for period in periods:
+        archive_period(db, period)
+        names.append(period.period_name)
+    return names
+
+
+def get_period_results(db: Session, period: Period) -> List[Dict[str, Any]]:
+    """期数结果：已归档的读快照，否则从热表实时统计"""
+    snapshot = db.query(PeriodArchive.snapshot).filter(PeriodArchive.period_id == period.id).scalar()
+    if snapshot:
+        return json.loads(snapshot)["results"]
+    focus_areas = dict(db.query(Signup.nickname, Signup.focus_area).filter(Signup.period_id == period.id))
+    return [
+        {
+            "nickname": row.nickname,
+            "focus_area": focus_areas.get(row.nickname),
+            "checkin_count": row.checkin_count,
+            "last_checkin_date": row.last_checkin_date.isoformat() if row.last_checkin_date else None,
+            "qualified": row.checkin_count >= QUALIFIED_CHECKINS,
+        }
+        for row in get_period_stats(db, period.id)
+    ]
+
+
+def main(argv: List[str] = None) -> None:
+    arg_parser = argparse.ArgumentParser(description="已结束期数的冷归档")
+    arg_parser.add_argument("action", choices=["archive", "restore", "list"])
+    arg_parser.add_argument("period", nargs="?", help="期数名称；archive 不指定时归档所有到期的期数")
+    args = arg_parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    init_db()
+    db = SessionLocal()
+    try:
+        if args.action == "list":
+            rows = db.query(Period.period_name, PeriodArchive.signup_count, PeriodArchive.checkin_count,
+                            PeriodArchive.archived_at)\
+                .join(PeriodArchive, PeriodArchive.period_id == Period.id)\
+                .order_by(Period.id)\
+                .all()
+            for name, signup_count, checkin_count, archived_at in rows:
+                print(f"{name}: {signup_count} 条报名，{checkin_count} 条打卡，归档于 {archived_at:%Y-%m-%d %H:%M}")
+            return
+        if args.action == "archive" and not args.period:
+            names = archive_ended_periods(db)
+            print(f"已归档 {len(names)} 个期数: {', '.join(names)}" if names else "没有需要归档的期数")
+            return
+        if not args.period:
+            arg_parser.error("restore 需要指定期数")
+        period = db.query(Period).filter(Period.period_name == args.period).first()
+        if not period:
+            arg_parser.error(f"期数 {args.period} 不存在")
+        if args.action == "archive":
+            archive_period(db, period)
+        else:
+            restore_period(db, period)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+"""
+历史期数批量导入：从 CSV / JSONL 文件或多维表导出的 JSON 读取报名和打卡记录，写入 periods/signups/checkins。
+
+用法（在仓库根目录执行）：
+    python -m app.services.bulk_import --signups signups.csv --checkins checkins.jsonl --period 2023-10
+
+- 列名支持英文字段名或多维表的中文列名（期数、昵称、专注领域、自我介绍、本期目标、报名时间、打卡日期、打卡内容）
+- 行中没有期数时使用 --period；期数不存在时自动创建为"已结束"，起止日期取打卡日期范围
+- 打卡中出现未报名的昵称时自动创建报名记录
+- 打卡文件需按日期排序，checkin_count 按导入顺序累计
+- 每 --chunk-size 行提交一次事务并写入断点，中断后重新执行同样的命令会从断点继续；
+  已存在的报名（期数+昵称）和打卡（报名+日期）会跳过，重复执行不会产生重复数据
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import time
+from datetime import datetime, date
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from dateutil import parser as date_parser
+from sqlalchemy import insert, select, func
+from sqlalchemy.engine import Connection, Engine
+from app.models.database import Period, Signup, Checkin, engine, init_db
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+CHUNK_SIZE = 5000
+DEFAULT_CHECKPOINT = "bulk_import.checkpoint.json"
+
+# 字段名 -> 可接受的列名（多维表导出使用中文列名）
+FIELD_ALIASES = {
+    "period_name": ("period_name", "期数"),
+    "nickname": ("nickname", "昵称"),
+    "focus_area": ("focus_area", "专注领域"),
+    "introduction": ("introduction", "自我介绍"),
+    "goals": ("goals", "本期目标", "目标"),
+    "signup_time": ("signup_time", "报名时间"),
+    "checkin_date": ("checkin_date", "打卡日期"),
+    "content": ("content", "打卡内容"),
+}
+
+
+def _cell_text(value: Any) -> str:
+    """多维表单元格可能是字符串、数字或文本片段列表"""
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        return "".join(v.get("text", "") if isinstance(v, dict) else str(v) for v in value)
+    if isinstance(value, dict):
+        return str(value.get("text", ""))
+    return str(value)
+
+
+def _parse_datetime(value: Any) -> Optional[datetime]:
+    """解析日期：字符串，或多维表日期字段的毫秒时间戳"""
+    if value in (None, ""):
+        return None
+    try:
+        if isinstance(value, (int, float)):
+            return datetime.fromtimestamp(value / 1000)
+        return date_parser.parse(_cell_text(value))
+    except (ValueError, OverflowError):
+        logger.warning(f"无法解析的日期: {value}")
+        return None
+
+
+def _normalize(raw: Dict[str, Any]) -> Dict[str, Any]:
+    record = {}
+    for field, aliases in FIELD_ALIASES.items():
+        for alias in aliases:
+            if alias in raw:
+                record[field] = raw[alias]
+                break
+    return record
+
+
+def read_records(path: str) -> Iterator[Dict[str, Any]]:
+    """逐行读取记录：.csv、.jsonl，或多维表记录接口导出的 .json（items[].fields）"""
+    if path.endswith(".csv"):
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            for row in csv.DictReader(f):
+                yield _normalize(row)
+    elif path.endswith((".jsonl", ".ndjson")):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield _normalize(json.loads(line))
+    elif path.endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            data = data.get("data", data).get("items", [])
+        for item in data:
+            yield _normalize(item.get("fields", item))
+    else:
+        raise ValueError(f"不支持的文件格式: {path}")
+
+
+class BulkImporter:
+    """批量导入：多行 INSERT、分块事务、内存中的 (期数, 昵称) -> 报名ID 映射、断点续传"""
+
+    def __init__(self, engine: Engine, default_period: str = None, batch_size: int = BATCH_SIZE,
+                 chunk_size: int = CHUNK_SIZE, checkpoint_path: str = DEFAULT_CHECKPOINT):
+        self.engine = engine
+        self.default_period = default_period
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.checkpoint_path = checkpoint_path
+        # 断点：每个文件已处理的行数，以及导入涉及的期数（续传时用于最后更新期数日期）
+        self.checkpoint: Dict[str, Any] = {"files": {}, "periods": []}
+        if os.path.exists(checkpoint_path):
+            with open(checkpoint_path, encoding="utf-8") as f:
+                self.checkpoint = json.load(f)
+        self.periods: Dict[str, int] = {}
+        self.loaded_periods = set()
+        self.touched_periods = set(self.checkpoint["periods"])
+        # (期数ID, 昵称) -> 报名ID
+        self.signups: Dict[Tuple[int, str], int] = {}
+        # 已存在的 (报名ID, 打卡日期)，用于跳过重复打卡
+        self.checkin_keys = set()
+        self.checkin_counts: Dict[int, int] = {}
+
+    def _save_checkpoint(self, key: str, rows: int) -> None:
+        self.checkpoint["files"][key] = rows
+        self.checkpoint["periods"] = sorted(self.touched_periods)
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.checkpoint, f, ensure_ascii=False)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _period_id(self, conn: Connection, name: str, first_date: Optional[datetime]) -> int:
+        """按名称查找期数，不存在时创建；首次遇到某期时一次性加载该期已有的报名和打卡"""
+        name = (name or self.default_period or "").strip()
+        if not name:
+            raise ValueError("记录缺少期数，请在文件中提供 period_name/期数 列或使用 --period")
+        period_id = self.periods.get(name)
+        if period_id is None:
+            period_id = conn.execute(select(Period.id).where(Period.period_name == name)).scalar()
+            if period_id is None:
+                first_date = first_date or datetime.now()
+                period_id = conn.execute(insert(Period).values(
+                    period_name=name, start_date=first_date, end_date=first_date, status="已结束"
+                )).inserted_primary_key[0]
+                logger.info(f"创建期数 {name}")
+            self.periods[name] = period_id
+        if period_id not in self.loaded_periods:
+            self._load_period(conn, period_id)
+        self.touched_periods.add(period_id)
+        return period_id
+
+    def _load_period(self, conn: Connection, period_id: int) -> None:
+        for signup_id, nickname in conn.execute(
+                select(Signup.id, Signup.nickname).where(Signup.period_id == period_id)):
+            self.signups[(period_id, nickname)] = signup_id
+        rows = conn.execute(
+            select(Checkin.signup_id, Checkin.checkin_date)
+            .join(Signup, Signup.id == Checkin.signup_id)
+            .where(Signup.period_id == period_id))
+        for signup_id, checkin_date in rows:
+            self.checkin_keys.add((signup_id, checkin_date))
+            self.checkin_counts[signup_id] = self.checkin_counts.get(signup_id, 0) + 1
+        self.loaded_periods.add(period_id)
+
+    def _flush_signups(self, conn: Connection, rows: List[Dict[str, Any]]) -> None:
+        """多行插入一批报名，再用一次查询取回这批报名的ID"""
+        if not rows:
+            return
+        # executemany：PyMySQL/aiomysql 会改写成多行 INSERT ... VALUES，SQLite 走原生 executemany
+        conn.execute(insert(Signup), rows)
+        by_period: Dict[int, List[str]] = {}
+        for row in rows:
+            by_period.setdefault(row["period_id"], []).append(row["nickname"])
+        for period_id, nicknames in by_period.items():
+            for signup_id, nickname in conn.execute(
+                    select(Signup.id, Signup.nickname)
+                    .where(Signup.period_id == period_id)
+                    .where(Signup.nickname.in_(nicknames))):
+                self.signups[(period_id, nickname)] = signup_id
+        rows.clear()
+
+    def _signup_row(self, conn: Connection, record: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        nickname = _cell_text(record.get("nickname")).strip()
+        if not nickname:
+            return None
+        signup_time = _parse_datetime(record.get("signup_time"))
+        period_id = self._period_id(conn, _cell_text(record.get("period_name")), signup_time)
+        if (period_id, nickname) in self.signups:
+            return None
+        # 先占位，同一批内的重复昵称直接跳过
+        self.signups[(period_id, nickname)] = None
+        return {
+            "period_id": period_id,
+            "nickname": nickname,
+            "focus_area": _cell_text(record.get("focus_area")).strip() or "未知",
+            "introduction": _cell_text(record.get("introduction")).strip(),
+            "goals": _cell_text(record.get("goals")).strip(),
+            "signup_time": signup_time or datetime.now(),
+        }
+
+    def _checkin_row(self, conn: Connection, record: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        nickname = _cell_text(record.get("nickname")).strip()
+        content = _cell_text(record.get("content")).strip()
+        checkin_at = _parse_datetime(record.get("checkin_date"))
+        if not nickname or not content or checkin_at is None:
+            return None
+        period_id = self._period_id(conn, _cell_text(record.get("period_name")), checkin_at)
+        signup_id = self.signups.get((period_id, nickname))
+        if signup_id is None:
+            # 只有打卡没有报名的历史数据：补一条最简报名记录
+            signup_id = conn.execute(insert(Signup).values(
+                period_id=period_id, nickname=nickname, focus_area="未知", signup_time=checkin_at
+            )).inserted_primary_key[0]
+            self.signups[(period_id, nickname)] = signup_id
+        checkin_date = checkin_at.date() if isinstance(checkin_at, datetime) else checkin_at
+        if (signup_id, checkin_date) in self.checkin_keys:
+            return None
+        self.checkin_keys.add((signup_id, checkin_date))
+        count = self.checkin_counts.get(signup_id, 0) + 1
+        self.checkin_counts[signup_id] = count
+        return {
+            "signup_id": signup_id,
+            "nickname": nickname,
+            "checkin_date": checkin_date,
+            "content": content,
+            "checkin_count": count,
+            "created_at": checkin_at,
+        }
+
+    def import_file(self, path: str, kind: str) -> Dict[str, Any]:
+        """导入一个文件（kind 为 signups 或 checkins），返回导入统计"""
+        key = f"{kind}:{os.path.abspath(path)}"
+        done = self.checkpoint["files"].get(key, 0)
+        if done:
+            logger.info(f"{path} 从断点继续，跳过前 {done} 行")
+        stats = {"file": path, "read": 0, "inserted": 0, "skipped": 0}
+        start = time.perf_counter()
+        records = read_records(path)
+        for _ in range(done):
+            next(records, None)
+
+        row_builder = self._signup_row if kind == "signups" else self._checkin_row
+        exhausted = False
+        while not exhausted:
+            with self.engine.begin() as conn:
+                pending: List[Dict[str, Any]] = []
+                in_chunk = 0
+                for record in records:
+                    in_chunk += 1
+                    row = row_builder(conn, record)
+                    if row is None:
+                        stats["skipped"] += 1
+                    else:
+                        pending.append(row)
+                    if len(pending) >= self.batch_size:
+                        stats["inserted"] += len(pending)
+                        self._write_batch(conn, kind, pending)
+                    if in_chunk >= self.chunk_size:
+                        break
+                else:
+                    exhausted = True
+                stats["inserted"] += len(pending)
+                self._write_batch(conn, kind, pending)
+            # 事务提交后再记录断点；两者之间中断时重复的行会在重跑时被跳过
+            done += in_chunk
+            stats["read"] += in_chunk
+            self._save_checkpoint(key, done)
+            elapsed = time.perf_counter() - start
+            logger.info(f"{path}: 已处理 {stats['read']} 行，写入 {stats['inserted']} 行，"
+                        f"{stats['read'] / elapsed if elapsed else 0:.0f} 行/秒")
+
+        stats["seconds"] = time.perf_counter() - start
+        return stats
+
+    def _write_batch(self, conn: Connection, kind: str, rows: List[Dict[str, Any]]) -> None:
+        if kind == "signups":
+            self._flush_signups(conn, rows)
+        elif rows:
+            conn.execute(insert(Checkin), rows)
+            rows.clear()
+
+    def finalize(self) -> None:
+        """按导入的打卡更新期数的起止日期"""
+        with self.engine.begin() as conn:
+            for period_id in self.touched_periods:
+                first, last = conn.execute(
+                    select(func.min(Checkin.checkin_date), func.max(Checkin.checkin_date))
+                    .join(Signup, Signup.id == Checkin.signup_id)
+                    .where(Signup.period_id == period_id)).one()
+                if first and last:
+                    conn.execute(Period.__table__.update()
+                                 .where(Period.id == period_id)
+                                 .values(start_date=_as_datetime(first), end_date=_as_datetime(last)))
+
+
+def _as_datetime(value) -> datetime:
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    return date_parser.parse(str(value))
+
+
+def main(argv: List[str] = None) -> None:
+    arg_parser = argparse.ArgumentParser(description="批量导入历史期数的报名和打卡记录")
+    arg_parser.add_argument("--signups", nargs="*", default=[], help="报名记录文件（.csv/.jsonl/.json）")
+    arg_parser.add_argument("--checkins", nargs="*", default=[], help="打卡记录文件（.csv/.jsonl/.json），按日期排序")
+    arg_parser.add_argument("--period", help="记录中没有期数列时使用的期数名称")
+    arg_parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="每条 INSERT 的行数")
+    arg_parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="每个事务处理的行数")
+    arg_parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT, help="断点文件")
+    arg_parser.add_argument("--reset", action="store_true", help="忽略已有断点，从头导入")
+    args = arg_parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.reset and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+
+    init_db()
+    importer = BulkImporter(engine, args.period, args.batch_size, args.chunk_size, args.checkpoint)
+    results = [importer.import_file(path, "signups") for path in args.signups]
+    results += [importer.import_file(path, "checkins") for path in args.checkins]
+    importer.finalize()
+
+    for stats in results:
+        rate = stats["read"] / stats["seconds"] if stats["seconds"] else 0
+        print(f"{stats['file']}: 读取 {stats['read']} 行，写入 {stats['inserted']} 行，"
+              f"跳过 {stats['skipped']} 行，耗时 {stats['seconds']:.1f}s，{rate:.0f} 行/秒")
+
+
+if __name__ == "__main__":
+    main()
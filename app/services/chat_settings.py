@@ -0,0 +1,58 @@
+import os
+import threading
+from typing import Dict, Optional, Tuple
+from dotenv import load_dotenv
+from sqlalchemy.orm import Session
+from app.models.database import ChatSetting
+
+load_dotenv()
+
+# 每日汇总模式下默认的发送时间（HH:MM）
+DIGEST_TIME = os.getenv("DIGEST_TIME", "21:30")
+
+FEEDBACK_INSTANT = "instant"
+FEEDBACK_DIGEST = "digest"
+
+DIGEST_COMMAND = "#打卡日报"
+
+
+class ChatSettingsCache:
+    """群设置的进程内缓存：每条打卡都要查反馈方式，设置只在命令修改时变化"""
+
+    def __init__(self):
+        # chat_id -> (反馈方式, 汇总时间)
+        self._entries: Dict[str, Tuple[str, str]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, db: Session, chat_id: str) -> Tuple[str, str]:
+        """返回群的 (反馈方式, 每日汇总时间)"""
+        with self._lock:
+            cached = self._entries.get(chat_id)
+        if cached is not None:
+            return cached
+        setting = db.get(ChatSetting, chat_id) if chat_id else None
+        if setting is None:
+            value = (FEEDBACK_INSTANT, DIGEST_TIME)
+        else:
+            value = (setting.feedback_mode, setting.digest_time or DIGEST_TIME)
+        with self._lock:
+            self._entries[chat_id] = value
+        return value
+
+    def set(self, db: Session, chat_id: str, feedback_mode: str, digest_time: Optional[str] = None) -> Tuple[str, str]:
+        """修改并提交群设置"""
+        setting = db.get(ChatSetting, chat_id)
+        if setting is None:
+            setting = ChatSetting(chat_id=chat_id)
+            db.add(setting)
+        setting.feedback_mode = feedback_mode
+        if digest_time:
+            setting.digest_time = digest_time
+        db.commit()
+        value = (setting.feedback_mode, setting.digest_time or DIGEST_TIME)
+        with self._lock:
+            self._entries[chat_id] = value
+        return value
+
+
+chat_settings = ChatSettingsCache()
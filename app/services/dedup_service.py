@@ -0,0 +1,167 @@
+import logging
+import os
+import random
+import struct
+import threading
+import zlib
+from collections import OrderedDict, defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+from dotenv import load_dotenv
+from sqlalchemy.orm import Session
+from app.models.database import Checkin
+
+try:
+    import numpy as np
+except ImportError:
+    # numpy 是数据分析的可选依赖，未安装时签名逐个计算，结果相同
+    np = None
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 估计的 Jaccard 相似度（字符二元组）不低于该值视为近似重复
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.7"))
+# 内存中最多保留多少个报名者的分段索引
+DEDUP_MAX_SIGNUPS = int(os.getenv("DEDUP_MAX_SIGNUPS", "5000"))
+
+NUM_PERM = 64
+# LSH 分段：16 段 × 4 行，相似度 0.7 时成为候选的概率约 99%
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 2
+
+_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_rng = random.Random(20240501)  # 固定种子，保证签名跨进程、跨重启一致
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+_PACK = struct.Struct(f"<{NUM_PERM}I")
+
+# 向量化计算用的参数：a、b 小于 2^61，与 32 位哈希相乘会超出 uint64，
+# 因此把 a 拆成高 30 位和低 31 位分别相乘，再利用 2^61 ≡ 1 (mod _PRIME) 做取模，结果与逐个计算完全一致
+if np is not None:
+    _A = np.array([a for a, _ in _PERMUTATIONS], dtype=np.uint64)[:, None]
+    _A_HI = _A >> np.uint64(31)
+    _A_LO = _A & np.uint64((1 << 31) - 1)
+    _B = np.array([b for _, b in _PERMUTATIONS], dtype=np.uint64)[:, None]
+    _P = np.uint64(_PRIME)
+
+
+def _shingles(content: str) -> set:
+    normalized = "".join(content.lower().split())
+    if len(normalized) <= SHINGLE_SIZE:
+        return {normalized}
+    return {normalized[i:i + SHINGLE_SIZE] for i in range(len(normalized) - SHINGLE_SIZE + 1)}
+
+
+def _mod_prime(values: "np.ndarray") -> "np.ndarray":
+    """对小于 2^63 的 uint64 数组取模 _PRIME（梅森素数 2^61-1）"""
+    values = (values & _P) + (values >> np.uint64(61))
+    return np.where(values >= _P, values - _P, values)
+
+
+def signature(content: str) -> Tuple[int, ...]:
+    """计算文本的 MinHash 签名（64 个 32 位整数），即每个排列下 min((a * h + b) % _PRIME) 的低 32 位"""
+    if np is None:
+        hashes = [zlib.crc32(s.encode("utf-8")) for s in _shingles(content)]
+        return tuple(min((a * h + b) % _PRIME for h in hashes) & _MAX_HASH for a, b in _PERMUTATIONS)
+    hashes = np.array([zlib.crc32(s.encode("utf-8")) for s in _shingles(content)], dtype=np.uint64)
+    high = _mod_prime(_A_HI * hashes)  # a 的高 30 位乘积，小于 2^62
+    # high * 2^31 = (high >> 30) * 2^61 + (high 的低 30 位) * 2^31，其中 2^61 取模后为 1
+    high = _mod_prime((high >> np.uint64(30)) + ((high & np.uint64((1 << 30) - 1)) << np.uint64(31)))
+    values = _mod_prime(high + _mod_prime(_A_LO * hashes) + _B)
+    return tuple(int(x) & _MAX_HASH for x in values.min(axis=1))
+
+
+def pack(sig: Tuple[int, ...]) -> bytes:
+    """签名压缩为 256 字节存入数据库"""
+    return _PACK.pack(*sig)
+
+
+def unpack(data: bytes) -> Tuple[int, ...]:
+    return _PACK.unpack(data)
+
+
+def similarity(a: Tuple[int, ...], b: Tuple[int, ...]) -> float:
+    """由签名估计 Jaccard 相似度"""
+    return sum(x == y for x, y in zip(a, b)) / NUM_PERM
+
+
+def band_keys(sig: Tuple[int, ...]) -> List[Tuple[int, Tuple[int, ...]]]:
+    return [(i, sig[i * ROWS:(i + 1) * ROWS]) for i in range(BANDS)]
+
+
+class LSHIndex:
+    """按报名者划分的 LSH 分段索引：(段号, 段内签名) -> [(打卡ID, 签名)]，按 LRU 淘汰整个报名者"""
+
+    def __init__(self, max_signups: int):
+        self.max_signups = max_signups
+        self._signups: "OrderedDict[int, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _load(self, db: Session, signup_id: int) -> Dict:
+        """从数据库加载某个报名者已有打卡的签名，缺失的签名顺便回填"""
+        table = defaultdict(list)
+        rows = db.query(Checkin.id, Checkin.minhash)\
+            .filter(Checkin.signup_id == signup_id)\
+            .all()
+        signatures = [(checkin_id, unpack(data)) for checkin_id, data in rows if data]
+        missing = [checkin_id for checkin_id, data in rows if not data]
+        if missing:
+            for checkin_id, content in db.query(Checkin.id, Checkin.content).filter(Checkin.id.in_(missing)):
+                sig = signature(content)
+                db.query(Checkin).filter(Checkin.id == checkin_id)\
+                    .update({Checkin.minhash: pack(sig)}, synchronize_session=False)
+                signatures.append((checkin_id, sig))
+            db.commit()
+            logger.info(f"回填打卡签名 - 报名ID: {signup_id}, {len(missing)} 条")
+        for checkin_id, sig in signatures:
+            for key in band_keys(sig):
+                table[key].append((checkin_id, sig))
+        return table
+
+    def _table(self, db: Session, signup_id: int) -> Dict:
+        with self._lock:
+            table = self._signups.get(signup_id)
+            if table is not None:
+                self._signups.move_to_end(signup_id)
+                return table
+        table = self._load(db, signup_id)
+        with self._lock:
+            self._signups[signup_id] = table
+            while len(self._signups) > self.max_signups:
+                self._signups.popitem(last=False)
+        return table
+
+    def find_similar(self, db: Session, signup_id: int, sig: Tuple[int, ...]) -> Optional[int]:
+        """查找该报名者此前与签名近似的打卡，返回相似度最高的打卡 ID"""
+        table = self._table(db, signup_id)
+        best = None
+        with self._lock:
+            candidates = {}
+            for key in band_keys(sig):
+                for checkin_id, other in table.get(key, ()):
+                    candidates[checkin_id] = other
+        for checkin_id, other in candidates.items():
+            score = similarity(sig, other)
+            if score >= DEDUP_THRESHOLD and (best is None or score > best[0]):
+                best = (score, checkin_id)
+        return best[1] if best else None
+
+    def forget(self, signup_ids: Iterable[int]) -> None:
+        """移除报名者的索引（期数归档后不会再有打卡）"""
+        with self._lock:
+            for signup_id in signup_ids:
+                self._signups.pop(signup_id, None)
+
+    def add(self, signup_id: int, checkin_id: int, sig: Tuple[int, ...]) -> None:
+        """新打卡写入后加入索引（该报名者未加载时跳过，下次使用时从数据库加载）"""
+        with self._lock:
+            table = self._signups.get(signup_id)
+            if table is None:
+                return
+            for key in band_keys(sig):
+                table.setdefault(key, []).append((checkin_id, sig))
+
+
+lsh_index = LSHIndex(DEDUP_MAX_SIGNUPS)
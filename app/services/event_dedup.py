@@ -0,0 +1,36 @@
+import os
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 最多记住的事件/消息 ID 数量，超出后淘汰最早的
+EVENT_DEDUP_MAX_ENTRIES = int(os.getenv("EVENT_DEDUP_MAX_ENTRIES", "10000"))
+
+
+class RecentEvents:
+    """最近处理过的事件 ID 和消息 ID，用于丢弃飞书的重复投递；数量有上限（LRU 淘汰），内存占用固定"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def seen(self, *keys: str) -> bool:
+        """记录这些 ID，返回其中是否有已经处理过的"""
+        keys = [key for key in keys if key]
+        with self._lock:
+            duplicate = any(key in self._entries for key in keys)
+            for key in keys:
+                self._entries[key] = None
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return duplicate
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+recent_events = RecentEvents(EVENT_DEDUP_MAX_ENTRIES)
@@ -1,17 +1,51 @@
+import asyncio
 import logging
 import re
 from typing import List, Dict, Any
 from urllib.parse import urlparse, parse_qs
-import requests
+import httpx
+import json
 import os
+import time
 from dotenv import load_dotenv
-from datetime import datetime
+from app.services.http_client import http_transport
+from app.services.signup_parser import parse_signup_records
 
 # 加载环境变量
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+FEISHU_API_BASE = "https://open.feishu.cn/open-apis"
+
+# 进程内共享的 tenant_access_token：app_id -> (token, 过期时间)
+_token_cache: Dict[str, tuple] = {}
+
+# 接龙链接解析出的多维表信息缓存多久（秒），期间结束报名只需请求记录分页
+BITABLE_META_TTL = float(os.getenv("BITABLE_META_TTL", "3600"))
+# 记录接口单页最大条数
+BITABLE_PAGE_SIZE = 500
+# 接龙链接 -> (过期时间, base_id, [table_id])
+_bitable_meta_cache: Dict[str, tuple] = {}
+
+
+# 令牌无效或过期时飞书返回的业务错误码（HTTP 状态可能是 200 或 400）
+_TOKEN_EXPIRED_CODES = {99991661, 99991663, 99991668}
+
+
+def _auth_expired(response: httpx.Response) -> bool:
+    """响应是否表示访问令牌失效"""
+    if response.status_code in [401, 403]:
+        return True
+    try:
+        return response.json().get("code") in _TOKEN_EXPIRED_CODES
+    except ValueError:
+        return False
+
+
+class _AuthExpired(Exception):
+    """并发读取表格时遇到令牌失效，由调用方刷新令牌后整体重试"""
+
 
 class FeishuService:
     def __init__(self):
@@ -22,10 +56,18 @@ class FeishuService:
                 "未找到飞书配置信息，请检查环境变量 FEISHU_APP_ID 和 FEISHU_APP_SECRET")
         self.access_token = None
 
+    def _ensure_token(self) -> str:
+        """每次请求前检查令牌是否过期：进程内只有一个 FeishuService，令牌有效期只有 2 小时"""
+        cached = _token_cache.get(self.app_id)
+        if cached and cached[1] > time.time():
+            self.access_token = cached[0]
+            return self.access_token
+        return self.get_access_token()
+
     def get_access_token(self) -> str:
         """获取飞书访问令牌"""
         try:
-            url = "https://open.feishu.cn/open-apis/auth/v3/tenant_access_token/internal"
+            url = f"{FEISHU_API_BASE}/auth/v3/tenant_access_token/internal"
             headers = {
                 "Content-Type": "application/json"
             }
@@ -33,12 +75,15 @@ class FeishuService:
                 "app_id": self.app_id,
                 "app_secret": self.app_secret
             }
-            response = requests.post(url, headers=headers, json=data)
+            response = http_transport.request_sync("POST", url, headers=headers, json=data)
             response.raise_for_status()
             result = response.json()
 
             if result.get("code") == 0:
                 self.access_token = result.get("tenant_access_token")
+                # 提前 5 分钟过期，避免临界时刻使用失效令牌
+                expires_at = time.time() + result.get("expire", 7200) - 300
+                _token_cache[self.app_id] = (self.access_token, expires_at)
                 return self.access_token
             else:
                 raise Exception(f"获取访问令牌失败: {result.get('msg')}")
@@ -47,209 +92,153 @@ class FeishuService:
             raise
 
     def extract_base_info(self, url: str) -> tuple:
-        """从URL中提取多维表的base_id和table_id"""
+        """从URL中提取多维表的 base_id 和 table_id 列表（table 参数可重复或用逗号分隔；没有时返回空列表）"""
+        parsed_url = urlparse(url)
+        path_parts = parsed_url.path.split('/')
+        query_params = parse_qs(parsed_url.query)
+
+        # 查找base_id（从路径中查找最后一个非空部分）
+        base_id = None
+        for part in reversed(path_parts):
+            if part and len(part) > 20:  # base_id 通常较长
+                base_id = part
+                break
+
+        if not base_id:
+            raise ValueError(f"未在URL中找到base_id: {url}")
+
+        # 从查询参数中获取table_id
+        table_ids = []
+        for value in query_params.get('table', []):
+            table_ids.extend(t.strip() for t in value.split(',') if t.strip())
+        if not table_ids:
+            # 如果URL中没有table参数，尝试从路径中查找
+            table_ids = [part for part in path_parts if part.startswith('tbl')]
+
+        return base_id, list(dict.fromkeys(table_ids))
+
+    def _resolve_tables(self, signup_link: str) -> tuple:
+        """解析接龙链接对应的 base_id 和表格列表，结果按链接缓存 BITABLE_META_TTL 秒"""
+        cached = _bitable_meta_cache.get(signup_link)
+        if cached and cached[0] > time.time():
+            return cached[1], cached[2]
+
+        base_id, table_ids = self.extract_base_info(signup_link)
+        if not table_ids:
+            # 链接中没有指定表格时取多维表中的第一个表格
+            url = f"{FEISHU_API_BASE}/bitable/v1/apps/{base_id}/tables"
+            response = self._get_with_auth(url)
+            result = response.json()
+            if result.get("code") != 0:
+                raise Exception(f"获取表格列表失败: {result.get('msg')}")
+            tables = result.get("data", {}).get("items", [])
+            if not tables:
+                raise Exception("多维表中没有找到任何表格")
+            table_ids = [tables[0]["table_id"]]
+
+        logger.info(f"接龙链接解析结果 - base_id: {base_id}, table_id: {', '.join(table_ids)}")
+        _bitable_meta_cache[signup_link] = (time.time() + BITABLE_META_TTL, base_id, table_ids)
+        return base_id, table_ids
+
+    def _get_with_auth(self, url: str, params: Dict[str, Any] = None) -> httpx.Response:
+        """GET 请求，令牌失效时刷新一次后重试"""
+        for attempt in range(2):
+            headers = {"Authorization": f"Bearer {self._ensure_token()}"}
+            response = http_transport.request_sync("GET", url, headers=headers, params=params)
+            if _auth_expired(response) and attempt == 0:
+                logger.info("检测到认证错误，尝试重新获取访问令牌")
+                self.get_access_token()
+                continue
+            return response
+        return response
+
+    async def _fetch_table_records(self, base_id: str, table_id: str) -> List[Dict[str, Any]]:
+        """按 page_token 翻页读取一个表格的全部记录"""
+        url = f"{FEISHU_API_BASE}/bitable/v1/apps/{base_id}/tables/{table_id}/records"
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+        records = []
+        page_token = None
+        while True:
+            params = {"page_size": BITABLE_PAGE_SIZE}
+            if page_token:
+                params["page_token"] = page_token
+            response = await http_transport.request("GET", url, headers=headers, params=params)
+            if _auth_expired(response):
+                raise _AuthExpired()
+            result = response.json()
+            if result.get("code") != 0:
+                raise Exception(f"获取表格 {table_id} 数据失败: {result.get('msg')}")
+            data = result.get("data") or {}
+            records.extend(data.get("items") or [])
+            page_token = data.get("page_token")
+            if not data.get("has_more") or not page_token:
+                return records
+
+    def _fetch_records(self, base_id: str, table_ids: List[str]) -> List[Dict[str, Any]]:
+        """并发读取多个表格的记录，按表格顺序合并"""
+        async def fetch_all():
+            pages = await asyncio.gather(*(self._fetch_table_records(base_id, t) for t in table_ids))
+            return [record for page in pages for record in page]
+
+        self._ensure_token()
         try:
-            logger.info(f"开始解析URL: {url}")
-            parsed_url = urlparse(url)
-            path_parts = parsed_url.path.split('/')
-            query_params = parse_qs(parsed_url.query)
-
-            # 查找base_id（从路径中查找最后一个非空部分）
-            base_id = None
-            for part in reversed(path_parts):
-                if part and len(part) > 20:  # base_id 通常较长
-                    base_id = part
-                    break
-
-            if not base_id:
-                raise ValueError("未在URL中找到base_id")
-
-            # 从查询参数中获取table_id
-            table_id = query_params.get('table', [None])[0]
-            if not table_id:
-                # 如果URL中没有table参数，尝试从路径中查找
-                for part in path_parts:
-                    if part.startswith('tbl'):
-                        table_id = part
-                        break
-                
-                # 如果仍然没有找到，使用默认值
-                if not table_id:
-                    table_id = 'tblzscrkKqRba5r6'  # 使用默认的table_id
-            
-            logger.info(f"从URL中提取到 base_id: {base_id}, table_id: {table_id}")
-            logger.info(f"URL解析结果 - 路径部分: {path_parts}")
-            logger.info(f"URL解析结果 - 查询参数: {query_params}")
-
-            return base_id, table_id
-        except Exception as e:
-            logger.error(f"解析URL时发生错误: {str(e)}")
-            logger.error(f"URL: {url}")
-            logger.error(f"解析后的URL对象: {parsed_url}")
-            raise
+            return http_transport.run_sync(fetch_all())
+        except _AuthExpired:
+            logger.info("检测到认证错误，尝试重新获取访问令牌")
+            self.get_access_token()
+            return http_transport.run_sync(fetch_all())
 
     def fetch_signup_data(self, signup_link: str) -> List[Dict[str, Any]]:
         """获取接龙数据"""
         try:
             logger.info(f"开始获取接龙数据，链接: {signup_link}")
 
-            if not self.access_token:
-                logger.info("获取新的访问令牌")
-                self.get_access_token()
-
-            logger.info(f"使用访问令牌: {self.access_token[:10]}...")
+            base_id, table_ids = self._resolve_tables(signup_link)
+            records = self._fetch_records(base_id, table_ids)
+            logger.info(f"获取到 {len(records)} 条记录（{len(table_ids)} 个表格）")
 
-            base_id, _ = self.extract_base_info(signup_link)
-            logger.info(f"提取到的 base_id: {base_id}")
+            signup_data = list(parse_signup_records(records))
+            logger.info(f"成功处理 {len(signup_data)} 条报名数据")
+            return signup_data
+        except Exception as e:
+            logger.error(f"获取接龙数据时发生错误: {str(e)}", exc_info=True)
+            raise
 
-            # 首先获取多维表的表格列表
-            list_url = f"https://open.feishu.cn/open-apis/bitable/v1/apps/{base_id}/tables"
+    def _post_message(self, url: str, body: Dict[str, Any], params: Dict[str, str] = None) -> bool:
+        """调用飞书消息接口，令牌失效时刷新一次后重试"""
+        for attempt in range(2):
             headers = {
-                "Authorization": f"Bearer {self.access_token}",
+                "Authorization": f"Bearer {self._ensure_token()}",
                 "Content-Type": "application/json"
             }
-            
-            logger.info(f"获取表格列表，URL: {list_url}")
-            list_response = requests.get(list_url, headers=headers)
-            list_result = list_response.json()
-            
-            if list_result.get("code") != 0:
-                error_msg = f"获取表格列表失败: {list_result.get('msg')} (错误码: {list_result.get('code')})"
-                logger.error(error_msg)
-                raise Exception(error_msg)
-            
-            tables = list_result.get("data", {}).get("items", [])
-            if not tables:
-                error_msg = "未找到任何表格"
-                logger.error(error_msg)
-                raise Exception(error_msg)
-            
-            # 使用第一个表格的ID
-            table_id = tables[0].get("table_id")
-            logger.info(f"使用第一个表格的ID: {table_id}")
-
-            # 构建API URL
-            url = f"https://open.feishu.cn/open-apis/bitable/v1/apps/{base_id}/tables/{table_id}/records"
-            params = {"page_size": 100}
-
-            logger.info(f"准备请求URL: {url}")
-            logger.info(f"请求参数: {params}")
+            response = http_transport.request_sync("POST", url, headers=headers, params=params, json=body)
+            if _auth_expired(response) and attempt == 0:
+                logger.info("检测到认证错误，尝试重新获取访问令牌")
+                self.get_access_token()
+                continue
 
             try:
-                response = requests.get(url, headers=headers, params=params)
-                logger.info(f"API响应状态码: {response.status_code}")
-                response_text = response.text
-                logger.info(f"API响应内容: {response_text[:500]}...")
-
-                if not response.ok:
-                    logger.error(f"API请求失败: 状态码 {response.status_code}")
-                    logger.error(f"错误响应: {response_text}")
-                    if response.status_code in [401, 403]:
-                        logger.info("检测到认证错误，尝试重新获取访问令牌")
-                        self.access_token = None
-                        self.get_access_token()
-                        headers["Authorization"] = f"Bearer {self.access_token}"
-                        response = requests.get(url, headers=headers, params=params)
-                        logger.info(f"重试请求状态码: {response.status_code}")
-                        response_text = response.text
-
                 result = response.json()
-            except requests.exceptions.RequestException as e:
-                logger.error(f"发送请求时发生错误: {str(e)}")
-                raise
-            except ValueError as e:
-                logger.error(f"解析JSON响应时发生错误: {str(e)}")
-                logger.error(f"原始响应内容: {response_text}")
-                raise
-
-            if result.get("code") == 0:
-                records = result.get("data", {}).get("items", [])
-                logger.info(f"获取到 {len(records)} 条记录")
-
-                signup_data = []
-                
-                for record in records:
-                    fields = record.get("fields", {})
-                    signup_info = fields.get("接龙信息", "").strip()
-                    logger.info(f"处理接龙信息: {signup_info}")
-
-                    if not signup_info:
-                        continue
-
-                    # 将接龙信息按行分割
-                    lines = signup_info.split("\n")
-                    if not lines:
-                        continue
-
-                    current_signup = None
-                    for line in lines:
-                        line = line.strip()
-                        if not line:
-                            continue
-
-                        if "-" in line:  # 这是昵称行
-                            # 如果有之前的报名记录，保存它
-                            if current_signup and current_signup["nickname"]:
-                                signup_data.append(current_signup)
-                                current_signup = None
-
-                            # 解析昵称和专注领域
-                            parts = line.split("-")
-                            if len(parts) >= 3:
-                                nickname = parts[0].strip()
-                                # 专注领域在最后一部分
-                                focus_area = parts[-1].strip()
-                                if nickname:
-                                    current_signup = {
-                                        "nickname": nickname,
-                                        "focus_area": focus_area,
-                                        "introduction": "",
-                                        "goals": "",
-                                        "signup_time": datetime.now()
-                                    }
-                                    logger.info(f"创建新的报名记录 - 昵称: {nickname}, 专注领域: {focus_area}")
-                            else:
-                                logger.warning(f"昵称格式不正确: {line}")
-                                nickname = line
-                                focus_area = "未知"
-                                if nickname:
-                                    current_signup = {
-                                        "nickname": nickname,
-                                        "focus_area": focus_area,
-                                        "introduction": "",
-                                        "goals": "",
-                                        "signup_time": datetime.now()
-                                    }
-                                    logger.info(f"创建新的报名记录（格式不正确） - 昵称: {nickname}, 专注领域: {focus_area}")
-                        elif current_signup:
-                            # 处理自我介绍和目标
-                            if "自我介绍：" in line:
-                                current_signup["introduction"] = line.split("自我介绍：")[1].strip()
-                                logger.info(f"添加自我介绍 - 昵称: {current_signup['nickname']}")
-                            elif "本期目标：" in line:
-                                current_signup["goals"] = line.split("本期目标：")[1].strip()
-                                logger.info(f"添加目标 - 昵称: {current_signup['nickname']}")
-
-                    # 添加最后一个报名记录
-                    if current_signup and current_signup["nickname"]:
-                        signup_data.append(current_signup)
-                        logger.info(f"添加最后一条报名记录 - 昵称: {current_signup['nickname']}, 专注领域: {current_signup['focus_area']}")
-
-                logger.info("=== 数据处理结果 ===")
-                for idx, data in enumerate(signup_data, 1):
-                    logger.info(f"处理后的记录 {idx}:")
-                    logger.info(f"昵称: {data['nickname']}")
-                    logger.info(f"专注领域: {data['focus_area']}")
-                    logger.info(f"简介: {data['introduction']}")
-                    logger.info(f"目标: {data['goals']}")
-                    logger.info("---")
-
-                logger.info(f"成功处理 {len(signup_data)} 条报名数据")
-                return signup_data
-            else:
-                error_msg = f"获取数据失败: {result.get('msg')} (错误码: {result.get('code')})"
-                logger.error(error_msg)
-                raise Exception(error_msg)
-        except Exception as e:
-            logger.error(f"获取接龙数据时发生错误: {str(e)}", exc_info=True)
-            raise
+            except ValueError:
+                result = {"code": response.status_code, "msg": response.text[:200]}
+            if result.get("code") != 0:
+                logger.error(
+                    f"发送消息失败: {result.get('msg')}, log_id: {response.headers.get('X-Tt-Logid')}")
+                return False
+            return True
+        return False
+
+    def send_message(self, chat_id: str, text: str) -> bool:
+        """向会话发送文本消息"""
+        return self._post_message(
+            f"{FEISHU_API_BASE}/im/v1/messages",
+            {"receive_id": chat_id, "msg_type": "text", "content": json.dumps({"text": text})},
+            params={"receive_id_type": "chat_id"}
+        )
+
+    def reply_message(self, message_id: str, text: str) -> bool:
+        """回复指定消息"""
+        return self._post_message(
+            f"{FEISHU_API_BASE}/im/v1/messages/{message_id}/reply",
+            {"msg_type": "text", "content": json.dumps({"text": text})}
+        )
@@ -0,0 +1,144 @@
+import logging
+import math
+import os
+import re
+from typing import List, Tuple
+from dotenv import load_dotenv
+from sqlalchemy.orm import Session, undefer
+from app.models.database import Signup, Checkin
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 原文保留最近的打卡条数
+HISTORY_RECENT_K = int(os.getenv("HISTORY_RECENT_K", "5"))
+# 历史部分（摘要 + 最近打卡）在提示词中的 token 预算
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "800"))
+# 滚动摘要自身的 token 上限，超出时合并相邻条目而不是丢弃最早的打卡
+HISTORY_SUMMARY_TOKEN_BUDGET = int(os.getenv("HISTORY_SUMMARY_TOKEN_BUDGET", "300"))
+# 摘要中每一行（一次或合并后的一段打卡）保留的字数
+HISTORY_SNIPPET_CHARS = int(os.getenv("HISTORY_SNIPPET_CHARS", "40"))
+
+# 摘要行格式：第3次：… 或 合并后的 第1-4次：…
+_SUMMARY_LINE = re.compile(r"^第(\d+)(?:-(\d+))?次：(.*)$")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的 token 数（中文约 0.6 token/字，其他字符约 0.3 token/字）"""
+    if not text:
+        return 0
+    cjk = sum(1 for ch in text if '一' <= ch <= '鿿')
+    return math.ceil(cjk * 0.6 + (len(text) - cjk) * 0.3)
+
+
+def _snippet(index: int, content: str) -> str:
+    """把一次打卡压缩成摘要中的一行"""
+    content = " ".join(content.split())
+    if len(content) > HISTORY_SNIPPET_CHARS:
+        content = content[:HISTORY_SNIPPET_CHARS] + "…"
+    return f"第{index}次：{content}"
+
+
+def _fit_lines(lines: List[str], budget: int) -> List[str]:
+    """从最新的一行往前保留，直到用完预算"""
+    kept = []
+    used = 0
+    for line in reversed(lines):
+        cost = estimate_tokens(line) + 1
+        if used + cost > budget:
+            break
+        kept.append(line)
+        used += cost
+    kept.reverse()
+    return kept
+
+
+def _parse_line(line: str) -> Tuple[int, int, str]:
+    """摘要行 -> (起始次数, 结束次数, 内容)；无法识别的行按覆盖 0 次处理，优先被合并"""
+    match = _SUMMARY_LINE.match(line)
+    if not match:
+        return 0, 0, line
+    first = int(match.group(1))
+    return first, int(match.group(2) or first), match.group(3)
+
+
+def _merge_lines(older: str, newer: str) -> str:
+    """把相邻两行合并为一行：覆盖两者的次数范围，各取一半字数"""
+    first, _, older_text = _parse_line(older)
+    _, last, newer_text = _parse_line(newer)
+    half = max(HISTORY_SNIPPET_CHARS // 2, 1)
+    parts = []
+    for text in (older_text, newer_text):
+        parts.append(text if len(text) <= half else text[:half] + "…")
+    span = f"{first}-{last}" if last > first else f"{last}"
+    return f"第{span}次：{'；'.join(parts)}"
+
+
+def _condense(lines: List[str], budget: int) -> List[str]:
+    """摘要超出预算时反复合并覆盖次数最少的相邻两行（相同时合并较早的），
+    早期打卡保留为更粗粒度的条目而不是被丢弃，各时段的粒度大致均衡"""
+    lines = list(lines)
+    while len(lines) > 1 and estimate_tokens("\n".join(lines)) + len(lines) > budget:
+        spans = [last - first + 1 for first, last, _ in map(_parse_line, lines)]
+        i = min(range(len(lines) - 1), key=lambda k: spans[k] + spans[k + 1])
+        lines[i:i + 2] = [_merge_lines(lines[i], lines[i + 1])]
+    if lines and estimate_tokens(lines[0]) + 1 > budget:
+        # 只剩一行仍超出预算（预算极小），退化为截断
+        return _fit_lines(lines, budget)
+    return lines
+
+
+def _fold_into_summary(signup: Signup, checkins: List[Checkin]) -> None:
+    """把移出最近窗口的打卡增量并入 Signup 上的滚动摘要；超出预算时合并相邻条目压缩，覆盖全部早期打卡"""
+    start = signup.summarized_count or 0
+    lines = signup.history_summary.split("\n") if signup.history_summary else []
+    lines.extend(_snippet(start + i, c.content) for i, c in enumerate(checkins, 1))
+    signup.history_summary = "\n".join(_condense(lines, HISTORY_SUMMARY_TOKEN_BUDGET))
+    signup.summarized_count = start + len(checkins)
+
+
+def build_history(db: Session, signup_id: int) -> str:
+    """构建提示词中的历史打卡部分：早期打卡的摘要 + 最近 K 次打卡原文，总长度受 token 预算约束"""
+    # 报名记录可能已在会话中（未加载摘要列），populate_existing 让 undefer 对已有对象同样生效，一次查询取齐
+    signup = db.get(Signup, signup_id, options=[undefer(Signup.history_summary)], populate_existing=True)
+    if not signup:
+        return ""
+
+    summarized = signup.summarized_count or 0
+    # 只读取尚未并入摘要的打卡，最后一条为本次打卡，不计入历史
+    checkins = db.query(Checkin)\
+        .options(undefer(Checkin.content))\
+        .filter(Checkin.signup_id == signup_id)\
+        .order_by(Checkin.checkin_date, Checkin.id)\
+        .offset(summarized)\
+        .all()[:-1]
+
+    overflow = len(checkins) - HISTORY_RECENT_K
+    if overflow > 0:
+        try:
+            _fold_into_summary(signup, checkins[:overflow])
+            db.commit()
+            logger.info(f"更新历史摘要 - 报名ID: {signup_id}, 已摘要 {signup.summarized_count} 次打卡")
+        except Exception as e:
+            logger.error(f"更新历史摘要失败: {str(e)}")
+            db.rollback()
+            return ""
+        checkins = checkins[overflow:]
+        summarized = signup.summarized_count
+
+    recent_lines = [
+        f"第{summarized + i}次打卡内容：{checkin.content}"
+        for i, checkin in enumerate(checkins, 1)
+    ]
+    recent_lines = _fit_lines(recent_lines, HISTORY_TOKEN_BUDGET)
+    remaining = HISTORY_TOKEN_BUDGET - estimate_tokens("\n".join(recent_lines))
+
+    parts = []
+    if signup.history_summary and remaining > 0:
+        summary_lines = _condense(signup.history_summary.split("\n"), remaining)
+        if summary_lines:
+            parts.append("（早期打卡摘要）")
+            parts.extend(summary_lines)
+    parts.extend(recent_lines)
+    return "\n".join(parts)
@@ -0,0 +1,203 @@
+import asyncio
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Any, Callable, Coroutine, Dict, Tuple
+from urllib.parse import urlparse
+from urllib.request import getproxies
+import httpcore
+import httpx
+from dotenv import load_dotenv
+from sqlalchemy.util import await_only
+from sqlalchemy.util.concurrency import in_greenlet
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 所有出站请求（DeepSeek、飞书 OpenAPI）的连接与并发配置都集中在这里
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_MAX_CONCURRENCY = int(os.getenv("HTTP_MAX_CONCURRENCY", "16"))
+HTTP_CONNECT_RETRIES = int(os.getenv("HTTP_CONNECT_RETRIES", "1"))
+HTTP_DNS_TTL = float(os.getenv("HTTP_DNS_TTL", "300"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() == "true"
+
+try:
+    import h2  # noqa: F401
+except ImportError:
+    if HTTP2_ENABLED:
+        logger.warning("未安装 h2，出站请求回退到 HTTP/1.1")
+    HTTP2_ENABLED = False
+
+
+class CachingDNSBackend(httpcore.AsyncNetworkBackend):
+    """在 httpcore 网络后端外加一层 DNS 缓存，避免每次建连都重新解析域名"""
+
+    def __init__(self, backend: httpcore.AsyncNetworkBackend, ttl: float):
+        self._backend = backend
+        self._ttl = ttl
+        self._cache: Dict[Tuple[str, int], Tuple[float, str]] = {}
+
+    async def _resolve(self, host: str, port: int) -> str:
+        cached = self._cache.get((host, port))
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        loop = asyncio.get_running_loop()
+        infos = await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        address = infos[0][4][0]
+        self._cache[(host, port)] = (time.monotonic() + self._ttl, address)
+        return address
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        # TLS 的 SNI 使用请求中的域名，这里只替换实际连接的地址
+        address = await self._resolve(host, port)
+        try:
+            return await self._backend.connect_tcp(
+                address, port, timeout=timeout,
+                local_address=local_address, socket_options=socket_options)
+        except Exception:
+            self._cache.pop((host, port), None)
+            raise
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return await self._backend.connect_unix_socket(
+            path, timeout=timeout, socket_options=socket_options)
+
+    async def sleep(self, seconds: float) -> None:
+        await self._backend.sleep(seconds)
+
+
+class HttpTransport:
+    """共享的异步 HTTP 传输层：一个后台事件循环 + 一个 httpx.AsyncClient（HTTP/2、连接池、DNS 缓存、并发上限）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._client = None
+        self._semaphore = None
+        self._stats: Dict[str, Dict[str, Any]] = {}
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """后台事件循环，首次使用时启动"""
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever, name="http-transport", daemon=True)
+                self._thread.start()
+            return self._loop
+
+    def _build_client(self) -> httpx.AsyncClient:
+        limits = httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+        )
+        if any(key in ("http", "https", "all") for key in getproxies()):
+            # 显式传入 transport 时 httpx 不再读取 HTTP_PROXY/HTTPS_PROXY/NO_PROXY，
+            # 配置了代理时交给 httpx 按环境变量建立代理连接（不使用 DNS 缓存和建连重试）
+            logger.info(f"检测到代理环境变量，出站 HTTP 客户端使用代理 - HTTP/2: {HTTP2_ENABLED}")
+            return httpx.AsyncClient(
+                limits=limits, timeout=HTTP_TIMEOUT, http2=HTTP2_ENABLED, trust_env=True)
+
+        transport = httpx.AsyncHTTPTransport(
+            http2=HTTP2_ENABLED, limits=limits, retries=HTTP_CONNECT_RETRIES)
+        # httpx 没有暴露 network_backend 参数，直接替换连接池的网络后端以加入 DNS 缓存；
+        # 这是 httpcore 的私有属性（版本在 requirements.txt 中固定），取不到时不启用 DNS 缓存
+        pool = getattr(transport, "_pool", None)
+        backend = getattr(pool, "_network_backend", None)
+        if isinstance(backend, httpcore.AsyncNetworkBackend):
+            pool._network_backend = CachingDNSBackend(backend, HTTP_DNS_TTL)
+        else:
+            logger.warning("当前 httpcore 版本无法替换网络后端，出站请求不使用 DNS 缓存")
+        logger.info(f"初始化出站 HTTP 客户端 - HTTP/2: {HTTP2_ENABLED}, 最大连接数: {HTTP_MAX_CONNECTIONS}, 最大并发: {HTTP_MAX_CONCURRENCY}")
+        return httpx.AsyncClient(
+            transport=transport, timeout=HTTP_TIMEOUT, http2=HTTP2_ENABLED)
+
+    def _record(self, host: str, elapsed: float, response: httpx.Response = None) -> None:
+        stats = self._stats.setdefault(
+            host, {"requests": 0, "errors": 0, "total_seconds": 0.0, "http_versions": {}})
+        stats["requests"] += 1
+        stats["total_seconds"] += elapsed
+        if response is None or response.status_code >= 500:
+            stats["errors"] += 1
+        if response is not None:
+            versions = stats["http_versions"]
+            versions[response.http_version] = versions.get(response.http_version, 0) + 1
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """在共享事件循环中发送请求"""
+        if self._client is None:
+            self._client = self._build_client()
+            self._semaphore = asyncio.Semaphore(HTTP_MAX_CONCURRENCY)
+        host = urlparse(url).netloc
+        async with self._semaphore:
+            start = time.perf_counter()
+            response = None
+            try:
+                response = await self._client.request(method, url, **kwargs)
+                return response
+            finally:
+                self._record(host, time.perf_counter() - start, response)
+
+    def in_async_handler(self) -> bool:
+        """当前是否运行在共享事件循环上的异步处理链路中（AsyncSession.run_sync 等 SQLAlchemy greenlet 内）"""
+        return self._thread is not None and threading.current_thread() is self._thread and in_greenlet()
+
+    def run_sync(self, coro: Coroutine) -> Any:
+        """供同步代码调用：在共享事件循环中执行协程并等待结果"""
+        loop = self.loop
+        if threading.current_thread() is self._thread:
+            if in_greenlet():
+                # 异步处理链路中的同步代码：挂起当前 greenlet，事件循环继续处理其他事件
+                return await_only(coro)
+            coro.close()
+            raise RuntimeError("不能在传输层事件循环内部同步等待，请直接 await")
+        return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+    def request_sync(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """供同步代码调用：把请求提交到后台事件循环并等待结果"""
+        return self.run_sync(self.request(method, url, **kwargs))
+
+    def sleep(self, seconds: float) -> None:
+        """重试等待：异步处理链路中让出事件循环，否则阻塞当前线程"""
+        if self.in_async_handler():
+            await_only(asyncio.sleep(seconds))
+        else:
+            time.sleep(seconds)
+
+    def run_blocking(self, fn: Callable[..., Any], *args) -> Any:
+        """执行 CPU 密集或阻塞的函数：异步处理链路中放到线程池执行，避免阻塞事件循环"""
+        if self.in_async_handler():
+            return await_only(asyncio.get_running_loop().run_in_executor(None, fn, *args))
+        return fn(*args)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """按目标主机统计的请求数、错误数、耗时和 HTTP 版本"""
+        return {host: dict(s, http_versions=dict(s["http_versions"])) for host, s in self._stats.items()}
+
+    def close(self) -> None:
+        """关闭连接池并停止后台事件循环"""
+        with self._lock:
+            loop = self._loop
+        if loop is None:
+            return
+        if self._client is not None:
+            asyncio.run_coroutine_threadsafe(self._client.aclose(), loop).result(timeout=10)
+            self._client = None
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join(timeout=10)
+        loop.close()
+        with self._lock:
+            self._loop = None
+            self._thread = None
+
+
+http_transport = HttpTransport()
@@ -0,0 +1,69 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+from dotenv import load_dotenv
+from sqlalchemy.orm import Session
+from app.models.database import Signup
+
+load_dotenv()
+
+# 内存中最多缓存多少个 (期数, open_id) -> 报名ID 的绑定
+IDENTITY_MAX_ENTRIES = int(os.getenv("IDENTITY_MAX_ENTRIES", "10000"))
+
+
+class SenderIndex:
+    """发送者身份索引：(期数ID, open_id) -> 报名ID，未命中时按 signups.period_open_id 索引查询"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[int, str], int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, db: Session, period_id: int, open_id: str) -> Optional[int]:
+        """查找发送者在该期绑定的报名ID"""
+        if not open_id:
+            return None
+        key = (period_id, open_id)
+        with self._lock:
+            signup_id = self._entries.get(key)
+            if signup_id is not None:
+                self._entries.move_to_end(key)
+                return signup_id
+        signup_id = db.query(Signup.id)\
+            .filter(Signup.period_id == period_id)\
+            .filter(Signup.open_id == open_id)\
+            .scalar()
+        if signup_id is not None:
+            self.bind(period_id, open_id, signup_id)
+        return signup_id
+
+    def bind(self, period_id: int, open_id: str, signup_id: int) -> None:
+        with self._lock:
+            self._entries[(period_id, open_id)] = signup_id
+            self._entries.move_to_end((period_id, open_id))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def forget_period(self, period_id: int) -> None:
+        """移除某期的全部绑定（期数归档后报名行已删除）"""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == period_id]:
+                del self._entries[key]
+
+
+def match_nickname(candidates: List[Tuple[int, str]], text: str) -> Optional[Tuple[int, str, str]]:
+    """在报名昵称中找出 text 开头的那个（最长匹配，昵称可以包含空格和 emoji），返回 (报名ID, 昵称, 剩余内容)"""
+    best = None
+    for signup_id, nickname in candidates:
+        if not nickname or not text.startswith(nickname):
+            continue
+        rest = text[len(nickname):]
+        if rest and not rest[0].isspace():
+            continue
+        if best is None or len(nickname) > len(best[1]):
+            best = (signup_id, nickname, rest.strip())
+    return best
+
+
+sender_index = SenderIndex(IDENTITY_MAX_ENTRIES)
@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+from typing import Awaitable, Callable, Dict
+from dotenv import load_dotenv
+from .http_client import http_transport
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 延迟敏感通道：打卡、搜索、创建期数等快速命令
+LANE_FAST = "fast"
+# 吞吐通道：期数流转、报告等耗时任务
+LANE_BULK = "bulk"
+
+LANE_FAST_WORKERS = int(os.getenv("LANE_FAST_WORKERS", "8"))
+LANE_BULK_WORKERS = int(os.getenv("LANE_BULK_WORKERS", "1"))
+# 异步处理时每个通道在共享事件循环上的并发上限（不再占用线程）
+LANE_FAST_ASYNC_LIMIT = int(os.getenv("LANE_FAST_ASYNC_LIMIT", "64"))
+LANE_BULK_ASYNC_LIMIT = int(os.getenv("LANE_BULK_ASYNC_LIMIT", str(LANE_BULK_WORKERS)))
+
+# 进入吞吐通道的命令
+BULK_COMMANDS = ('#接龙结束', '#活动结束', '#统计')
+
+# 长任务的进度汇报间隔
+PROGRESS_INTERVAL_SECONDS = float(os.getenv("PROGRESS_INTERVAL_SECONDS", "30"))
+
+
+def classify(message_type: str, message_content: str) -> str:
+    """根据消息内容选择执行通道"""
+    if message_type == "text" and message_content.strip() in BULK_COMMANDS:
+        return LANE_BULK
+    return LANE_FAST
+
+
+class JobLanes:
+    """按优先级划分的执行通道，每个通道有独立的线程池和并发上限，长任务不会阻塞快速命令"""
+
+    def __init__(self):
+        self._executors: Dict[str, ThreadPoolExecutor] = {
+            LANE_FAST: ThreadPoolExecutor(max_workers=LANE_FAST_WORKERS, thread_name_prefix="lane-fast"),
+            LANE_BULK: ThreadPoolExecutor(max_workers=LANE_BULK_WORKERS, thread_name_prefix="lane-bulk"),
+        }
+        self._async_limits = {LANE_FAST: LANE_FAST_ASYNC_LIMIT, LANE_BULK: LANE_BULK_ASYNC_LIMIT}
+        # 在共享事件循环中首次使用时创建
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        # 已提交但尚未完成的任务（含排队中的），停机时据此等待
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        # 停机开始后置位，长任务在安全的位置检查并提前结束
+        self.stopping = threading.Event()
+
+    def submit(self, lane: str, fn: Callable, *args, **kwargs) -> Future:
+        """把任务提交到指定通道"""
+        submitted_at = time.perf_counter()
+
+        def run():
+            waited = (time.perf_counter() - submitted_at) * 1000
+            if waited > 1000:
+                logger.warning(f"{lane} 通道任务排队 {waited:.0f}ms")
+            return fn(*args, **kwargs)
+
+        return self._track(self._executors[lane].submit(run))
+
+    def submit_async(self, lane: str, fn: Callable[..., Awaitable], *args) -> Future:
+        """把协程提交到共享事件循环，按通道限制并发，不占用线程"""
+        submitted_at = time.perf_counter()
+
+        async def run():
+            semaphore = self._semaphores.get(lane)
+            if semaphore is None:
+                semaphore = self._semaphores[lane] = asyncio.Semaphore(self._async_limits[lane])
+            async with semaphore:
+                waited = (time.perf_counter() - submitted_at) * 1000
+                if waited > 1000:
+                    logger.warning(f"{lane} 通道任务排队 {waited:.0f}ms")
+                return await fn(*args)
+
+        return self._track(asyncio.run_coroutine_threadsafe(run(), http_transport.loop))
+
+    def _track(self, future: Future) -> Future:
+        with self._pending_lock:
+            self._pending.add(future)
+        future.add_done_callback(self._discard)
+        return future
+
+    def _discard(self, future: Future) -> None:
+        with self._pending_lock:
+            self._pending.discard(future)
+
+    def pending(self) -> int:
+        with self._pending_lock:
+            return len(self._pending)
+
+    def drain(self, timeout: float) -> bool:
+        """停止接收新任务，等待已提交的任务（包括排队中的）在期限内执行完，返回是否全部完成"""
+        self.stopping.set()
+        for executor in self._executors.values():
+            executor.shutdown(wait=False)
+        with self._pending_lock:
+            pending = set(self._pending)
+        if pending:
+            logger.info(f"等待 {len(pending)} 个进行中的任务完成（最长 {timeout:.0f}s）")
+        _, not_done = wait(pending, timeout=timeout)
+        if not_done:
+            logger.error(f"停机期限已到，仍有 {len(not_done)} 个任务未完成")
+            return False
+        return True
+
+
+class ProgressReporter:
+    """长任务进度汇报，按时间间隔节流，避免刷屏"""
+
+    def __init__(self, notify: Callable[[str], None], interval: float = PROGRESS_INTERVAL_SECONDS):
+        self.notify = notify
+        self.interval = interval
+        self._last_report = time.monotonic()
+
+    def report(self, message: str, force: bool = False) -> None:
+        if not self.notify:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_report < self.interval:
+            return
+        self._last_report = now
+        try:
+            self.notify(message)
+        except Exception as e:
+            logger.error(f"发送进度消息失败: {str(e)}")
+
+
+job_lanes = JobLanes()
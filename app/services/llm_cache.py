@@ -0,0 +1,178 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "86400"))  # 秒
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1024"))
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", "")  # 为空时只使用内存缓存
+# 磁盘缓存最多保留的文件数，清理时超出部分按写入时间从旧到新删除
+LLM_CACHE_MAX_FILES = int(os.getenv("LLM_CACHE_MAX_FILES", "10000"))
+# 磁盘缓存清理间隔（秒），启动时先清理一次
+LLM_CACHE_SWEEP_INTERVAL = int(os.getenv("LLM_CACHE_SWEEP_INTERVAL", "3600"))
+# 普通打卡反馈与活动结束总结分别开关
+LLM_CACHE_FEEDBACK = os.getenv("LLM_CACHE_FEEDBACK", "false").lower() == "true"
+LLM_CACHE_FINAL = os.getenv("LLM_CACHE_FINAL", "true").lower() == "true"
+
+
+class LLMResponseCache:
+    """按 (模型, 系统提示词, 用户提示词, temperature) 的哈希缓存大模型回复，内存 LRU + 可选磁盘两级"""
+
+    def __init__(self, max_entries: int = 1024, ttl: int = 86400, cache_dir: str = "",
+                 max_files: int = 10000, sweep_interval: int = 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.cache_dir = cache_dir
+        self.max_files = max_files
+        self.sweep_interval = sweep_interval
+        self._sweeper = None
+        self._memory = OrderedDict()  # key -> (写入时间, 回复)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(model: str, system_prompt: str, user_prompt: str, temperature: float) -> str:
+        """生成内容寻址的缓存键"""
+        payload = json.dumps(
+            [model, system_prompt, user_prompt, temperature], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _expired(self, created_at: float) -> bool:
+        return self.ttl > 0 and time.time() - created_at > self.ttl
+
+    def get(self, key: str) -> Optional[str]:
+        """读取缓存，未命中或已过期时返回 None"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry:
+                if not self._expired(entry[0]):
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._memory[key]
+
+        if self.cache_dir:
+            try:
+                with open(self._disk_path(key), encoding="utf-8") as f:
+                    entry = json.load(f)
+                if not self._expired(entry["created_at"]):
+                    with self._lock:
+                        self._remember(key, entry["created_at"], entry["value"])
+                        self.hits += 1
+                        self.disk_hits += 1
+                    return entry["value"]
+                os.remove(self._disk_path(key))
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.warning(f"读取磁盘缓存失败: {str(e)}")
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key: str, value: str) -> None:
+        """写入缓存"""
+        created_at = time.time()
+        with self._lock:
+            self._remember(key, created_at, value)
+
+        if self.cache_dir:
+            path = self._disk_path(key)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump({"created_at": created_at, "value": value}, f, ensure_ascii=False)
+                os.replace(tmp_path, path)
+            except Exception as e:
+                logger.warning(f"写入磁盘缓存失败: {str(e)}")
+
+    def _remember(self, key: str, created_at: float, value: str) -> None:
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def sweep(self) -> int:
+        """清理磁盘缓存：删除过期文件和残留的临时文件，文件数仍超过上限时删除最旧的，返回删除的文件数"""
+        if not self.cache_dir:
+            return 0
+        now = time.time()
+        files = []
+        removed = 0
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    # 缓存文件只写入一次，修改时间即写入时间，不必逐个读取内容
+                    mtime = os.path.getmtime(path)
+                    if self._expired(mtime) or (name.endswith(".tmp") and now - mtime > 3600):
+                        os.remove(path)
+                        removed += 1
+                    elif name.endswith(".json"):
+                        files.append((mtime, path))
+                except FileNotFoundError:
+                    pass
+        if self.max_files > 0 and len(files) > self.max_files:
+            files.sort()
+            overflow, files = files[:len(files) - self.max_files], files[len(files) - self.max_files:]
+            for _, path in overflow:
+                try:
+                    os.remove(path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        if removed:
+            logger.info(f"清理磁盘缓存 {removed} 个文件，剩余 {len(files)} 个")
+        return removed
+
+    def start_sweeper(self) -> None:
+        """后台线程：启动时清理一次磁盘缓存，之后每隔 sweep_interval 秒清理一次"""
+        if not self.cache_dir or self._sweeper is not None:
+            return
+        self._sweeper = threading.Thread(target=self._sweep_loop, name="llm-cache-sweep", daemon=True)
+        self._sweeper.start()
+
+    def _sweep_loop(self) -> None:
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"清理磁盘缓存失败: {str(e)}")
+            time.sleep(self.sweep_interval)
+
+    def stats(self) -> Dict[str, int]:
+        """命中统计"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "entries": len(self._memory),
+            }
+
+
+llm_cache = LLMResponseCache(
+    max_entries=LLM_CACHE_MAX_ENTRIES,
+    ttl=LLM_CACHE_TTL,
+    cache_dir=LLM_CACHE_DIR,
+    max_files=LLM_CACHE_MAX_FILES,
+    sweep_interval=LLM_CACHE_SWEEP_INTERVAL
+)
@@ -0,0 +1,168 @@
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+from sqlalchemy import func, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from app.models.database import LLMUsage, SessionLocal
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 内存中累计的用量多久写入一次数据库（秒）
+LLM_USAGE_FLUSH_SECONDS = float(os.getenv("LLM_USAGE_FLUSH_SECONDS", "60"))
+
+USAGE_COMMAND = "#用量"
+
+_COUNTERS = ("calls", "prompt_tokens", "completion_tokens", "cache_hit_tokens", "cache_miss_tokens",
+             "local_cache_hits", "total_latency_ms")
+
+
+def parse_usage(usage: Optional[Dict[str, Any]]) -> Dict[str, int]:
+    """从响应的 usage 中取出 token 数；DeepSeek 返回 prompt_cache_hit/miss_tokens，
+    OpenAI 兼容接口返回 prompt_tokens_details.cached_tokens"""
+    usage = usage or {}
+    prompt_tokens = usage.get("prompt_tokens") or 0
+    cache_hit = usage.get("prompt_cache_hit_tokens")
+    if cache_hit is None:
+        cache_hit = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+    cache_miss = usage.get("prompt_cache_miss_tokens")
+    if cache_miss is None:
+        cache_miss = max(prompt_tokens - cache_hit, 0)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": usage.get("completion_tokens") or 0,
+        "cache_hit_tokens": cache_hit,
+        "cache_miss_tokens": cache_miss,
+    }
+
+
+class UsageTracker:
+    """LLM 用量统计：调用时只累加内存计数，由后台线程定期合并写入 llm_usage 表"""
+
+    def __init__(self, flush_seconds: float = LLM_USAGE_FLUSH_SECONDS,
+                 session_factory: Callable[[], Session] = SessionLocal):
+        self.flush_seconds = flush_seconds
+        self.session_factory = session_factory
+        # (期数ID, 命令) -> 计数
+        self._pending: Dict[Tuple[Optional[int], str], Counter] = {}
+        self._max_latency: Dict[Tuple[Optional[int], str], int] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+
+    def record(self, period_id: Optional[int], command: str, usage: Optional[Dict[str, Any]],
+               latency_ms: float) -> None:
+        """记录一次 LLM 请求"""
+        tokens = parse_usage(usage)
+        latency_ms = int(latency_ms)
+        logger.info(f"LLM 用量 - 命令: {command}, 输入: {tokens['prompt_tokens']}"
+                    f"（缓存命中 {tokens['cache_hit_tokens']}）, 输出: {tokens['completion_tokens']}, "
+                    f"耗时: {latency_ms}ms")
+        self._add(period_id, command, dict(tokens, calls=1, total_latency_ms=latency_ms), latency_ms)
+
+    def record_local_hit(self, period_id: Optional[int], command: str) -> None:
+        """记录一次命中本地响应缓存（没有发出请求）"""
+        self._add(period_id, command, {"local_cache_hits": 1}, 0)
+
+    def _add(self, period_id: Optional[int], command: str, values: Dict[str, int], latency_ms: int) -> None:
+        key = (period_id, command)
+        with self._lock:
+            self._pending.setdefault(key, Counter()).update(values)
+            self._max_latency[key] = max(self._max_latency.get(key, 0), latency_ms)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="llm-usage-flush", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.flush_seconds)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"写入 LLM 用量失败: {str(e)}")
+
+    def flush(self) -> None:
+        """把内存中的累计值合并到数据库；写入失败时计数放回内存，下次重试"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                max_latency, self._max_latency = self._max_latency, {}
+            if not pending:
+                return
+            db = self.session_factory()
+            try:
+                for key, counts in pending.items():
+                    self._merge(db, key, counts, max_latency.get(key, 0))
+                db.commit()
+            except Exception:
+                db.rollback()
+                with self._lock:
+                    for key, counts in pending.items():
+                        self._pending.setdefault(key, Counter()).update(counts)
+                        self._max_latency[key] = max(self._max_latency.get(key, 0), max_latency.get(key, 0))
+                raise
+            finally:
+                db.close()
+
+    def _merge(self, db: Session, key: Tuple[Optional[int], str], counts: Counter, max_latency: int) -> None:
+        period_id, command = key
+        period_filter = LLMUsage.period_id.is_(None) if period_id is None else LLMUsage.period_id == period_id
+        values = {name: getattr(LLMUsage, name) + counts.get(name, 0) for name in _COUNTERS}
+        values["max_latency_ms"] = func.max(LLMUsage.max_latency_ms, max_latency) \
+            if db.get_bind().dialect.name == "sqlite" else func.greatest(LLMUsage.max_latency_ms, max_latency)
+        stmt = update(LLMUsage).where(period_filter, LLMUsage.command == command).values(values)
+        if db.execute(stmt).rowcount:
+            return
+        try:
+            with db.begin_nested():
+                db.add(LLMUsage(period_id=period_id, command=command, max_latency_ms=max_latency,
+                                **{name: counts.get(name, 0) for name in _COUNTERS}))
+        except IntegrityError:
+            # 其他实例刚插入了同一行，改为累加
+            db.execute(stmt)
+
+    def summary(self, db: Session, period_id: Optional[int]) -> List[Dict[str, Any]]:
+        """某期（为空时为全部期数）按命令汇总的用量，包含尚未写入数据库的部分"""
+        query = db.query(LLMUsage.command, *[func.sum(getattr(LLMUsage, name)) for name in _COUNTERS],
+                         func.max(LLMUsage.max_latency_ms)).group_by(LLMUsage.command)
+        if period_id is not None:
+            query = query.filter(LLMUsage.period_id == period_id)
+        rows: Dict[str, Counter] = {}
+        max_latency: Dict[str, int] = {}
+        for command, *sums, latency in query.all():
+            rows[command] = Counter({name: int(value or 0) for name, value in zip(_COUNTERS, sums)})
+            max_latency[command] = int(latency or 0)
+        with self._lock:
+            for (pending_period, command), counts in self._pending.items():
+                if period_id is None or pending_period == period_id:
+                    rows.setdefault(command, Counter(dict.fromkeys(_COUNTERS, 0))).update(counts)
+                    max_latency[command] = max(max_latency.get(command, 0),
+                                               self._max_latency.get((pending_period, command), 0))
+        return [dict(counts, command=command, max_latency_ms=max_latency[command])
+                for command, counts in sorted(rows.items(), key=lambda x: -x[1]["prompt_tokens"])]
+
+
+def format_summary(title: str, rows: List[Dict[str, Any]]) -> str:
+    """把用量汇总格式化成群消息"""
+    if not rows:
+        return f"{title}\n暂无 LLM 调用记录"
+    lines = [title]
+    for row in rows:
+        prompt_tokens = row["cache_hit_tokens"] + row["cache_miss_tokens"]
+        hit_rate = row["cache_hit_tokens"] / prompt_tokens * 100 if prompt_tokens else 0
+        avg_latency = row["total_latency_ms"] / row["calls"] if row["calls"] else 0
+        lines.append(
+            f"• {row['command']}：{row['calls']} 次请求（本地缓存命中 {row['local_cache_hits']} 次），"
+            f"输入 {row['prompt_tokens']} / 输出 {row['completion_tokens']} tokens，"
+            f"前缀缓存命中率 {hit_rate:.1f}%，平均耗时 {avg_latency:.0f}ms，最长 {row['max_latency_ms']}ms"
+        )
+    return "\n".join(lines)
+
+
+usage_tracker = UsageTracker()
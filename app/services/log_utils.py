@@ -0,0 +1,15 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 消息内容、回复、接口返回等长文本写入日志时最多保留的字符数
+LOG_PAYLOAD_CHARS = int(os.getenv("LOG_PAYLOAD_CHARS", "200"))
+
+
+def clip(text, limit: int = LOG_PAYLOAD_CHARS) -> str:
+    """截断写入日志的长文本：活动总结、卡片消息等可达数万字，原样记录会放大日志体积和格式化开销"""
+    text = "" if text is None else str(text)
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}…（共 {len(text)} 字）"
@@ -2,10 +2,26 @@ import json
 import re
 import logging
 from datetime import datetime, timedelta
-from sqlalchemy.orm import Session
-from ..models.database import Period, Signup, Checkin
+from typing import Callable
+from sqlalchemy import func, update
+from sqlalchemy.orm import Session, load_only
+from ..models.database import Period, Signup, Checkin, PeriodArchive, get_period_stats
 from .openai_service import generate_ai_feedback
 from .feishu_service import FeishuService
+from .search_service import search, index_checkin, index_signup, unindex
+from .dedup_service import lsh_index, signature, pack
+from .job_lanes import ProgressReporter, job_lanes
+from .report_sender import ReportStream
+from .profiler import stage, is_admin
+from .identity_service import sender_index, match_nickname
+from .http_client import http_transport
+from .log_utils import clip
+from .scheduler import (scheduler, next_reminder_time, next_daily_time, archive_time,
+                        JOB_PERIOD_CLOSE, JOB_DAILY_REMINDER, JOB_DAILY_DIGEST, JOB_PERIOD_ARCHIVE)
+from .chat_settings import chat_settings, FEEDBACK_DIGEST, FEEDBACK_INSTANT, DIGEST_COMMAND
+from .llm_usage import usage_tracker, format_summary, USAGE_COMMAND
+from .analytics import build_report, STATS_COMMAND
+from .archive_service import get_period_results, QUALIFIED_CHECKINS
 import os
 import requests
 import time
@@ -13,29 +29,38 @@ import time
 # 配置日志
 logger = logging.getLogger(__name__)
 
+RESULTS_COMMAND = "#结果"
+# 结果消息中最多列出的人数
+RESULTS_MAX_LINES = 50
+# 活动结束总结生成期间的期数状态：认领后其他的活动结束请求不会重复生成
+PERIOD_SETTLING = '结算中'
+
+
+def release_settling_periods(db: Session) -> int:
+    """启动时把上次进程退出时仍处于结算中的期数恢复为进行中，重新发送 #活动结束 即可继续"""
+    released = db.execute(
+        update(Period).where(Period.status == PERIOD_SETTLING).values(status='进行中')
+    ).rowcount
+    db.commit()
+    if released:
+        logger.warning(f"{released} 个期数上次结算未完成，已恢复为进行中")
+    return released
+
 
 class MessageHandler:
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, notify: Callable[[str], None] = None, feishu_service: FeishuService = None):
         self.db = db
-        self.feishu_service = FeishuService()
-        self._processed_messages = set()  # 用于存储已处理的消息ID
+        # 每个事件都会创建处理器，飞书服务由调用方共享传入
+        self.feishu_service = feishu_service or FeishuService()
+        # 长任务向会话汇报进度、分段发送报告（不传则不汇报，报告作为返回值一次性回复）
+        self.notify = notify
+        self.progress = ProgressReporter(notify)
 
-    def handle_message(self, message_content: str, chat_id: str, message_type: str = "text", message_id: str = None) -> str:
+    def handle_message(self, message_content: str, chat_id: str, message_type: str = "text", message_id: str = None, sender_open_id: str = None) -> str:
         """处理接收到的消息"""
+        # 重复投递的消息已在接收事件时按消息 ID 去重
         logger.info(f"开始处理消息，类型: {message_type}, ID: {message_id}")
-        
-        # 如果消息ID存在且已处理过，则跳过
-        if message_id:
-            if message_id in self._processed_messages:
-                logger.info(f"消息 {message_id} 已经处理过，跳过")
-                return None
-            self._processed_messages.add(message_id)
-            
-            # 保持集合大小在合理范围内，避免内存泄漏
-            if len(self._processed_messages) > 1000:
-                self._processed_messages.clear()
-
-        logger.info(f"消息内容: {message_content}")
+        logger.info(f"消息内容: {clip(message_content)}")
 
         if message_type == "interactive":
             try:
@@ -47,7 +72,7 @@ class MessageHandler:
                 if title == "🌟本期目标制定":
                     logger.info("检测到目标制定标题")
                     elements = content_json.get("elements", [])
-                    logger.info(f"消息元素: {elements}")
+                    logger.info(f"消息元素: {len(elements)} 组")
                     
                     # 检查是否包含接龙说明文本和参与人数文本
                     has_signup_text = False
@@ -100,8 +125,22 @@ class MessageHandler:
                 return self.handle_signup_end(chat_id)
             elif message_content.strip() == '#活动结束':
                 return self.handle_activity_end(chat_id)
+            elif message_content.startswith(DIGEST_COMMAND):
+                return self.handle_digest_command(message_content, chat_id)
             elif message_content.startswith('#打卡'):
-                return self.handle_checkin(message_content, chat_id)
+                return self.handle_checkin(message_content, chat_id, sender_open_id)
+            elif message_content.startswith('#搜索'):
+                return self.handle_search(message_content)
+            elif message_content.startswith(RESULTS_COMMAND):
+                return self.handle_results(message_content)
+            elif message_content.strip() in (USAGE_COMMAND, STATS_COMMAND) and not is_admin(sender_open_id):
+                # 用量和跨期统计只对管理员开放，与 #性能分析 相同，非管理员不回复
+                logger.info(f"非管理员尝试查询 {message_content.strip()} - 发送者: {sender_open_id}")
+                return None
+            elif message_content.strip() == USAGE_COMMAND:
+                return self.handle_usage()
+            elif message_content.strip() == STATS_COMMAND:
+                return self.handle_stats()
         return None
 
     def create_new_period(self, chat_id: str, message_content: str) -> str:
@@ -110,7 +149,7 @@ class MessageHandler:
             logger.info("开始检查是否有正在进行的活动期数")
             # 检查是否有正在进行的活动期数
             existing_period = self.db.query(Period)\
-                .filter(Period.status.in_(['报名中', '进行中']))\
+                .filter(Period.status.in_(['报名中', '进行中', PERIOD_SETTLING]))\
                 .first()
 
             if existing_period:
@@ -165,11 +204,13 @@ class MessageHandler:
                     start_date=now,
                     end_date=now + timedelta(days=30),
                     status='报名中',
-                    signup_link=signup_link
+                    signup_link=signup_link,
+                    chat_id=chat_id
                 )
                 self.db.add(new_period)
                 self.db.commit()
                 logger.info(f"成功创建新期数: {period_name}")
+                scheduler.schedule(self.db, JOB_PERIOD_CLOSE, new_period.id, chat_id, new_period.end_date)
 
                 return "本期接龙已开启，请大家踊跃报名！"
 
@@ -207,15 +248,19 @@ class MessageHandler:
 
             try:
                 # 从飞书多维表获取数据
+                self.progress.report("⏳ 正在同步接龙数据，请稍候…", force=True)
                 logger.info(f"开始从多维表获取数据: {current_period.signup_link}")
-                signup_data = self.feishu_service.fetch_signup_data(current_period.signup_link)
+                with stage("bitable"):
+                    signup_data = self.feishu_service.fetch_signup_data(current_period.signup_link)
                 
                 if not signup_data:
                     error_msg = "接龙结束失败：未获取到有效的报名数据"
                     logger.error(error_msg)
                     return error_msg
 
-                # 清除当前期数的所有报名记录
+                # 清除当前期数的所有报名记录（旧报名的 ID 用于提交后移出搜索索引）
+                old_signup_ids = [signup_id for (signup_id,) in self.db.query(Signup.id)
+                                  .filter(Signup.period_id == current_period.id)]
                 self.db.query(Signup)\
                     .filter(Signup.period_id == current_period.id)\
                     .delete()
@@ -224,6 +269,7 @@ class MessageHandler:
                 # 处理并添加新的报名记录
                 success_count = 0
                 developers = []
+                new_signups = []
                 for record in signup_data:
                     try:
                         # 获取昵称和专注领域
@@ -251,6 +297,7 @@ class MessageHandler:
                             signup_time=signup_time
                         )
                         self.db.add(signup)
+                        new_signups.append(signup)
                         success_count += 1
                         
                         # 收集开发者信息用于总结
@@ -272,10 +319,24 @@ class MessageHandler:
 
                 # 更新活动状态为已结束
                 current_period.status = '进行中'
+                current_period.chat_id = current_period.chat_id or chat_id
+                self.db.flush()
+                signup_goals = [(signup.id, signup.goals) for signup in new_signups]
                 self.db.commit()
+                scheduler.schedule(self.db, JOB_DAILY_REMINDER, current_period.id, current_period.chat_id,
+                                   next_reminder_time(datetime.now()))
+                feedback_mode, digest_time = chat_settings.get(self.db, current_period.chat_id)
+                if feedback_mode == FEEDBACK_DIGEST:
+                    scheduler.schedule(self.db, JOB_DAILY_DIGEST, current_period.id, current_period.chat_id,
+                                       next_daily_time(datetime.now(), digest_time))
                 logger.info(f"成功更新活动期数 {current_period.period_name} 状态为已结束")
                 logger.info(f"总共处理了 {success_count} 条报名记录")
 
+                # 更新搜索索引：先移出被替换的旧报名，否则它们仍占用 top-k 名额
+                unindex(self.db, [], old_signup_ids)
+                for signup_id, goals in signup_goals:
+                    index_signup(self.db, signup_id, goals)
+
                 # 生成报名统计信息
                 total_signups = len(developers)
                 focus_area_groups = {}
@@ -299,8 +360,11 @@ class MessageHandler:
                         response_lines.append(f"- {nickname}")
                 
                 response_lines.append("\n\n祝愿大家在本期活动中收获满满！🎉")
-                
-                return "\n".join(response_lines)
+
+                # 名单较长时按大小切分成多条消息发送
+                report = ReportStream(self.notify)
+                report.write("\n".join(response_lines))
+                return report.close()
 
             except Exception as e:
                 error_msg = f"接龙结束失败：更新数据时发生错误 - {str(e)}"
@@ -315,32 +379,20 @@ class MessageHandler:
                 self.db.rollback()
             return error_msg
 
-    def handle_checkin(self, message_content: str, chat_id: str) -> str:
-        """处理打卡消息"""
-        logger.info(f"开始处理打卡消息: {message_content}")
+    def handle_checkin(self, message_content: str, chat_id: str, sender_open_id: str = None) -> str:
+        """处理打卡消息：已绑定的发送者按 open_id 直接定位报名记录，昵称可省略"""
+        logger.info(f"开始处理打卡消息: {clip(message_content)}")
         
         # 解析打卡信息
-        pattern = r'#打卡\s+([\w-]+)\s+(.+)(?:\n|$)'
+        pattern = r'#打卡\s+(.+)(?:\n|$)'
         match = re.search(pattern, message_content)
 
         if not match:
-            error_msg = "📝 打卡格式不正确\n正确格式：#打卡 昵称 工作内容\n示例：#打卡 张三 完成了登录功能的开发"
-            logger.info(f"打卡格式错误: {message_content}")
+            error_msg = "📝 打卡格式不正确\n正确格式：#打卡 昵称 工作内容（首次打卡后可省略昵称）\n示例：#打卡 张三 完成了登录功能的开发"
+            logger.info(f"打卡格式错误: {clip(message_content)}")
             return error_msg
 
-        nickname = match.group(1)
-        content = match.group(2).strip()
-
-        # 检查工作内容
-        if len(content) < 2:
-            error_msg = "📝 打卡内容太短，请详细描述您的工作内容"
-            logger.info(f"打卡内容过短: {content}")
-            return error_msg
-        
-        if len(content) > 500:
-            error_msg = "📝 打卡内容过长，请控制在500字以内"
-            logger.info(f"打卡内容过长: {len(content)}字")
-            return error_msg
+        text = match.group(1).strip()
 
         # 获取当前活动期数
         current_period = self.db.query(Period)\
@@ -352,23 +404,59 @@ class MessageHandler:
             logger.info("打卡失败：没有进行中的活动期数")
             return error_msg
 
-        # 查找用户报名记录
+        # 先按发送者身份查找已绑定的报名记录，未绑定时按昵称匹配
+        signup_id = sender_index.get(self.db, current_period.id, sender_open_id)
+        if signup_id is None:
+            candidates = self.db.query(Signup.id, Signup.nickname)\
+                .filter(Signup.period_id == current_period.id)\
+                .all()
+            matched = match_nickname(candidates, text)
+            if not matched:
+                nickname = text.split()[0]
+                error_msg = f"⚠️ 未找到昵称为 {nickname} 的报名记录\n请先完成接龙或检查昵称是否正确"
+                logger.info(f"打卡失败：未找到报名记录 - {nickname}")
+                return error_msg
+            signup_id, nickname, content = matched
+        else:
+            content = None
+
+        # 查找用户报名记录（只加载生成反馈需要的列）
         signup = self.db.query(Signup)\
-            .filter(Signup.period_id == current_period.id)\
-            .filter(Signup.nickname == nickname)\
+            .options(load_only(Signup.id, Signup.nickname, Signup.goals, Signup.open_id))\
+            .filter(Signup.id == signup_id)\
             .first()
-
         if not signup:
-            error_msg = f"⚠️ 未找到昵称为 {nickname} 的报名记录\n请先完成接龙或检查昵称是否正确"
-            logger.info(f"打卡失败：未找到报名记录 - {nickname}")
+            logger.info(f"打卡失败：报名记录不存在 - 报名ID: {signup_id}")
+            return "⚠️ 未找到您的报名记录\n请先完成接龙或检查昵称是否正确"
+        nickname = signup.nickname
+
+        if content is None:
+            # 已绑定的发送者也可以照旧带上自己的昵称
+            matched = match_nickname([(signup.id, nickname)], text)
+            content = matched[2] if matched else text
+        elif sender_open_id and signup.open_id and signup.open_id != sender_open_id:
+            error_msg = f"⚠️ 昵称 {nickname} 已绑定其他飞书账号，请使用自己的昵称打卡"
+            logger.info(f"打卡失败：昵称已被其他账号绑定 - {nickname}")
+            return error_msg
+
+        # 检查工作内容
+        if len(content) < 2:
+            error_msg = "📝 打卡内容太短，请详细描述您的工作内容"
+            logger.info(f"打卡内容过短: {content}")
+            return error_msg
+        
+        if len(content) > 500:
+            error_msg = "📝 打卡内容过长，请控制在500字以内"
+            logger.info(f"打卡内容过长: {len(content)}字")
             return error_msg
 
         try:
-            # 检查是否重复打卡
+            # 检查是否重复打卡（读主库，避免副本延迟导致重复写入）
             today = datetime.now().date()
-            existing_checkin = self.db.query(Checkin)\
+            existing_checkin = self.db.query(Checkin.id)\
                 .filter(Checkin.signup_id == signup.id)\
                 .filter(Checkin.checkin_date == today)\
+                .execution_options(use_primary=True)\
                 .first()
             
             if existing_checkin:
@@ -376,11 +464,19 @@ class MessageHandler:
                 logger.info(f"打卡失败：重复打卡 - {nickname}")
                 return error_msg
 
-            # 获取用户所有打卡记录
-            user_checkins = self.db.query(Checkin)\
+            # 统计用户已有的有效打卡次数（近似重复的打卡不计入）
+            previous_count = self.db.query(func.count(Checkin.id))\
                 .filter(Checkin.signup_id == signup.id)\
-                .order_by(Checkin.checkin_date)\
-                .all()
+                .filter(Checkin.duplicate_of.is_(None))\
+                .execution_options(use_primary=True)\
+                .scalar()
+
+            # 近似重复检测：与该用户此前的打卡比较 MinHash 签名
+            # MinHash 是 CPU 密集计算，异步处理时放到线程池，不阻塞事件循环上的其他事件
+            content_signature = http_transport.run_blocking(signature, content)
+            duplicate_of = lsh_index.find_similar(self.db, signup.id, content_signature)
+            if duplicate_of:
+                logger.info(f"检测到近似重复打卡 - 用户: {nickname}, 相似打卡ID: {duplicate_of}")
 
             # 创建打卡记录
             logger.info(f"创建打卡记录 - 用户: {nickname}, 内容长度: {len(content)}")
@@ -389,18 +485,42 @@ class MessageHandler:
                 nickname=nickname,
                 checkin_date=today,
                 content=content,
-                checkin_count=len(user_checkins) + 1
+                checkin_count=previous_count if duplicate_of else previous_count + 1,
+                minhash=pack(content_signature),
+                duplicate_of=duplicate_of
             )
             
+            # 首次打卡时把发送者绑定到报名记录，之后可省略昵称
+            bind_sender = sender_open_id and not signup.open_id
+            if bind_sender:
+                signup.open_id = sender_open_id
+
             try:
                 self.db.add(checkin)
+                self.db.flush()
+                checkin_id = checkin.id
                 self.db.commit()
-                logger.info(f"打卡记录添加成功 - 用户: {nickname}, 第 {len(user_checkins) + 1} 次打卡")
+                logger.info(f"打卡记录添加成功 - 用户: {nickname}, 第 {previous_count + 1} 次打卡")
+                if bind_sender:
+                    sender_index.bind(current_period.id, sender_open_id, signup.id)
+                    logger.info(f"绑定发送者 - 用户: {nickname}, open_id: {sender_open_id}")
             except Exception as db_error:
                 logger.error(f"数据库更新失败: {str(db_error)}")
                 self.db.rollback()
                 return "❌ 打卡失败，请稍后重试"
 
+            # 增量更新搜索索引和重复检测索引
+            index_checkin(self.db, checkin_id, content)
+            lsh_index.add(signup.id, checkin_id, content_signature)
+
+            if duplicate_of:
+                return f"⚠️ 打卡已记录，但内容与您之前的打卡高度相似，本次不计入达标次数\n📝 当前有效打卡 {previous_count}/21 次\n\n换个角度分享一下今天的新进展吧！"
+
+            # 每日汇总模式：只回复模板确认，AI 点评在日报中统一生成
+            feedback_mode, digest_time = chat_settings.get(self.db, chat_id)
+            if feedback_mode == FEEDBACK_DIGEST:
+                return f"✨ 打卡成功！\n📝 第 {previous_count + 1}/21 次打卡\n\n📰 今天的 AI 点评会在 {digest_time} 的打卡日报中统一发送"
+
             # 生成打卡反馈
             try:
                 logger.info(f"开始生成AI反馈 - 用户: {nickname}")
@@ -415,7 +535,9 @@ class MessageHandler:
                             nickname=nickname,
                             goals=signup.goals,
                             content=content,
-                            checkin_count=len(user_checkins) + 1
+                            checkin_count=previous_count + 1,
+                            period_id=signup.period_id,
+                            command="#打卡"
                         )
                         if ai_feedback:
                             break
@@ -424,16 +546,16 @@ class MessageHandler:
                         retry_count -= 1
                         if retry_count > 0:
                             # 短暂等待后重试
-                            time.sleep(1)
+                            http_transport.sleep(1)
                 
                 if ai_feedback:
                     return ai_feedback
                 else:
-                    return f"✨ 打卡成功！\n📝 第 {len(user_checkins) + 1}/21 次打卡\n\n继续加油，你的每一步进展都很棒！ 🌟"
+                    return f"✨ 打卡成功！\n📝 第 {previous_count + 1}/21 次打卡\n\n继续加油，你的每一步进展都很棒！ 🌟"
                 
             except Exception as ai_error:
                 logger.error(f"AI反馈生成失败: {str(ai_error)}")
-                return f"✨ 打卡成功！\n📝 第 {len(user_checkins) + 1}/21 次打卡\n\n继续加油，你的每一步进展都很棒！ 🌟"
+                return f"✨ 打卡成功！\n📝 第 {previous_count + 1}/21 次打卡\n\n继续加油，你的每一步进展都很棒！ 🌟"
             
         except Exception as e:
             error_msg = f"打卡失败：{str(e)}"
@@ -441,57 +563,233 @@ class MessageHandler:
             self.db.rollback()
             return "❌ 打卡失败，请稍后重试或联系管理员"
 
-    async def handle_activity_end(self, message_id: str) -> str:
-        """处理活动结束"""
+    def handle_search(self, message_content: str) -> str:
+        """处理搜索命令：在历史打卡和报名目标中搜索关键词"""
+        keyword = message_content.strip()[len('#搜索'):].strip()
+        if not keyword:
+            return "🔍 请输入要搜索的关键词\n格式：#搜索 关键词\n示例：#搜索 docker"
+
         try:
-            # 获取当前进行中的活动期数
-            current_period = self.db.query(Period)\
+            start = time.perf_counter()
+            results = search(self.db, keyword)
+            logger.info(f"搜索完成 - 关键词: {keyword}, 结果: {len(results)} 条, 耗时: {(time.perf_counter() - start) * 1000:.1f}ms")
+        except Exception as e:
+            logger.error(f"搜索失败: {str(e)}", exc_info=True)
+            return "❌ 搜索失败，请稍后重试"
+
+        # 已归档期数的打卡不在热表中，搜不到，需要提示
+        archived = self.db.query(func.count(PeriodArchive.id)).scalar()
+        notice = f"\n\nℹ️ 已归档的 {archived} 期不在搜索范围内，可用 #结果 期数名 查看其结果" if archived else ""
+
+        if not results:
+            return f"🔍 没有找到与「{keyword}」相关的记录{notice}"
+
+        response_lines = [f"🔍 「{keyword}」的搜索结果（前 {len(results)} 条）："]
+        for i, result in enumerate(results, 1):
+            response_lines.append(
+                f"\n{i}. [{result['period_name']}] {result['nickname']} · {result['source']}")
+            response_lines.append(f"   {result['snippet']}")
+        return "\n".join(response_lines) + notice
+
+    def handle_results(self, message_content: str) -> str:
+        """处理结果命令：#结果 [期数名]，不指定时为最近结束的一期；已归档的期数读取归档时的结果快照"""
+        period_name = message_content.strip()[len(RESULTS_COMMAND):].strip()
+        try:
+            query = self.db.query(Period).options(load_only(Period.id, Period.period_name, Period.status))
+            if period_name:
+                period = query.filter(Period.period_name == period_name).first()
+            else:
+                period = query.filter(Period.status == '已结束').order_by(Period.end_date.desc()).first()
+            if not period:
+                return f"⚠️ 没有找到期数 {period_name}" if period_name else "⚠️ 还没有已结束的期数"
+
+            results = sorted(get_period_results(self.db, period), key=lambda r: -r["checkin_count"])
+            archived = self.db.query(PeriodArchive.id).filter(PeriodArchive.period_id == period.id).first()
+            qualified = [r["nickname"] for r in results if r["qualified"]]
+            lines = [f"🏁 {period.period_name} 期结果（{'已归档' if archived else period.status}）："
+                     f"{len(results)} 人，{len(qualified)} 人达标（有效打卡 ≥ {QUALIFIED_CHECKINS} 次）"]
+            if qualified:
+                lines.append("🏆 达标：" + "、".join(qualified))
+            lines.append("📋 有效打卡次数：")
+            for r in results[:RESULTS_MAX_LINES]:
+                lines.append(f"- {r['nickname']}：{r['checkin_count']} 次")
+            if len(results) > RESULTS_MAX_LINES:
+                lines.append(f"…… 另有 {len(results) - RESULTS_MAX_LINES} 人")
+            return "\n".join(lines)
+        except Exception as e:
+            logger.error(f"查询期数结果失败: {str(e)}", exc_info=True)
+            return "❌ 查询结果失败，请稍后重试"
+
+    def handle_digest_command(self, message_content: str, chat_id: str) -> str:
+        """处理打卡日报命令：#打卡日报 开启 [HH:MM] / 关闭 / 状态"""
+        args = message_content.strip()[len(DIGEST_COMMAND):].split()
+        action = args[0] if args else "状态"
+        usage = f"用法：{DIGEST_COMMAND} 开启 [HH:MM] / 关闭 / 状态"
+        try:
+            period = self.db.query(Period)\
                 .filter(Period.status == '进行中')\
+                .filter(Period.chat_id == chat_id)\
+                .first()
+            if action == "开启":
+                digest_time = None
+                if len(args) > 1:
+                    try:
+                        digest_time = datetime.strptime(args[1], "%H:%M").strftime("%H:%M")
+                    except ValueError:
+                        return usage
+                _, digest_time = chat_settings.set(self.db, chat_id, FEEDBACK_DIGEST, digest_time)
+                if period:
+                    scheduler.schedule(self.db, JOB_DAILY_DIGEST, period.id, chat_id,
+                                       next_daily_time(datetime.now(), digest_time))
+                logger.info(f"开启打卡日报 - 群: {chat_id}, 时间: {digest_time}")
+                return f"📰 已开启打卡日报：打卡后只回复确认，每天 {digest_time} 统一发送当天所有打卡的 AI 点评"
+            if action == "关闭":
+                chat_settings.set(self.db, chat_id, FEEDBACK_INSTANT)
+                if period:
+                    scheduler.cancel(self.db, JOB_DAILY_DIGEST, period.id)
+                logger.info(f"关闭打卡日报 - 群: {chat_id}")
+                return "✨ 已关闭打卡日报，恢复每次打卡即时 AI 点评"
+            if action == "状态":
+                feedback_mode, digest_time = chat_settings.get(self.db, chat_id)
+                if feedback_mode == FEEDBACK_DIGEST:
+                    return f"📰 打卡日报：已开启，每天 {digest_time} 发送"
+                return "📰 打卡日报：未开启（每次打卡即时 AI 点评）"
+            return usage
+        except Exception as e:
+            logger.error(f"处理打卡日报命令失败: {str(e)}", exc_info=True)
+            self.db.rollback()
+            return "❌ 设置失败，请稍后重试"
+
+    def handle_usage(self) -> str:
+        """处理用量命令：最近一期和全部期数按命令汇总的 LLM 用量及前缀缓存命中率"""
+        try:
+            period = self.db.query(Period).options(load_only(Period.id, Period.period_name))\
+                .order_by(Period.id.desc())\
                 .first()
+            sections = []
+            if period:
+                sections.append(format_summary(f"📊 {period.period_name} 期 LLM 用量",
+                                               usage_tracker.summary(self.db, period.id)))
+            sections.append(format_summary("📊 全部期数 LLM 用量", usage_tracker.summary(self.db, None)))
+            return "\n\n".join(sections)
+        except Exception as e:
+            logger.error(f"查询 LLM 用量失败: {str(e)}", exc_info=True)
+            return "❌ 查询用量失败，请稍后重试"
+
+    def handle_stats(self) -> str:
+        """处理统计命令：导出全部期数（含已归档）并计算跨期指标，计算放到线程池中进行"""
+        try:
+            return http_transport.run_blocking(build_report)
+        except RuntimeError as e:
+            logger.error(f"生成跨期统计失败: {str(e)}")
+            return f"❌ {str(e)}"
+        except Exception as e:
+            logger.error(f"生成跨期统计失败: {str(e)}", exc_info=True)
+            return "❌ 生成统计失败，请稍后重试"
+
+    def handle_activity_end(self, message_id: str, period_id: int = None) -> str:
+        """处理活动结束：先认领期数（进行中 -> 结算中），再逐个生成开发者总结并分段发送，最后更新期数状态；
+        period_id 为空时结束当前进行中的期数"""
+        report = None
+        try:
+            # 获取当前进行中的活动期数（定时任务指定期数）
+            query = self.db.query(Period).filter(Period.status.in_(['进行中', PERIOD_SETTLING]))
+            if period_id is not None:
+                query = query.filter(Period.id == period_id)
+            current_period = query.first()
 
             if not current_period:
                 error_msg = "活动结束失败：没有正在进行的活动"
                 logger.info(error_msg)
                 return error_msg
 
+            # 原子地认领期数：手动 #活动结束 与定时自动结束可能同时执行，只有认领成功的一方生成总结
+            claimed = self.db.execute(
+                update(Period)
+                .where(Period.id == current_period.id)
+                .where(Period.status == '进行中')
+                .values(status=PERIOD_SETTLING)
+            ).rowcount
+            self.db.commit()
+            if not claimed:
+                logger.info(f"期数 {current_period.period_name} 正在结算中，忽略重复的活动结束")
+                return f"⏳ {current_period.period_name}期活动正在结算中，总结生成后会发到群里"
+
             try:
-                # 获取所有报名记录
+                # 获取所有报名记录（只加载统计和生成表扬需要的列）
                 signups = self.db.query(Signup)\
+                    .options(load_only(Signup.id, Signup.nickname, Signup.focus_area, Signup.goals))\
                     .filter(Signup.period_id == current_period.id)\
+                    .order_by(Signup.id)\
                     .all()
-
-                # 收集每个开发者的打卡统计和成果
-                developer_stats = []
-                qualified_developers = []  # 达标开发者
+                # 上次因停机中断时已发送的开发者不再重复发送（认领后读取，进度由上次中断时与状态一起写入）
+                self.db.refresh(current_period)
+                resume_from = current_period.report_progress or 0
+
+                # 一次分组查询得到每个开发者的打卡次数（配置了副本时从副本读取）
+                checkin_counts = {
+                    row.nickname: row.checkin_count
+                    for row in get_period_stats(self.db, current_period.id)
+                }
+
+                # 达标开发者，用于结尾的达标名单
+                qualified_developers = []
                 
-                for signup in signups:
-                    # 获取该开发者的所有打卡记录
-                    checkins = self.db.query(Checkin)\
-                        .filter(Checkin.signup_id == signup.id)\
-                        .order_by(Checkin.checkin_date)\
-                        .all()
-                    
-                    checkin_count = len(checkins)
+                self.progress.report(f"⏳ 正在生成 {len(signups) - resume_from} 位开发者的活动总结，请稍候…", force=True)
+
+                # 报告边生成边发送：每位开发者的总结生成后立即写入，按大小切分成多条消息
+                report = ReportStream(self.notify)
+                if resume_from:
+                    report.write(f"✨ {current_period.period_name}期活动总结（续，从第 {resume_from + 1} 位开发者开始）")
+                else:
+                    report.write("\n".join([
+                        f"✨ {current_period.period_name}期活动圆满结束！",
+                        "感谢大家的积极参与和付出！\n",
+                        "📊 开发者打卡统计："
+                    ]))
+
+                for index, signup in enumerate(signups):
+                    checkin_count = checkin_counts.get(signup.nickname, 0)
                     
                     # 检查是否达标（9次有效打卡）
                     is_qualified = checkin_count >= 9
+                    if index < resume_from:
+                        if is_qualified:
+                            qualified_developers.append(signup.nickname)
+                        continue
+
+                    # 停机时在两位开发者之间停下：已写入的部分发完，记录进度，重新执行时接着发送
+                    if job_lanes.stopping.is_set():
+                        # 进度与释放认领一起提交，重新执行时再次认领并从这里继续
+                        current_period.report_progress = index
+                        current_period.status = '进行中'
+                        self.db.commit()
+                        report.write(f"\n⏸ 服务重启，总结已发送到第 {index} 位开发者，重启后再次发送 #活动结束 将继续发送剩余部分")
+                        logger.warning(f"停机中断活动总结 - 期数: {current_period.period_name}, 已发送 {index}/{len(signups)} 位")
+                        return report.close()
                     
                     # 生成开发者的AI表扬语
                     praise = ""
                     if checkin_count > 0:
+                        # 只读取最后一次打卡的内容用于生成表扬
+                        latest_content = self.db.query(Checkin.content)\
+                            .filter(Checkin.signup_id == signup.id)\
+                            .order_by(Checkin.checkin_date.desc(), Checkin.id.desc())\
+                            .limit(1)\
+                            .scalar()
                         retry_count = 3  # 最大重试次数
                         while retry_count > 0:
                             try:
-                                # 使用最后一次打卡内容生成表扬
-                                latest_checkin = checkins[-1]
                                 praise = generate_ai_feedback(
                                     db=self.db,
                                     signup_id=signup.id,
                                     nickname=signup.nickname,
                                     goals=signup.goals,
-                                    content=latest_checkin.content,
+                                    content=latest_content,
                                     checkin_count=checkin_count,
-                                    is_final=True  # 标记这是结束总结
+                                    is_final=True,  # 标记这是结束总结
+                                    period_id=current_period.id,
+                                    command="#活动结束"
                                 )
                                 if praise:
                                     praise = praise.split('\n\n')[-1]  # 只取AI反馈部分
@@ -502,34 +800,25 @@ class MessageHandler:
                                 if retry_count == 0:
                                     praise = "很棒的表现！期待下次再见！"  # 默认表扬语
                             
-                    developer_stats.append({
-                        'nickname': signup.nickname,
-                        'focus_area': signup.focus_area,
-                        'checkin_count': checkin_count,
-                        'is_qualified': is_qualified,
-                        'praise': praise
-                    })
+                    report.write("\n".join([
+                        f"\n{signup.nickname} ({signup.focus_area})：",
+                        f"- 打卡进度：{checkin_count}/21次",
+                        f"- {praise}"
+                    ]))
                     
                     if is_qualified:
                         qualified_developers.append(signup.nickname)
 
                 # 更新活动状态为已结束
                 current_period.status = '已结束'
+                current_period.report_progress = 0
                 self.db.commit()
                 logger.info(f"成功更新活动期数 {current_period.period_name} 状态为已结束")
+                scheduler.schedule(self.db, JOB_PERIOD_ARCHIVE, current_period.id, current_period.chat_id,
+                                   archive_time(current_period))
 
-                # 构建响应消息
-                response_lines = [
-                    f"✨ {current_period.period_name}期活动圆满结束！",
-                    "感谢大家的积极参与和付出！\n"
-                ]
-                
-                # 添加开发者统计信息
-                response_lines.append("📊 开发者打卡统计：")
-                for dev in developer_stats:
-                    response_lines.append(f"\n{dev['nickname']} ({dev['focus_area']})：")
-                    response_lines.append(f"- 打卡进度：{dev['checkin_count']}/21次")
-                    response_lines.append(f"- {dev['praise']}")
+                # 构建结尾部分
+                response_lines = []
                 
                 # 添加达标情况说明
                 response_lines.append("\n🎯 达标情况：")
@@ -551,7 +840,7 @@ class MessageHandler:
                 ])
                 
                 # 对未达标者的简短鼓励
-                if len(qualified_developers) < len(developer_stats):
+                if len(qualified_developers) < len(signups):
                     response_lines.extend([
                         "\n💪 未达标的小伙伴也请不要灰心，",
                         "这只是开始，继续坚持，下期一定能达标！"
@@ -562,13 +851,24 @@ class MessageHandler:
                     "\n🌈 让我们继续努力，",
                     "下期再战，更多惊喜奖励等你来挑战！ 🚀"
                 ])
+                report.write("\n".join(response_lines))
                 
-                return "\n".join(response_lines)
+                return report.close()
 
             except Exception as e:
                 error_msg = f"活动结束失败：更新状态时发生错误 - {str(e)}"
                 logger.error(error_msg, exc_info=True)
                 self.db.rollback()
+                # 释放认领，之后可以重新发送 #活动结束
+                self.db.execute(
+                    update(Period)
+                    .where(Period.id == current_period.id)
+                    .where(Period.status == PERIOD_SETTLING)
+                    .values(status='进行中')
+                )
+                self.db.commit()
+                if report:
+                    report.close()
                 return error_msg
 
         except Exception as e:
@@ -1,126 +1,194 @@
 from dotenv import load_dotenv
 import os
-import httpx
 import json
 import logging
-from typing import List
-from app.models.database import Signup, Checkin
+import time
+from typing import List, Optional, Tuple
+from app.models.database import release_connection
+from app.services.history_service import build_history, estimate_tokens
+from app.services.llm_cache import llm_cache, LLM_CACHE_FEEDBACK, LLM_CACHE_FINAL
+from app.services.http_client import http_transport
+from app.services.profiler import stage
+from app.services.llm_usage import usage_tracker
 from sqlalchemy.orm import Session
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
-# 创建自定义的 httpx 客户端
-http_client = httpx.Client(
-    timeout=30.0
-)
-
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
 DEEPSEEK_API_ENDPOINT = os.getenv("DEEPSEEK_API_ENDPOINT", "https://aiproxy.gzg.sealos.run")
 DEEPSEEK_API_URL = f"{DEEPSEEK_API_ENDPOINT}/v1/chat/completions"
 
 logger.info(f"使用 API 端点: {DEEPSEEK_API_URL}")
 
-def get_all_checkins(db: Session, signup_id: int) -> List[Checkin]:
-    """获取用户所有的打卡记录"""
-    return db.query(Checkin).filter(Checkin.signup_id == signup_id).order_by(Checkin.checkin_date).all()
+DEEPSEEK_MODEL = "deepseek-chat"
+FEEDBACK_TEMPERATURE = 0.8
+# 每日汇总：打卡内容在提示词中的 token 预算、每条打卡保留的字数、回复长度上限
+DIGEST_TOKEN_BUDGET = int(os.getenv("DIGEST_TOKEN_BUDGET", "6000"))
+DIGEST_SNIPPET_CHARS = int(os.getenv("DIGEST_SNIPPET_CHARS", "80"))
+DIGEST_MAX_TOKENS = 1200
+SYSTEM_PROMPT = """你是一个超级活泼可爱的AI助手，善于分析用户的学习进展并给出鼓励。你的回复要既体现对用户目标和历史的关注，又保持轻松愉快的语气。"""
 
-def generate_ai_feedback(db: Session, signup_id: int, nickname: str, goals: str, content: str, checkin_count: int, is_final: bool = False) -> str:
-    """生成AI反馈，基于用户的所有打卡记录和目标"""
-    # 获取所有历史打卡记录
-    all_checkins = get_all_checkins(db, signup_id)
-    
-    # 构建历史打卡内容字符串
-    history = ""
-    for i, checkin in enumerate(all_checkins, 1):
-        if i == len(all_checkins):  # 最新的打卡
-            continue
-        history += f"第{i}次打卡内容：{checkin.content}\n"
+# 固定的说明放在 system 消息中、用户数据放在最后，同类请求共享同一个提示词前缀，可命中服务端的前缀缓存
+FEEDBACK_INSTRUCTIONS = """用户消息中依次给出：用户昵称、【报名目标】、【历史打卡记录】、【本次打卡】。
+
+请根据这些信息生成一段活泼的回复（50字左右），要求：
+1. 将本次打卡内容与用户目标关联，体现进展
+2. 参考历史打卡，体现连续性和进步
+3. 用充满活力的语气表达惊喜和赞赏
+4. 加入emoji表情，增添趣味性
+5. 给出温暖有趣的鼓励
+
+回复要求：
+1. 语气要活泼自然，像朋友间的对话
+2. 避免过于正式或说教的语气
+3. 多用感叹号表达惊喜
+4. 适当加入一些俏皮可爱的表达"""
+
+FINAL_INSTRUCTIONS = """用户消息中依次给出：用户昵称、【报名目标】、【历史打卡记录】、【本次打卡】（最后一次打卡）。
+
+请生成一个简短的总结（20-30字），要求：
+1. 首先说明用户具体的目标内容（例如："学习Python基础"、"完成项目部署"等）
+2. 然后说明该目标的完成程度（已完成/部分完成/刚起步）
+3. 结合打卡内容，具体说明在目标上取得了什么进展
+4. 加入1个emoji表情点缀
+5. 语气要积极但实事求是
+
+示例格式：
+- 🚀 Python基础学习目标完成70%，已掌握函数和类的使用，数据处理很扎实！
+- ⭐ 项目部署目标完成40%，成功配置了Docker环境，正在学习K8s！"""
+
+DIGEST_INSTRUCTIONS = """用户消息中给出某一天全体成员的打卡记录，每行格式为“昵称（第N次）：打卡内容”。
+
+请为全群生成一份当天的打卡日报，要求：
+1. 开头用一两句话概括今天大家整体的进展和氛围
+2. 按主题把相近的进展归类，点名表扬有代表性的成员，每位被点名的成员用一句话点评
+3. 尽量让每位打卡的成员都被提到，人数很多时可以在同一句中点名多位
+4. 语气活泼，适当加入emoji，但不要夸大打卡内容
+5. 结尾给出一句明天的鼓励
+6. 总长度不超过600字，不要使用Markdown标题"""
+
+FEEDBACK_SYSTEM_PROMPT = f"{SYSTEM_PROMPT}\n\n{FEEDBACK_INSTRUCTIONS}"
+DIGEST_SYSTEM_PROMPT = f"{SYSTEM_PROMPT}\n\n{DIGEST_INSTRUCTIONS}"
+FINAL_SYSTEM_PROMPT = f"{SYSTEM_PROMPT}\n\n{FINAL_INSTRUCTIONS}"
+
+def generate_ai_feedback(db: Session, signup_id: int, nickname: str, goals: str, content: str, checkin_count: int, is_final: bool = False, use_cache: bool = None, period_id: int = None, command: str = "#打卡") -> str:
+    """生成AI反馈，基于用户的历史打卡摘要、最近打卡和目标；用量按 period_id 和 command 计入统计"""
+    if use_cache is None:
+        use_cache = LLM_CACHE_FINAL if is_final else LLM_CACHE_FEEDBACK
+
+    # 历史打卡：早期打卡的滚动摘要 + 最近几次打卡原文，长度受 token 预算约束
+    with stage("history"):
+        history = build_history(db, signup_id)
+    # 查询到此为止，等待大模型期间不占用数据库连接
+    release_connection(db)
     
-    # 根据是否是最终总结调整提示词
-    if is_final:
-        prompt = f"""
-        用户 {nickname} 的学习情况：
-        
-        【报名目标】
-        {goals}
-        
-        【历史打卡记录】
-        {history}
-        
-        【本次打卡】（第{checkin_count}次）
-        {content}
-        
-        请生成一个简短的总结（20-30字），要求：
-        1. 首先说明用户具体的目标内容（例如："学习Python基础"、"完成项目部署"等）
-        2. 然后说明该目标的完成程度（已完成/部分完成/刚起步）
-        3. 结合打卡内容，具体说明在目标上取得了什么进展
-        4. 加入1个emoji表情点缀
-        5. 语气要积极但实事求是
-
-        示例格式：
-        - 🚀 Python基础学习目标完成70%，已掌握函数和类的使用，数据处理很扎实！
-        - ⭐ 项目部署目标完成40%，成功配置了Docker环境，正在学习K8s！
-        """
-    else:
-        prompt = f"""
-        用户 {nickname} 的学习情况：
-        
-        【报名目标】
-        {goals}
-        
-        【历史打卡记录】
-        {history}
-        
-        【本次打卡】（第{checkin_count}次）
-        {content}
-        
-        请根据以上信息生成一段活泼的回复（50字左右），要求：
-        1. 将本次打卡内容与用户目标关联，体现进展
-        2. 参考历史打卡，体现连续性和进步
-        3. 用充满活力的语气表达惊喜和赞赏
-        4. 加入emoji表情，增添趣味性
-        5. 给出温暖有趣的鼓励
-        
-        回复要求：
-        1. 语气要活泼自然，像朋友间的对话
-        2. 避免过于正式或说教的语气
-        3. 多用感叹号表达惊喜
-        4. 适当加入一些俏皮可爱的表达
-        """
+    system_prompt = FINAL_SYSTEM_PROMPT if is_final else FEEDBACK_SYSTEM_PROMPT
+    # 同一用户的目标和历史在前、本次打卡在最后，相邻两次请求的前缀也尽量一致
+    prompt = f"""用户：{nickname}
+
+【报名目标】
+{goals}
+
+【历史打卡记录】
+{history}
+
+【本次打卡】（第{checkin_count}次）
+{content}"""
+
+    cache_key = llm_cache.make_key(DEEPSEEK_MODEL, system_prompt, prompt, FEEDBACK_TEMPERATURE)
+    if use_cache:
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"命中AI反馈缓存 - 用户: {nickname}, 统计: {llm_cache.stats()}")
+            usage_tracker.record_local_hit(period_id, command)
+            return f"✨ 打卡成功！\n📝 第 {checkin_count}/21 次打卡\n\n{cached}"
 
     try:
-        response = http_client.post(
-            DEEPSEEK_API_URL,
-            headers={
-                "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "model": "deepseek-chat",
-                "messages": [
-                    {
-                        "role": "system", 
-                        "content": """你是一个超级活泼可爱的AI助手，善于分析用户的学习进展并给出鼓励。你的回复要既体现对用户目标和历史的关注，又保持轻松愉快的语气。"""
-                    },
-                    {"role": "user", "content": prompt}
-                ],
-                "temperature": 0.8,
-                "max_tokens": 100
-            }
-        )
+        start = time.perf_counter()
+        with stage("llm"):
+            response = http_transport.request_sync(
+                "POST",
+                DEEPSEEK_API_URL,
+                headers={
+                    "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
+                    "Content-Type": "application/json"
+                },
+                json={
+                    "model": DEEPSEEK_MODEL,
+                    "messages": [
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": prompt}
+                    ],
+                    "temperature": FEEDBACK_TEMPERATURE,
+                    "max_tokens": 100
+                }
+            )
         
         if response.status_code == 200:
             result = response.json()
+            usage_tracker.record(period_id, command, result.get("usage"), (time.perf_counter() - start) * 1000)
             ai_feedback = result['choices'][0]['message']['content'].strip()
+            if use_cache:
+                llm_cache.set(cache_key, ai_feedback)
             
             # 构建反馈消息
             return f"✨ 打卡成功！\n📝 第 {checkin_count}/21 次打卡\n\n{ai_feedback}"
             
         else:
-            raise Exception(f"API调用失败: {response.status_code} - {response.text}")
+            raise Exception(f"API调用失败: {response.status_code} - {response.text[:200]}")
             
     except Exception as e:
         logger.error(f"生成AI反馈失败: {str(e)}")
         return f"✅ 打卡成功！\n📊 第 {checkin_count}/21 次打卡\n\n💪 继续加油，期待您的下次分享！"
+
+
+def _digest_lines(entries: List[Tuple[str, int, str]], snippet_chars: int) -> List[str]:
+    lines = []
+    for nickname, checkin_count, content in entries:
+        content = " ".join((content or "").split())
+        if len(content) > snippet_chars:
+            content = content[:snippet_chars] + "…"
+        lines.append(f"{nickname}（第{checkin_count}次）：{content}")
+    return lines
+
+
+def generate_daily_digest(period_id: int, day_label: str, entries: List[Tuple[str, int, str]]) -> Optional[str]:
+    """一次请求为全群当天的打卡生成日报；entries 为 (昵称, 打卡次数, 内容)，失败时返回 None"""
+    lines = _digest_lines(entries, DIGEST_SNIPPET_CHARS)
+    total = estimate_tokens("\n".join(lines))
+    if total > DIGEST_TOKEN_BUDGET:
+        # 人数多时按比例缩短每条打卡，保证所有人都在提示词中
+        snippet_chars = max(20, int(DIGEST_SNIPPET_CHARS * DIGEST_TOKEN_BUDGET / total))
+        lines = _digest_lines(entries, snippet_chars)
+    prompt = f"【{day_label} 打卡记录】（共{len(entries)}人）\n" + "\n".join(lines)
+
+    try:
+        start = time.perf_counter()
+        with stage("llm"):
+            response = http_transport.request_sync(
+                "POST",
+                DEEPSEEK_API_URL,
+                headers={
+                    "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
+                    "Content-Type": "application/json"
+                },
+                json={
+                    "model": DEEPSEEK_MODEL,
+                    "messages": [
+                        {"role": "system", "content": DIGEST_SYSTEM_PROMPT},
+                        {"role": "user", "content": prompt}
+                    ],
+                    "temperature": FEEDBACK_TEMPERATURE,
+                    "max_tokens": DIGEST_MAX_TOKENS
+                }
+            )
+        if response.status_code != 200:
+            raise Exception(f"API调用失败: {response.status_code} - {response.text[:200]}")
+        result = response.json()
+        usage_tracker.record(period_id, "#打卡日报", result.get("usage"), (time.perf_counter() - start) * 1000)
+        return result['choices'][0]['message']['content'].strip()
+    except Exception as e:
+        logger.error(f"生成打卡日报失败: {str(e)}")
+        return None
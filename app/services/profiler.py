@@ -0,0 +1,228 @@
+import cProfile
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 是否开启事件剖析（也可由管理员通过 #性能分析 命令在运行时切换）
+PROFILE_ENABLED = os.getenv("PROFILE_ENABLED", "false").lower() == "true"
+# sample：定时采样调用栈，开销低；cprofile：确定性剖析，信息完整但开销较大
+PROFILE_MODE = os.getenv("PROFILE_MODE", "sample")
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "10"))
+# 超过该耗时的事件才会落盘
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "5000"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles")
+# 最多保留多少个慢事件，超出后删除最旧的
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "50"))
+# 管理员 open_id，逗号分隔：可使用 #性能分析、#用量、#统计 等管理命令
+ADMIN_OPEN_IDS = {x.strip() for x in os.getenv("ADMIN_OPEN_IDS", "").split(",") if x.strip()}
+
+PROFILE_COMMAND = "#性能分析"
+
+# 当前事件的剖析数据；线程和 greenlet 各自独立，异步处理时并发的事件互不干扰
+_current_trace: ContextVar = ContextVar("current_trace", default=None)
+
+# 同一时刻只允许一个事件使用 cProfile：Python 3.11 及以下同一线程上再建一个 Profile 会顶掉前一个，
+# 3.12+ 则直接报错；拿不到锁的并发事件改用采样
+_cprofile_lock = threading.Lock()
+
+
+def is_admin(sender_id: Optional[str]) -> bool:
+    """发送者是否为管理员（ADMIN_OPEN_IDS）"""
+    return bool(sender_id) and sender_id in ADMIN_OPEN_IDS
+
+
+class _StackSampler:
+    """后台线程定时读取被剖析线程的调用栈，按折叠栈（flamegraph 格式）计数
+
+    采样只能按线程区分：异步处理时同一事件循环线程上交替执行的多个事件，
+    采到的调用栈都会计入当前被剖析的事件，其中可能混有其他协程的调用栈
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        # 剖析数据 -> (线程ID, 调用栈计数)
+        self._threads: Dict[object, tuple] = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, key: object, thread_id: int) -> Counter:
+        counter = Counter()
+        with self._lock:
+            self._threads[key] = (thread_id, counter)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+                self._thread.start()
+        return counter
+
+    def stop(self, key: object) -> None:
+        with self._lock:
+            self._threads.pop(key, None)
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._threads:
+                    self._thread = None
+                    return
+                threads = list(self._threads.values())
+            frames = sys._current_frames()
+            for thread_id, counter in threads:
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                if stack:
+                    counter[";".join(reversed(stack))] += 1
+
+
+_sampler = _StackSampler(PROFILE_SAMPLE_INTERVAL_MS / 1000)
+
+
+class _EventTrace:
+    """一个事件的剖析数据：各阶段耗时及调用栈"""
+
+    def __init__(self, event_type: str, event_id: str, command: str):
+        self.event_type = event_type
+        self.event_id = event_id
+        self.command = command
+        # 阶段名 -> [累计毫秒, 次数]
+        self.stages: Dict[str, list] = {}
+
+
+class EventProfiler:
+    def __init__(self, enabled: bool = PROFILE_ENABLED, mode: str = PROFILE_MODE):
+        self.enabled = enabled
+        self.mode = mode
+
+    @contextmanager
+    def trace(self, event_type: str, event_id: str, command: str = ""):
+        """剖析一个事件的处理过程，耗时超过阈值时把剖析结果写入 PROFILE_DIR"""
+        if not self.enabled or _current_trace.get() is not None:
+            yield
+            return
+
+        trace = _EventTrace(event_type, event_id, command)
+        token = _current_trace.set(trace)
+        profile = None
+        samples = None
+        thread_id = threading.get_ident()
+        if self.mode == "cprofile" and _cprofile_lock.acquire(blocking=False):
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # 其他代码（如调试器）已启用了剖析器
+                _cprofile_lock.release()
+                profile = None
+        if profile is None:
+            # 异步处理时同一线程上的多个事件交替执行，采样到的是该线程当时正在运行的调用栈
+            samples = _sampler.start(trace, thread_id)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if profile is not None:
+                profile.disable()
+                _cprofile_lock.release()
+            else:
+                _sampler.stop(trace)
+            _current_trace.reset(token)
+            if elapsed_ms >= PROFILE_SLOW_MS:
+                try:
+                    self._dump(trace, elapsed_ms, profile, samples)
+                except Exception as e:
+                    logger.error(f"写入剖析结果失败: {str(e)}")
+
+    def _dump(self, trace: _EventTrace, elapsed_ms: float, profile: Optional[cProfile.Profile],
+              samples: Optional[Counter]) -> None:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        base = os.path.join(
+            PROFILE_DIR,
+            f"{datetime.now().strftime('%Y%m%d-%H%M%S')}_{trace.event_type}_{trace.event_id}"
+        )
+        summary = {
+            "event_type": trace.event_type,
+            "event_id": trace.event_id,
+            "command": trace.command,
+            "elapsed_ms": round(elapsed_ms, 1),
+            "stages": {
+                name: {"total_ms": round(total, 1), "count": count}
+                for name, (total, count) in sorted(trace.stages.items(), key=lambda x: -x[1][0])
+            }
+        }
+        with open(f"{base}.json", "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        if profile is not None:
+            # 可用 python -m pstats 或 snakeviz 查看
+            profile.dump_stats(f"{base}.prof")
+        elif samples:
+            # 折叠栈格式，可直接交给 flamegraph.pl / speedscope
+            with open(f"{base}.folded", "w", encoding="utf-8") as f:
+                for stack, count in samples.most_common():
+                    f.write(f"{stack} {count}\n")
+        logger.warning(f"慢事件 {trace.event_id} 耗时 {elapsed_ms:.0f}ms，剖析结果已写入 {base}.*")
+        self._rotate()
+
+    def _rotate(self) -> None:
+        """按事件分组，只保留最近的 PROFILE_KEEP 个"""
+        groups: Dict[str, float] = {}
+        for name in os.listdir(PROFILE_DIR):
+            stem, _ = os.path.splitext(name)
+            mtime = os.path.getmtime(os.path.join(PROFILE_DIR, name))
+            groups[stem] = max(groups.get(stem, 0), mtime)
+        expired = sorted(groups, key=groups.get)[:-PROFILE_KEEP] if len(groups) > PROFILE_KEEP else []
+        for name in os.listdir(PROFILE_DIR):
+            if os.path.splitext(name)[0] in expired:
+                os.remove(os.path.join(PROFILE_DIR, name))
+
+    def handle_command(self, sender_id: str, message_content: str) -> Optional[str]:
+        """管理员命令：#性能分析 开启 / 关闭 / 状态"""
+        if not is_admin(sender_id):
+            logger.info(f"非管理员尝试切换性能分析 - 发送者: {sender_id}")
+            return None
+        arg = message_content.strip()[len(PROFILE_COMMAND):].strip()
+        if arg == "开启":
+            self.enabled = True
+        elif arg == "关闭":
+            self.enabled = False
+        elif arg != "状态":
+            return f"用法：{PROFILE_COMMAND} 开启 / 关闭 / 状态"
+        logger.info(f"性能分析{'已开启' if self.enabled else '已关闭'} - 操作者: {sender_id}")
+        return (f"🔬 性能分析：{'已开启' if self.enabled else '已关闭'}（{self.mode}），"
+                f"耗时超过 {PROFILE_SLOW_MS:.0f}ms 的事件会写入 {PROFILE_DIR}")
+
+
+@contextmanager
+def stage(name: str):
+    """记录当前事件中某个阶段的耗时（未在剖析时几乎没有开销）"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        entry = trace.stages.setdefault(name, [0.0, 0])
+        entry[0] += (time.perf_counter() - start) * 1000
+        entry[1] += 1
+
+
+profiler = EventProfiler()
@@ -0,0 +1,84 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 每个发送者：每分钟补充的令牌数 / 桶容量（允许的突发）
+RATE_USER_PER_MIN = float(os.getenv("RATE_USER_PER_MIN", "6"))
+RATE_USER_BURST = float(os.getenv("RATE_USER_BURST", "3"))
+# 每个会话（群）
+RATE_CHAT_PER_MIN = float(os.getenv("RATE_CHAT_PER_MIN", "120"))
+RATE_CHAT_BURST = float(os.getenv("RATE_CHAT_BURST", "30"))
+# 每类最多跟踪的桶数量，超出后淘汰最久未活动的桶，内存占用固定
+RATE_MAX_KEYS = int(os.getenv("RATE_MAX_KEYS", "10000"))
+# 被限流时是否回复一次提示（每个桶在恢复前只提示一次）
+RATE_LIMIT_REPLY = os.getenv("RATE_LIMIT_REPLY", "true").lower() == "true"
+
+RATE_LIMITED_MESSAGE = "⏳ 操作太频繁啦，请稍后再试～"
+
+
+class TokenBucketLimiter:
+    """按 key 的令牌桶限流，桶数量有上限（LRU 淘汰）"""
+
+    def __init__(self, per_minute: float, burst: float, max_keys: int):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.max_keys = max_keys
+        # key -> [令牌数, 上次更新时间, 是否已提示过]
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str) -> Tuple[bool, bool]:
+        """尝试取一个令牌，返回 (是否放行, 是否应当发送限流提示)"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = [self.burst, now, False]
+                self._buckets[key] = bucket
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                bucket[2] = False
+                return True, False
+
+            should_notify = not bucket[2]
+            bucket[2] = True
+            return False, should_notify
+
+    def refund(self, key: str) -> None:
+        """退还一个令牌：请求在后续的检查中被拒绝时，不计入该 key 的额度"""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket[0] = min(self.burst, bucket[0] + 1)
+
+
+user_limiter = TokenBucketLimiter(RATE_USER_PER_MIN, RATE_USER_BURST, RATE_MAX_KEYS)
+chat_limiter = TokenBucketLimiter(RATE_CHAT_PER_MIN, RATE_CHAT_BURST, RATE_MAX_KEYS)
+
+
+def admit(sender_id: str, chat_id: str) -> Tuple[bool, str]:
+    """准入检查：先按发送者、再按会话限流。返回 (是否放行, 需要回复的提示或 None)"""
+    if sender_id:
+        allowed, notify = user_limiter.acquire(sender_id)
+        if not allowed:
+            return False, RATE_LIMITED_MESSAGE if notify and RATE_LIMIT_REPLY else None
+    if chat_id:
+        allowed, notify = chat_limiter.acquire(chat_id)
+        if not allowed:
+            # 被会话限流的消息不应消耗发送者自己的额度
+            if sender_id:
+                user_limiter.refund(sender_id)
+            return False, RATE_LIMITED_MESSAGE if notify and RATE_LIMIT_REPLY else None
+    return True, None
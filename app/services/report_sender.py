@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Callable, List, Optional
+from dotenv import load_dotenv
+from sqlalchemy.util import await_only, greenlet_spawn
+from .http_client import http_transport
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 单条消息的最大字符数（飞书文本消息有大小限制，过长的消息也不便阅读）
+REPORT_CHUNK_CHARS = int(os.getenv("REPORT_CHUNK_CHARS", "4000"))
+# 已生成的内容最多缓冲多久就先发出去，保证第一部分尽快到达群里
+REPORT_FLUSH_SECONDS = float(os.getenv("REPORT_FLUSH_SECONDS", "20"))
+
+_SENTINEL = object()
+
+
+def split_text(content: str, limit: int) -> List[str]:
+    """把超长的单个段落按行切分，单行仍超长时硬切"""
+    pieces = []
+    current = ""
+    for line in content.split("\n"):
+        while len(line) > limit:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(line[:limit])
+            line = line[limit:]
+        candidate = f"{current}\n{line}" if current else line
+        if len(candidate) > limit:
+            pieces.append(current)
+            current = line
+        else:
+            current = candidate
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+class ReportStream:
+    """分段发送长报告：按段落写入，超过大小或缓冲时间后切成带编号的消息，由后台线程按顺序发送
+    （异步处理链路中改为共享事件循环上的任务）。不传 send 时只收集内容，close() 返回完整文本。"""
+
+    def __init__(self, send: Optional[Callable[[str], bool]] = None,
+                 limit: int = REPORT_CHUNK_CHARS, flush_seconds: float = REPORT_FLUSH_SECONDS):
+        self.send = send
+        # 预留编号行的长度
+        self.limit = max(limit - 30, 100)
+        self.flush_seconds = flush_seconds
+        self._sections: List[str] = []
+        self._buffer: List[str] = []
+        self._buffer_size = 0
+        self._buffer_started = None
+        self._chunk_no = 0
+        self._queue = None
+        self._worker = None
+        if send and http_transport.in_async_handler():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.ensure_future(self._drain_async())
+        elif send:
+            self._queue = queue.Queue()
+            self._worker = threading.Thread(target=self._drain, name="report-sender", daemon=True)
+            self._worker.start()
+
+    def _drain(self) -> None:
+        """后台线程：按顺序发送已切好的消息，生成与发送并行"""
+        while True:
+            chunk = self._queue.get()
+            if chunk is _SENTINEL:
+                return
+            self._send_chunk(chunk)
+
+    async def _drain_async(self) -> None:
+        """事件循环上的发送任务：send 是同步函数，放到 greenlet 中执行，其中的请求等待时让出事件循环"""
+        while True:
+            chunk = await self._queue.get()
+            if chunk is _SENTINEL:
+                return
+            await greenlet_spawn(self._send_chunk, chunk)
+
+    def _send_chunk(self, chunk: str) -> None:
+        for attempt in range(2):
+            try:
+                if self.send(chunk):
+                    return
+            except Exception as e:
+                logger.error(f"发送报告分段失败: {str(e)}")
+            if attempt == 0:
+                http_transport.sleep(1)
+        logger.error(f"报告分段发送失败，已放弃: {chunk[:50]}...")
+
+    def _emit(self, final: bool) -> None:
+        if not self._buffer:
+            return
+        content = "\n".join(self._buffer)
+        self._buffer = []
+        self._buffer_size = 0
+        self._buffer_started = None
+        self._chunk_no += 1
+        # 只有一段时不加编号
+        if not (final and self._chunk_no == 1):
+            suffix = "（完）" if final else "，未完待续…"
+            content = f"{content}\n\n📄 第 {self._chunk_no} 部分{suffix}"
+        self._queue.put_nowait(content)
+
+    def write(self, section: str) -> None:
+        """写入一个段落"""
+        if not self.send:
+            self._sections.append(section)
+            return
+
+        for piece in split_text(section, self.limit):
+            if self._buffer and self._buffer_size + len(piece) + 1 > self.limit:
+                self._emit(final=False)
+            if self._buffer_started is None:
+                self._buffer_started = time.monotonic()
+            self._buffer.append(piece)
+            self._buffer_size += len(piece) + 1
+
+        if self._buffer_started is not None and time.monotonic() - self._buffer_started >= self.flush_seconds:
+            self._emit(final=False)
+
+    def close(self, timeout: float = 60) -> Optional[str]:
+        """结束报告：发送剩余内容并等待发送完成；收集模式下返回完整文本"""
+        if not self.send:
+            return "\n".join(self._sections)
+        if self._buffer:
+            self._emit(final=True)
+        elif self._chunk_no >= 1:
+            # 最后一部分已因缓冲超时发出，补一条结束提示
+            self._queue.put_nowait(f"📄 以上共 {self._chunk_no} 部分（完）")
+        self._queue.put_nowait(_SENTINEL)
+        if isinstance(self._worker, threading.Thread):
+            self._worker.join(timeout=timeout)
+        else:
+            try:
+                await_only(asyncio.wait_for(asyncio.shield(self._worker), timeout))
+            except asyncio.TimeoutError:
+                logger.error("等待报告分段发送超时")
+        return None
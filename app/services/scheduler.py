@@ -0,0 +1,320 @@
+import heapq
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional, Tuple
+from dotenv import load_dotenv
+from sqlalchemy import and_, update
+from sqlalchemy.orm import Session
+from app.models.database import Period, Signup, Checkin, ScheduledJob, SessionLocal
+from .chat_settings import chat_settings, FEEDBACK_DIGEST
+from .openai_service import generate_daily_digest
+from .archive_service import ARCHIVE_AFTER_DAYS, archive_ended_periods
+from .job_lanes import job_lanes, LANE_BULK, LANE_FAST
+from .report_sender import ReportStream
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 是否启用定时任务（期数到期自动结束、每日打卡提醒和汇总、到期归档）
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() == "true"
+# 每日打卡提醒的时间（HH:MM）
+REMINDER_TIME = os.getenv("REMINDER_TIME", "20:00")
+# 停机期间错过的提醒，超过这个时间就不再补发
+REMINDER_GRACE_MINUTES = int(os.getenv("REMINDER_GRACE_MINUTES", "120"))
+# 任务失败后的重试次数和间隔
+JOB_MAX_ATTEMPTS = 3
+JOB_RETRY_SECONDS = 300
+# 最长休眠时间，避免系统时间调整后错过任务
+MAX_SLEEP_SECONDS = 60
+
+JOB_PERIOD_CLOSE = "period_close"
+JOB_DAILY_REMINDER = "daily_reminder"
+JOB_PERIOD_ARCHIVE = "period_archive"
+JOB_DAILY_DIGEST = "daily_digest"
+
+
+def next_daily_time(after: datetime, at: str) -> datetime:
+    """after 之后下一次到达每日时刻 at（HH:MM）的时间"""
+    hour, minute = (int(x) for x in at.split(":"))
+    run_at = after.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if run_at <= after:
+        run_at += timedelta(days=1)
+    return run_at
+
+
+def next_reminder_time(after: datetime) -> datetime:
+    """after 之后的下一个提醒时间"""
+    return next_daily_time(after, REMINDER_TIME)
+
+
+def missing_checkins(db: Session, period_id: int, day) -> List[Tuple[str, Optional[str]]]:
+    """某期在 day 当天还没有打卡的报名者 (昵称, open_id)，一次反连接查询"""
+    return db.query(Signup.nickname, Signup.open_id)\
+        .outerjoin(Checkin, and_(Checkin.signup_id == Signup.id, Checkin.checkin_date == day))\
+        .filter(Signup.period_id == period_id)\
+        .filter(Checkin.id.is_(None))\
+        .order_by(Signup.id)\
+        .all()
+
+
+class Scheduler:
+    """定时任务调度：scheduled_jobs 表是任务的持久化来源，内存中用按执行时间排序的小顶堆，
+    后台线程睡到堆顶任务到期，再按任务类型交给对应的执行通道（JOB_LANES）"""
+
+    def __init__(self, session_factory: Callable[[], Session] = SessionLocal):
+        self.session_factory = session_factory
+        self.send: Optional[Callable[[str, str], bool]] = None
+        # (执行时间, 任务ID, 任务类型)
+        self._heap: List[Tuple[datetime, int, str]] = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def start(self, send: Callable[[str, str], bool]) -> None:
+        """加载数据库中未执行的任务并启动调度线程；send(chat_id, text) 用于向群里发消息"""
+        self.send = send
+        db = self.session_factory()
+        try:
+            # 上次停机时正在执行的任务重新执行
+            db.execute(update(ScheduledJob).where(ScheduledJob.status == 'running').values(status='pending'))
+            db.commit()
+            self._ensure_jobs(db)
+            jobs = db.query(ScheduledJob.run_at, ScheduledJob.id, ScheduledJob.kind)\
+                .filter(ScheduledJob.status == 'pending')\
+                .all()
+        finally:
+            db.close()
+        with self._cond:
+            self._stopped = False
+            for run_at, job_id, kind in jobs:
+                heapq.heappush(self._heap, (run_at, job_id, kind))
+        self._thread = threading.Thread(target=self._run, name="scheduler", daemon=True)
+        self._thread.start()
+        logger.info(f"定时任务已启动，待执行 {len(jobs)} 个")
+
+    def stop(self, timeout: float = 5) -> None:
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+
+    def _ensure_jobs(self, db: Session) -> None:
+        """为进行中的期数补上缺少的自动结束、每日提醒和日报任务（如升级前创建的期数）"""
+        periods = db.query(Period)\
+            .filter(Period.status == '进行中')\
+            .filter(Period.chat_id.isnot(None))\
+            .all()
+        for period in periods:
+            kinds = {kind for (kind,) in db.query(ScheduledJob.kind)
+                     .filter(ScheduledJob.period_id == period.id)
+                     .filter(ScheduledJob.status == 'pending')}
+            if JOB_PERIOD_CLOSE not in kinds:
+                self.schedule(db, JOB_PERIOD_CLOSE, period.id, period.chat_id, period.end_date)
+            if JOB_DAILY_REMINDER not in kinds:
+                self.schedule(db, JOB_DAILY_REMINDER, period.id, period.chat_id, next_reminder_time(datetime.now()))
+            feedback_mode, digest_time = chat_settings.get(db, period.chat_id)
+            if feedback_mode == FEEDBACK_DIGEST and JOB_DAILY_DIGEST not in kinds:
+                self.schedule(db, JOB_DAILY_DIGEST, period.id, period.chat_id, next_daily_time(datetime.now(), digest_time))
+
+    def schedule(self, db: Session, kind: str, period_id: Optional[int], chat_id: Optional[str],
+                 run_at: datetime) -> ScheduledJob:
+        """新增任务并提交；同一期同类型的待执行任务只保留一个，再次调度时改为新的执行时间"""
+        job = db.query(ScheduledJob)\
+            .filter(ScheduledJob.kind == kind)\
+            .filter(ScheduledJob.period_id == period_id)\
+            .filter(ScheduledJob.status == 'pending')\
+            .first()
+        if job:
+            job.run_at = run_at
+            job.chat_id = chat_id
+        else:
+            job = ScheduledJob(kind=kind, period_id=period_id, chat_id=chat_id, run_at=run_at, status='pending')
+            db.add(job)
+        db.commit()
+        self._push(run_at, job.id, kind)
+        logger.info(f"已安排定时任务 {kind} - 期数ID: {period_id}, 执行时间: {run_at:%Y-%m-%d %H:%M}")
+        return job
+
+    def cancel(self, db: Session, kind: str, period_id: Optional[int]) -> int:
+        """取消某期某类型的待执行任务并提交，返回取消的个数"""
+        cancelled = db.execute(
+            update(ScheduledJob)
+            .where(ScheduledJob.kind == kind)
+            .where(ScheduledJob.period_id == period_id)
+            .where(ScheduledJob.status == 'pending')
+            .values(status='cancelled')
+        ).rowcount
+        db.commit()
+        return cancelled
+
+    def _push(self, run_at: datetime, job_id: int, kind: str) -> None:
+        with self._cond:
+            heapq.heappush(self._heap, (run_at, job_id, kind))
+            self._cond.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    now = datetime.now()
+                    if self._heap and self._heap[0][0] <= now:
+                        break
+                    timeout = MAX_SLEEP_SECONDS
+                    if self._heap:
+                        timeout = min(timeout, (self._heap[0][0] - now).total_seconds())
+                    self._cond.wait(timeout)
+                if self._stopped:
+                    return
+                _, job_id, kind = heapq.heappop(self._heap)
+            try:
+                job_lanes.submit(JOB_LANES.get(kind, LANE_BULK), self._execute, job_id)
+            except RuntimeError:
+                # 通道已关闭（服务正在停止），任务保留在数据库中，下次启动时执行
+                return
+
+    def _execute(self, job_id: int) -> None:
+        db = self.session_factory()
+        try:
+            # 认领任务：已被改期（堆中还有新的条目）或已执行的任务直接跳过
+            claimed = db.execute(
+                update(ScheduledJob)
+                .where(ScheduledJob.id == job_id)
+                .where(ScheduledJob.status == 'pending')
+                .where(ScheduledJob.run_at <= datetime.now())
+                .values(status='running', attempts=ScheduledJob.attempts + 1)
+            ).rowcount
+            db.commit()
+            if not claimed:
+                return
+
+            job = db.get(ScheduledJob, job_id)
+            logger.info(f"执行定时任务 {job.kind} - 期数ID: {job.period_id}")
+            try:
+                JOB_RUNNERS[job.kind](self, db, job)
+                job.status = 'done'
+            except Exception as e:
+                logger.error(f"定时任务 {job_id} 执行失败: {str(e)}", exc_info=True)
+                db.rollback()
+                job = db.get(ScheduledJob, job_id)
+                job.last_error = str(e)[:1000]
+                if job.attempts >= JOB_MAX_ATTEMPTS:
+                    job.status = 'failed'
+                else:
+                    job.status = 'pending'
+                    job.run_at = datetime.now() + timedelta(seconds=JOB_RETRY_SECONDS)
+                    self._push(job.run_at, job.id, job.kind)
+            db.commit()
+        finally:
+            db.close()
+
+    def _notify(self, chat_id: str, text: str) -> bool:
+        if self.send is None or not chat_id:
+            logger.warning(f"定时任务消息未发送（未设置群）: {text[:50]}")
+            return False
+        return self.send(chat_id, text)
+
+    def _close_period(self, db: Session, job: ScheduledJob) -> None:
+        """期数到期：进行中的活动自动结束并发送总结"""
+        # 避免循环导入：message_handler 依赖本模块安排任务
+        from .message_handler import MessageHandler
+
+        period = db.get(Period, job.period_id)
+        if period is None or period.status in ('已结束', '结算中'):
+            return
+        if period.status != '进行中':
+            logger.warning(f"期数 {period.period_name} 已到结束时间，但仍处于{period.status}状态，未自动结束")
+            return
+        self._notify(job.chat_id, f"⏰ {period.period_name}期已到结束时间，自动结束本期活动")
+        handler = MessageHandler(db, notify=lambda text: self._notify(job.chat_id, text))
+        reply = handler.handle_activity_end(job.chat_id, period_id=job.period_id)
+        if reply:
+            self._notify(job.chat_id, reply)
+
+    def _send_reminder(self, db: Session, job: ScheduledJob) -> None:
+        """每日提醒：列出今天还没有打卡的人，并安排下一天的提醒"""
+        period = db.get(Period, job.period_id)
+        if period is None or period.status != '进行中':
+            return
+        now = datetime.now()
+        if now - job.run_at > timedelta(minutes=REMINDER_GRACE_MINUTES):
+            logger.info(f"跳过过期的打卡提醒 - 期数: {period.period_name}, 原定时间: {job.run_at}")
+        else:
+            missing = missing_checkins(db, period.id, now.date())
+            if missing:
+                report = ReportStream(lambda text: self._notify(job.chat_id, text))
+                report.write(f"⏰ {period.period_name}期今日打卡提醒：还有 {len(missing)} 位小伙伴今天没有打卡")
+                for nickname, open_id in missing:
+                    report.write(f'<at user_id="{open_id}">{nickname}</at>' if open_id else nickname)
+                report.write("发送「#打卡 今天的进展」即可完成打卡，加油！💪")
+                report.close()
+        next_run = next_reminder_time(now)
+        if next_run < period.end_date:
+            self.schedule(db, JOB_DAILY_REMINDER, period.id, job.chat_id, next_run)
+
+    def _send_digest(self, db: Session, job: ScheduledJob) -> None:
+        """每日汇总：一次 LLM 请求点评当天全部打卡，发一条日报，并安排下一天的汇总"""
+        period = db.get(Period, job.period_id)
+        if period is None or period.status != '进行中':
+            return
+        feedback_mode, digest_time = chat_settings.get(db, job.chat_id)
+        if feedback_mode != FEEDBACK_DIGEST:
+            return
+        now = datetime.now()
+        day = job.run_at.date()
+        if now - job.run_at > timedelta(minutes=REMINDER_GRACE_MINUTES):
+            logger.info(f"跳过过期的打卡日报 - 期数: {period.period_name}, 原定时间: {job.run_at}")
+        else:
+            entries = db.query(Signup.nickname, Checkin.checkin_count, Checkin.content)\
+                .join(Signup, Signup.id == Checkin.signup_id)\
+                .filter(Signup.period_id == period.id)\
+                .filter(Checkin.checkin_date == day)\
+                .filter(Checkin.duplicate_of.is_(None))\
+                .order_by(Checkin.id)\
+                .all()
+            if entries:
+                digest = generate_daily_digest(period.id, f"{day:%m月%d日}", entries)
+                report = ReportStream(lambda text: self._notify(job.chat_id, text))
+                report.write(f"📰 {period.period_name}期 {day:%m月%d日} 打卡日报（{len(entries)} 人打卡）")
+                if digest:
+                    report.write(digest)
+                else:
+                    report.write("今天打卡的小伙伴：" + "、".join(nickname for nickname, _, _ in entries) + "\n继续加油！🌟")
+                report.close()
+        next_run = next_daily_time(now, digest_time)
+        if next_run < period.end_date:
+            self.schedule(db, JOB_DAILY_DIGEST, period.id, job.chat_id, next_run)
+
+    def _archive(self, db: Session, job: ScheduledJob) -> None:
+        """归档结束超过 ARCHIVE_AFTER_DAYS 天的期数"""
+        names = archive_ended_periods(db)
+        if names:
+            logger.info(f"已自动归档期数: {', '.join(names)}")
+
+
+JOB_RUNNERS = {
+    JOB_PERIOD_CLOSE: Scheduler._close_period,
+    JOB_DAILY_REMINDER: Scheduler._send_reminder,
+    JOB_PERIOD_ARCHIVE: Scheduler._archive,
+    JOB_DAILY_DIGEST: Scheduler._send_digest,
+}
+
+# 自动结束和归档走吞吐通道（与手动 #活动结束 的互斥由期数的结算中状态保证）；
+# 提醒和日报只发一条消息，走快速通道，不排在长任务后面
+JOB_LANES = {
+    JOB_PERIOD_CLOSE: LANE_BULK,
+    JOB_DAILY_REMINDER: LANE_FAST,
+    JOB_PERIOD_ARCHIVE: LANE_BULK,
+    JOB_DAILY_DIGEST: LANE_FAST,
+}
+
+
+def archive_time(period: Period) -> datetime:
+    """期数的归档时间：结束日期（已过时取当前时间）之后 ARCHIVE_AFTER_DAYS 天"""
+    return max(period.end_date, datetime.now()) + timedelta(days=ARCHIVE_AFTER_DAYS)
+
+
+scheduler = Scheduler()
@@ -0,0 +1,214 @@
+import heapq
+import logging
+import math
+import os
+import re
+import threading
+from collections import defaultdict
+from typing import Iterable, List, Dict, Any, Tuple
+from dotenv import load_dotenv
+from sqlalchemy import select, text
+from sqlalchemy.orm import Session
+from app.models.database import Period, Signup, Checkin
+from app.services.http_client import http_transport
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SEARCH_TOP_K = int(os.getenv("SEARCH_TOP_K", "10"))
+SNIPPET_RADIUS = 30
+
+_WORD_RE = re.compile(r"[a-z0-9_+#.]+|[一-鿿]+")
+
+
+def tokenize(content: str) -> List[str]:
+    """分词：英文按单词，中文按二元组（与 MySQL ngram_token_size=2 一致）"""
+    tokens = []
+    for word in _WORD_RE.findall(content.lower()):
+        if '一' <= word[0] <= '鿿':
+            if len(word) == 1:
+                tokens.append(word)
+            else:
+                tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        else:
+            tokens.append(word.strip("."))
+    return [t for t in tokens if t]
+
+
+class InvertedIndex:
+    """进程内倒排索引，用于 SQLite 部署；文档键为 ("c", 打卡ID) 或 ("g", 报名ID)"""
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[Tuple[str, int], int]] = defaultdict(dict)
+        self._doc_lengths: Dict[Tuple[str, int], int] = {}
+        self._lock = threading.Lock()
+        self.loaded = False
+
+    def add(self, doc_key: Tuple[str, int], content: str) -> None:
+        """增量加入一个文档"""
+        tokens = tokenize(content or "")
+        if not tokens:
+            return
+        counts: Dict[str, int] = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        with self._lock:
+            for token, tf in counts.items():
+                self._postings[token][doc_key] = tf
+            self._doc_lengths[doc_key] = len(tokens)
+
+    def remove(self, doc_keys: Iterable[Tuple[str, int]]) -> None:
+        """删除文档（期数归档后热表中已没有这些行，不删除会一直占用内存）"""
+        doc_keys = set(doc_keys)
+        if not doc_keys:
+            return
+        with self._lock:
+            for doc_key in doc_keys:
+                self._doc_lengths.pop(doc_key, None)
+            for token in list(self._postings):
+                posting = self._postings[token]
+                for doc_key in posting.keys() & doc_keys:
+                    del posting[doc_key]
+                if not posting:
+                    del self._postings[token]
+
+    def search(self, query: str, limit: int) -> List[Tuple[float, Tuple[str, int]]]:
+        """返回得分最高的 limit 个文档，要求包含查询中的所有词"""
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return []
+        with self._lock:
+            postings = [self._postings.get(token, {}) for token in tokens]
+            if any(not p for p in postings):
+                return []
+            postings.sort(key=len)
+            total = len(self._doc_lengths)
+            candidates = set(postings[0])
+            for p in postings[1:]:
+                candidates &= p.keys()
+                if not candidates:
+                    return []
+            idf = [math.log(1 + total / len(p)) for p in postings]
+            scored = (
+                (sum(p[doc] * w for p, w in zip(postings, idf)) / math.sqrt(self._doc_lengths[doc]), doc)
+                for doc in candidates
+            )
+            return heapq.nlargest(limit, scored)
+
+    def __len__(self) -> int:
+        return len(self._doc_lengths)
+
+
+_index = InvertedIndex()
+
+
+def _use_fulltext(db: Session) -> bool:
+    return db.get_bind().dialect.name == "mysql"
+
+
+def _add_documents(docs: List[Tuple[Tuple[str, int], str]]) -> None:
+    for doc_key, content in docs:
+        _index.add(doc_key, content)
+
+
+def _ensure_loaded(db: Session) -> None:
+    """首次搜索时从数据库构建进程内索引，之后由每次打卡增量更新。
+    构建期间不持有锁：异步处理时查询会让出事件循环，持锁会阻塞同一线程上的其他事件；
+    分词是 CPU 密集计算，每批行读出后放到线程池中加入索引。
+    并发的首次搜索各自重复写入同样的文档，结果一致"""
+    if _index.loaded:
+        return
+    logger.info("开始构建打卡全文索引")
+    for stmt, kind in ((select(Checkin.id, Checkin.content), "c"), (select(Signup.id, Signup.goals), "g")):
+        for rows in db.execute(stmt.execution_options(yield_per=1000)).partitions():
+            http_transport.run_blocking(_add_documents, [((kind, doc_id), content) for doc_id, content in rows])
+    _index.loaded = True
+    logger.info(f"全文索引构建完成，共 {len(_index)} 个文档")
+
+
+def index_checkin(db: Session, checkin_id: int, content: str) -> None:
+    """新打卡写入后更新索引（MySQL 由 FULLTEXT 索引自动维护）"""
+    if not _use_fulltext(db):
+        _index.add(("c", checkin_id), content)
+
+
+def index_signup(db: Session, signup_id: int, goals: str) -> None:
+    """新报名写入后更新索引（MySQL 由 FULLTEXT 索引自动维护）"""
+    if not _use_fulltext(db):
+        _index.add(("g", signup_id), goals)
+
+
+def unindex(db: Session, checkin_ids: Iterable[int], signup_ids: Iterable[int]) -> None:
+    """打卡和报名从热表删除（归档）后移出索引（MySQL 由 FULLTEXT 索引自动维护）"""
+    if not _use_fulltext(db):
+        _index.remove([("c", checkin_id) for checkin_id in checkin_ids] +
+                      [("g", signup_id) for signup_id in signup_ids])
+
+
+def _snippet(content: str, keyword: str) -> str:
+    """截取关键词附近的片段"""
+    content = " ".join((content or "").split())
+    pos = content.lower().find(keyword.lower())
+    if pos < 0:
+        pos = 0
+    start = max(0, pos - SNIPPET_RADIUS)
+    end = min(len(content), pos + len(keyword) + SNIPPET_RADIUS)
+    return ("…" if start > 0 else "") + content[start:end] + ("…" if end < len(content) else "")
+
+
+def _fulltext_doc_keys(db: Session, keyword: str, limit: int) -> List[Tuple[str, int]]:
+    """MySQL：使用 ngram 解析器的 FULLTEXT 索引检索"""
+    query = " ".join(f'+"{t}"' for t in keyword.replace('"', " ").split())
+    rows = db.execute(text("""
+        (SELECT 'c' AS kind, id, MATCH(content) AGAINST(:q IN BOOLEAN MODE) AS score
+           FROM checkins WHERE MATCH(content) AGAINST(:q IN BOOLEAN MODE))
+        UNION ALL
+        (SELECT 'g' AS kind, id, MATCH(goals) AGAINST(:q IN BOOLEAN MODE) AS score
+           FROM signups WHERE MATCH(goals) AGAINST(:q IN BOOLEAN MODE))
+        ORDER BY score DESC LIMIT :limit
+    """), {"q": query, "limit": limit}).all()
+    return [(row.kind, row.id) for row in rows]
+
+
+def search(db: Session, keyword: str, limit: int = SEARCH_TOP_K) -> List[Dict[str, Any]]:
+    """在所有期数的打卡内容和报名目标中搜索关键词，返回 top-k 结果"""
+    if _use_fulltext(db):
+        doc_keys = _fulltext_doc_keys(db, keyword, limit)
+    else:
+        _ensure_loaded(db)
+        doc_keys = [doc for _, doc in _index.search(keyword, limit)]
+
+    checkin_ids = [doc_id for kind, doc_id in doc_keys if kind == "c"]
+    signup_ids = [doc_id for kind, doc_id in doc_keys if kind == "g"]
+    found: Dict[Tuple[str, int], Dict[str, Any]] = {}
+
+    if checkin_ids:
+        rows = db.query(Checkin.id, Checkin.content, Checkin.checkin_date, Signup.nickname, Period.period_name)\
+            .join(Signup, Signup.id == Checkin.signup_id)\
+            .join(Period, Period.id == Signup.period_id)\
+            .filter(Checkin.id.in_(checkin_ids))\
+            .all()
+        for row in rows:
+            found[("c", row.id)] = {
+                "period_name": row.period_name,
+                "nickname": row.nickname,
+                "source": f"{row.checkin_date} 打卡",
+                "snippet": _snippet(row.content, keyword)
+            }
+
+    if signup_ids:
+        rows = db.query(Signup.id, Signup.goals, Signup.nickname, Period.period_name)\
+            .join(Period, Period.id == Signup.period_id)\
+            .filter(Signup.id.in_(signup_ids))\
+            .all()
+        for row in rows:
+            found[("g", row.id)] = {
+                "period_name": row.period_name,
+                "nickname": row.nickname,
+                "source": "报名目标",
+                "snippet": _snippet(row.goals, keyword)
+            }
+
+    # 保持相关度顺序；索引中已删除的记录直接跳过
+    return [found[doc] for doc in doc_keys if doc in found]
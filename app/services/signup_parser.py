@@ -0,0 +1,80 @@
+"""
+接龙信息解析：把多维表“接龙信息”字段的文本解析成报名记录。
+
+每条报名以“昵称-...-专注领域”行开头，后面可以跟“自我介绍：”和“本期目标：”行，例如：
+
+    小明-北京-后端开发
+    自我介绍：五年 Java 开发
+    本期目标：完成小程序上线
+
+横线少于两个的行整行作为昵称，专注领域记为“未知”；出现在第一条报名之前的其他行会被忽略。
+"""
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+SIGNUP_FIELD = "接龙信息"
+INTRODUCTION_LABEL = "自我介绍："
+GOALS_LABEL = "本期目标："
+UNKNOWN_FOCUS_AREA = "未知"
+
+
+def parse_signup_text(text: str, signup_time: Optional[datetime] = None) -> Iterator[Dict[str, Any]]:
+    """逐行扫描一段接龙文本，依次产出报名记录"""
+    if not text:
+        return
+    if signup_time is None:
+        signup_time = datetime.now()
+
+    current = None
+    for line in text.split("\n"):
+        line = line.strip()
+        if not line:
+            continue
+
+        first_dash = line.find("-")
+        if first_dash >= 0:
+            # 昵称行：结束上一条报名
+            if current is not None:
+                yield current
+                current = None
+            last_dash = line.rfind("-")
+            if last_dash != first_dash:
+                nickname = line[:first_dash].strip()
+                focus_area = line[last_dash + 1:].strip()
+            else:
+                nickname = line
+                focus_area = UNKNOWN_FOCUS_AREA
+            if nickname:
+                current = {
+                    "nickname": nickname,
+                    "focus_area": focus_area,
+                    "introduction": "",
+                    "goals": "",
+                    "signup_time": signup_time
+                }
+        elif current is not None:
+            _, label, value = line.partition(INTRODUCTION_LABEL)
+            if label:
+                current["introduction"] = value.strip()
+                continue
+            _, label, value = line.partition(GOALS_LABEL)
+            if label:
+                current["goals"] = value.strip()
+
+    if current is not None:
+        yield current
+
+
+def parse_signup_records(records: Iterable[Dict[str, Any]], field: str = SIGNUP_FIELD,
+                         signup_time: Optional[datetime] = None) -> Iterator[Dict[str, Any]]:
+    """解析多维表记录（记录接口返回的 items，或直接是 fields 字典）中的接龙信息"""
+    if signup_time is None:
+        signup_time = datetime.now()
+    for record in records:
+        fields = record.get("fields", record)
+        text = fields.get(field)
+        if isinstance(text, list):
+            # 多行文本字段也可能以富文本片段列表返回
+            text = "".join(segment.get("text", "") for segment in text if isinstance(segment, dict))
+        if isinstance(text, str):
+            yield from parse_signup_text(text, signup_time)
@@ -0,0 +1,153 @@
+"""
+接龙信息解析基准：先用 fixtures 中的样例（含格式不正确的行）校验解析结果，
+再把样例放大到约 1 万条报名，对比原先内联在 fetch_signup_data 中的逐行解析（按生产配置输出 INFO 日志）
+与 app.services.signup_parser 的单遍解析的吞吐量。
+
+用法（在仓库根目录执行）：
+    python -m benchmarks.bench_signup_parser
+
+可选环境变量：BENCH_SIGNUPS（报名条数，默认 10000）、BENCH_ROUNDS（每种写法重复次数，取最快一次，默认 5）
+"""
+import json
+import logging
+import os
+import time
+from datetime import datetime
+
+from app.services.signup_parser import parse_signup_records, parse_signup_text
+
+SIGNUPS = int(os.getenv("BENCH_SIGNUPS", "10000"))
+ROUNDS = int(os.getenv("BENCH_ROUNDS", "5"))
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+logger = logging.getLogger("bench_signup_parser.legacy")
+
+
+def legacy_parse(records):
+    """原 fetch_signup_data 中的解析循环（保留其日志），仅用于对比"""
+    signup_data = []
+    for record in records:
+        fields = record.get("fields", {})
+        signup_info = fields.get("接龙信息", "").strip()
+        logger.info(f"处理接龙信息: {signup_info}")
+        if not signup_info:
+            continue
+        lines = signup_info.split("\n")
+        current_signup = None
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            if "-" in line:
+                if current_signup and current_signup["nickname"]:
+                    signup_data.append(current_signup)
+                    current_signup = None
+                parts = line.split("-")
+                if len(parts) >= 3:
+                    nickname = parts[0].strip()
+                    focus_area = parts[-1].strip()
+                    if nickname:
+                        current_signup = {"nickname": nickname, "focus_area": focus_area,
+                                          "introduction": "", "goals": "", "signup_time": datetime.now()}
+                        logger.info(f"创建新的报名记录 - 昵称: {nickname}, 专注领域: {focus_area}")
+                else:
+                    logger.warning(f"昵称格式不正确: {line}")
+                    nickname = line
+                    focus_area = "未知"
+                    if nickname:
+                        current_signup = {"nickname": nickname, "focus_area": focus_area,
+                                          "introduction": "", "goals": "", "signup_time": datetime.now()}
+                        logger.info(f"创建新的报名记录（格式不正确） - 昵称: {nickname}, 专注领域: {focus_area}")
+            elif current_signup:
+                if "自我介绍：" in line:
+                    current_signup["introduction"] = line.split("自我介绍：")[1].strip()
+                    logger.info(f"添加自我介绍 - 昵称: {current_signup['nickname']}")
+                elif "本期目标：" in line:
+                    current_signup["goals"] = line.split("本期目标：")[1].strip()
+                    logger.info(f"添加目标 - 昵称: {current_signup['nickname']}")
+        if current_signup and current_signup["nickname"]:
+            signup_data.append(current_signup)
+            logger.info(f"添加最后一条报名记录 - 昵称: {current_signup['nickname']}, "
+                        f"专注领域: {current_signup['focus_area']}")
+    for idx, data in enumerate(signup_data, 1):
+        logger.info(f"处理后的记录 {idx}:")
+        logger.info(f"昵称: {data['nickname']}")
+        logger.info(f"专注领域: {data['focus_area']}")
+        logger.info(f"简介: {data['introduction']}")
+        logger.info(f"目标: {data['goals']}")
+        logger.info("---")
+    return signup_data
+
+
+def _strip_time(records):
+    return [{k: v for k, v in record.items() if k != "signup_time"} for record in records]
+
+
+def check_fixtures(items):
+    with open(os.path.join(FIXTURES, "signup_expected.json"), encoding="utf-8") as f:
+        expected = json.load(f)
+    parsed = _strip_time(parse_signup_records(items))
+    if parsed != expected:
+        raise AssertionError("解析结果与 signup_expected.json 不一致")
+    # 原实现不支持富文本片段列表，其余样例的结果应完全一致
+    text_items = [item for item in items if not isinstance(item["fields"].get("接龙信息"), list)]
+    if _strip_time(legacy_parse(text_items)) != _strip_time(parse_signup_records(text_items)):
+        raise AssertionError("单遍解析与原实现的结果不一致")
+    print(f"样例校验通过：{len(items)} 条记录 -> {len(parsed)} 条报名")
+
+
+def build_records(items):
+    """循环复制样例记录直到报名条数达到 SIGNUPS"""
+    text_items = [item for item in items if isinstance(item["fields"].get("接龙信息"), str)]
+    per_item = [len(list(parse_signup_records([item]))) for item in text_items]
+    records, total, i = [], 0, 0
+    while total < SIGNUPS:
+        item = text_items[i % len(text_items)]
+        records.append(item)
+        total += per_item[i % len(text_items)]
+        i += 1
+    return records, total
+
+
+def measure(name, func, total):
+    best = None
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        count = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    if count != total:
+        raise AssertionError(f"{name}: 期望 {total} 条报名，实际 {count} 条")
+    print(f"{name:<28} {best * 1000:>10.1f} ms {total / best:>14,.0f} 条/秒")
+    return best
+
+
+def main():
+    with open(os.path.join(FIXTURES, "signup_records.json"), encoding="utf-8") as f:
+        items = json.load(f)["items"]
+
+    # 与生产一致：INFO 级别日志写到文件（这里写到空设备）
+    handler = logging.FileHandler(os.devnull, encoding="utf-8")
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    check_fixtures(items)
+    records, total = build_records(items)
+    text = "\n".join(item["fields"]["接龙信息"] for item in records)
+    print(f"放大后：{len(records)} 条记录，{total} 条报名，{len(text) / 1024:.0f} KB 文本")
+
+    print(f"{'写法':<28} {'耗时':>13} {'吞吐量':>16}")
+    legacy = measure("原实现（INFO 日志）", lambda: len(legacy_parse(records)), total)
+    logger.setLevel(logging.WARNING)
+    measure("原实现（关闭 INFO 日志）", lambda: len(legacy_parse(records)), total)
+    records_time = measure("单遍解析（记录流）", lambda: sum(1 for _ in parse_signup_records(records)), total)
+    # 样例中有跨记录无效的行（昵称为空、没有横线），拼成一段文本后条数可能不同，单独统计
+    text_total = sum(1 for _ in parse_signup_text(text))
+    measure("单遍解析（整段文本）", lambda: sum(1 for _ in parse_signup_text(text)), text_total)
+    print(f"  -> 相比原实现提速 {legacy / records_time:.1f} 倍")
+
+
+if __name__ == "__main__":
+    main()
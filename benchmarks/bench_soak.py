@@ -0,0 +1,257 @@
+"""
+长时间运行的浸泡测试：把数十万条模拟事件送入 main.do_p2_im_message_receive_v1，走完整的接收、去重、限流、
+执行通道、数据库、DeepSeek 与飞书回复流程，观察进程内存（RSS）、tracemalloc 增长最多的分配位置、
+数据库连接池中借出的连接数、打开的文件描述符和线程数是否随事件数持续增长。
+
+本地替身：SQLite 文件数据库；DeepSeek 与飞书 OpenAPI 由 httpx.MockTransport 应答（仍经过共享连接池的
+并发控制与统计）；日志按生产格式写到空设备。每一轮模拟一期活动：写入报名 -> 打卡（首次打卡调用大模型并绑定
+发送者，其余为重复打卡、格式错误、昵称不存在）、重复投递的事件、普通聊天、#搜索、#用量、非接龙卡片消息 ->
+期数结束后归档，热表中的行随之删除，因此稳定状态下的内存不应随轮数增长。
+
+前 BENCH_WARMUP_ROUNDS 轮之后取基线，结束时与基线比较，任一项超过阈值则以非零状态退出：
+    python -m benchmarks.bench_soak
+
+可选环境变量：
+    BENCH_EVENTS                 事件总数（默认 200000，开启 tracemalloc 时约半小时）
+    BENCH_ROUND_SIGNUPS          每期报名人数（默认 200，每人约 10 条事件）
+    BENCH_WARMUP_ROUNDS          预热轮数（默认 5，有上限的缓存在此期间填满）
+    BENCH_MAX_RSS_GROWTH_MB      RSS 允许增长（默认 32）
+    BENCH_MAX_TRACED_GROWTH_MB   tracemalloc 跟踪的 Python 对象允许增长（默认 8）
+    BENCH_MAX_FD_GROWTH          文件描述符允许增长（默认 8）
+    BENCH_TRACEMALLOC            是否开启 tracemalloc（默认 true，开启后吞吐量约为关闭时的三分之一）
+    DB_ASYNC                     与机器人相同，默认走异步处理链路
+"""
+import gc
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+EVENTS = int(os.getenv("BENCH_EVENTS", "200000"))
+ROUND_SIGNUPS = int(os.getenv("BENCH_ROUND_SIGNUPS", "200"))
+WARMUP_ROUNDS = int(os.getenv("BENCH_WARMUP_ROUNDS", "5"))
+MAX_RSS_GROWTH_MB = float(os.getenv("BENCH_MAX_RSS_GROWTH_MB", "32"))
+MAX_TRACED_GROWTH_MB = float(os.getenv("BENCH_MAX_TRACED_GROWTH_MB", "8"))
+MAX_FD_GROWTH = int(os.getenv("BENCH_MAX_FD_GROWTH", "8"))
+TRACEMALLOC = os.getenv("BENCH_TRACEMALLOC", "true").lower() == "true"
+
+DB_PATH = "/tmp/feishu_bench_soak.db"
+CHATS = [f"oc_soak_{i}" for i in range(4)]
+# 每次提交多少条事件后等待执行通道清空，避免一次性排队数十万个任务本身占用内存
+BATCH = 500
+
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+os.environ.pop("DATABASE_REPLICA_URL", None)
+os.environ.setdefault("FEISHU_APP_ID", "bench")
+os.environ.setdefault("FEISHU_APP_SECRET", "bench")
+os.environ.setdefault("DEEPSEEK_API_KEY", "bench")
+# 浸泡测试关注资源是否泄漏，不测准入控制：放宽限流，让事件都进入处理流程
+for name in ("RATE_USER_PER_MIN", "RATE_USER_BURST", "RATE_CHAT_PER_MIN", "RATE_CHAT_BURST"):
+    os.environ.setdefault(name, "1000000")
+for suffix in ("", "-wal", "-shm"):
+    if os.path.exists(DB_PATH + suffix):
+        os.remove(DB_PATH + suffix)
+
+import httpx  # noqa: E402
+import lark_oapi as lark  # noqa: E402
+from lark_oapi.api.im.v1 import P2ImMessageReceiveV1  # noqa: E402
+
+import main  # noqa: E402
+from app.models import database  # noqa: E402
+from app.models.database import Period, Signup, SessionLocal, engine  # noqa: E402
+from app.services.archive_service import archive_period  # noqa: E402
+from app.services.http_client import http_transport  # noqa: E402
+from app.services.job_lanes import job_lanes  # noqa: E402
+from app.services.llm_usage import usage_tracker  # noqa: E402
+
+
+def mock_api(request: httpx.Request) -> httpx.Response:
+    """DeepSeek 与飞书 OpenAPI 的本地替身"""
+    path = request.url.path
+    if path.endswith("/chat/completions"):
+        return httpx.Response(200, json={
+            "choices": [{"message": {"role": "assistant", "content": "进展很扎实，明天继续保持这个节奏！"}}],
+            "usage": {"prompt_tokens": 420, "completion_tokens": 30,
+                      "prompt_cache_hit_tokens": 384, "prompt_cache_miss_tokens": 36},
+        })
+    if path.endswith("/tenant_access_token/internal"):
+        return httpx.Response(200, json={"code": 0, "tenant_access_token": "t-bench", "expire": 7200})
+    if path.startswith("/open-apis/im/v1/messages"):
+        return httpx.Response(200, json={"code": 0, "data": {"message_id": "om_bench"}})
+    return httpx.Response(404, json={"code": 404, "msg": "not found"})
+
+
+def build_event(event_id: str, message_id: str, chat_id: str, sender: str, message_type: str, content: dict):
+    return lark.JSON.unmarshal(json.dumps({
+        "schema": "2.0",
+        "header": {"event_id": event_id, "event_type": "im.message.receive_v1"},
+        "event": {
+            "sender": {"sender_id": {"open_id": sender}},
+            "message": {"message_id": message_id, "chat_id": chat_id, "chat_type": "group",
+                        "message_type": message_type, "content": json.dumps(content, ensure_ascii=False)},
+        },
+    }, ensure_ascii=False), P2ImMessageReceiveV1)
+
+
+def seed_period(round_no: int) -> int:
+    db = SessionLocal()
+    try:
+        period = Period(period_name=f"soak-{round_no}", start_date=datetime.now(),
+                        end_date=datetime.now() + timedelta(days=21), status="进行中", chat_id=CHATS[0])
+        db.add(period)
+        db.flush()
+        db.add_all([Signup(period_id=period.id, nickname=f"r{round_no}u{i}", focus_area="后端",
+                           goals=f"完成第{i % 17}个服务的重构并补齐监控") for i in range(ROUND_SIGNUPS)])
+        db.commit()
+        return period.id
+    finally:
+        db.close()
+
+
+def end_period(period_id: int) -> None:
+    """结束并归档本期，热表中的报名和打卡随之删除"""
+    db = SessionLocal()
+    try:
+        period = db.get(Period, period_id)
+        period.status = "已结束"
+        period.end_date = datetime.now()
+        db.commit()
+        archive_period(db, period)
+    finally:
+        db.close()
+    usage_tracker.flush()
+
+
+def round_events(round_no: int):
+    """一期的事件流，每人约 10 条"""
+    big_card = {"title": "📢 本周分享会", "elements": [[{"tag": "text", "text": "议程 " * 400}] for _ in range(20)]}
+    seq = 0
+
+    def next_ids():
+        nonlocal seq
+        seq += 1
+        return f"ev_{round_no}_{seq}", f"om_{round_no}_{seq}"
+
+    for i in range(ROUND_SIGNUPS):
+        chat = CHATS[i % len(CHATS)]
+        # 同一批人参加每一期
+        sender = f"ou_{i}"
+        nickname = f"r{round_no}u{i}"
+        event_id, message_id = next_ids()
+        first = (event_id, message_id, chat, sender, "text",
+                 {"text": f"#打卡 {nickname} 完成了第{round_no}期模块{i}的接口开发与联调，补充了单元测试"})
+        yield first
+        # 飞书重复投递同一事件
+        yield first
+        yield (*next_ids(), chat, sender, "text", {"text": "#打卡 今天又修了两个线上问题"})
+        for k in range(5):
+            yield (*next_ids(), chat, sender, "text", {"text": f"收到，第{k}条普通聊天消息不需要处理"})
+        if i % 20 == 0:
+            yield (*next_ids(), chat, sender, "text", {"text": "#打卡"})
+            yield (*next_ids(), chat, sender, "text", {"text": f"#打卡 不存在的人{i} 写了一些代码"})
+            yield (*next_ids(), chat, sender, "text", {"text": f"#搜索 模块{i}"})
+            yield (*next_ids(), chat, sender, "interactive", big_card)
+        if i % 100 == 0:
+            yield (*next_ids(), chat, sender, "text", {"text": "#用量"})
+
+
+def wait_idle() -> None:
+    while job_lanes.pending():
+        time.sleep(0.005)
+
+
+def pools():
+    """所有连接池中当前借出的连接数"""
+    engines = [engine] + [async_engine.sync_engine for async_engine in database._async_engines]
+    return sum(getattr(e.pool, "checkedout", lambda: 0)() for e in engines)
+
+
+def sample() -> dict:
+    gc.collect()
+    with open("/proc/self/statm") as f:
+        rss_pages = int(f.read().split()[1])
+    return {
+        "rss_mb": rss_pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024,
+        "traced_mb": tracemalloc.get_traced_memory()[0] / 1024 / 1024 if TRACEMALLOC else 0.0,
+        "connections": pools(),
+        "fds": len(os.listdir("/proc/self/fd")),
+        "threads": threading.active_count(),
+    }
+
+
+def main_soak() -> int:
+    # 日志按生产格式输出，但写到空设备
+    handler = logging.FileHandler(os.devnull, encoding="utf-8")
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    root = logging.getLogger()
+    root.handlers = [handler]
+
+    http_transport._build_client = lambda: httpx.AsyncClient(transport=httpx.MockTransport(mock_api))
+    if TRACEMALLOC:
+        tracemalloc.start()
+
+    print(f"事件总数 {EVENTS}，每期 {ROUND_SIGNUPS} 人，预热 {WARMUP_ROUNDS} 轮，"
+          f"DB_ASYNC={database.DB_ASYNC}，tracemalloc={'开' if TRACEMALLOC else '关'}")
+    print(f"{'轮次':>4} {'事件数':>9} {'事件/秒':>8} {'RSS(MB)':>9} {'跟踪(MB)':>9} {'连接':>4} {'fd':>4} {'线程':>4}")
+
+    sent, round_no = 0, 0
+    baseline, snapshot = None, None
+    start = time.perf_counter()
+    while sent < EVENTS:
+        round_no += 1
+        round_start, round_sent = time.perf_counter(), 0
+        period_id = seed_period(round_no)
+        for event in round_events(round_no):
+            main.do_p2_im_message_receive_v1(build_event(*event))
+            round_sent += 1
+            if round_sent % BATCH == 0:
+                wait_idle()
+        wait_idle()
+        end_period(period_id)
+        sent += round_sent
+
+        stats = sample()
+        print(f"{round_no:>4} {sent:>9} {round_sent / (time.perf_counter() - round_start):>8.0f} "
+              f"{stats['rss_mb']:>9.1f} {stats['traced_mb']:>9.1f} {stats['connections']:>4} "
+              f"{stats['fds']:>4} {stats['threads']:>4}", flush=True)
+        if round_no == WARMUP_ROUNDS:
+            baseline = stats
+            snapshot = tracemalloc.take_snapshot() if TRACEMALLOC else None
+
+    elapsed = time.perf_counter() - start
+    final = sample()
+    print(f"\n共 {sent} 条事件，{round_no} 期，耗时 {elapsed:.0f}s（{sent / elapsed:.0f} 条/秒）")
+    if baseline is None:
+        print("轮数不足，未完成预热，无法判断增长（增大 BENCH_EVENTS 或减小 BENCH_WARMUP_ROUNDS）")
+        return 1
+
+    if snapshot is not None:
+        print("\ntracemalloc 自基线以来增长最多的分配位置：")
+        for stat in tracemalloc.take_snapshot().compare_to(snapshot, "lineno")[:10]:
+            print(f"  {stat.size_diff / 1024:>+9.1f} KB {stat.count_diff:>+8} 个  {stat.traceback}")
+
+    checks = [
+        ("RSS", final["rss_mb"] - baseline["rss_mb"], MAX_RSS_GROWTH_MB, "MB"),
+        ("Python 对象", final["traced_mb"] - baseline["traced_mb"], MAX_TRACED_GROWTH_MB, "MB"),
+        ("文件描述符", final["fds"] - baseline["fds"], MAX_FD_GROWTH, "个"),
+        ("线程", final["threads"] - baseline["threads"], 0, "个"),
+        # 处理完所有事件后不应有连接仍被借出（会话未关闭）
+        ("借出的数据库连接", final["connections"], 0, "个"),
+    ]
+    print("\n与基线（第 {} 轮后）相比：".format(WARMUP_ROUNDS))
+    failed = False
+    for name, growth, limit, unit in checks:
+        ok = growth <= limit
+        failed = failed or not ok
+        print(f"  {'通过' if ok else '超限'}  {name}：{growth:+.1f} {unit}（上限 {limit} {unit}）")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    code = main_soak()
+    main.shutdown()
+    sys.exit(code)
@@ -0,0 +1,25 @@
+"""
+基准脚本会删除并重建目标库中的全部表，这里拒绝在非临时数据库上运行，避免误删业务数据。
+"""
+import os
+import tempfile
+from sqlalchemy.engine import make_url
+
+
+def is_disposable(url: str) -> bool:
+    """临时数据库：内存 SQLite、系统临时目录下的 SQLite 文件，或库名包含 bench 的专用基准库"""
+    parsed = make_url(url)
+    database = parsed.database or ""
+    if parsed.get_backend_name() == "sqlite":
+        if database in ("", ":memory:"):
+            return True
+        path = os.path.realpath(database)
+        return path.startswith(os.path.realpath(tempfile.gettempdir()) + os.sep)
+    return "bench" in database.lower()
+
+
+def require_disposable(url: str) -> None:
+    if not is_disposable(url):
+        raise SystemExit(
+            f"拒绝在 {make_url(url).render_as_string(hide_password=True)} 上运行：基准会删除全部表，"
+            f"请使用临时目录下的 SQLite 文件或库名包含 bench 的专用数据库")
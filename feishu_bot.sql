@@ -18,6 +18,9 @@ CREATE TABLE `periods` (
   `end_date` datetime NOT NULL,
   `status` varchar(20) NOT NULL,
   `signup_link` varchar(500) DEFAULT NULL,
+  `chat_id` varchar(64) DEFAULT NULL,
+  `keep_hot` tinyint(1) DEFAULT 0,
+  `report_progress` int(11) DEFAULT 0,
   PRIMARY KEY (`id`),
   UNIQUE KEY `period_name` (`period_name`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
@@ -32,8 +35,13 @@ CREATE TABLE `signups` (
   `introduction` text DEFAULT NULL,
   `goals` text DEFAULT NULL,
   `signup_time` datetime DEFAULT CURRENT_TIMESTAMP,
+  `history_summary` text DEFAULT NULL,
+  `summarized_count` int(11) DEFAULT 0,
+  `open_id` varchar(64) DEFAULT NULL,
   PRIMARY KEY (`id`),
   UNIQUE KEY `period_nickname` (`period_id`, `nickname`),
+  UNIQUE KEY `period_open_id` (`period_id`, `open_id`),
+  FULLTEXT KEY `ft_signups_goals` (`goals`) WITH PARSER ngram,
   CONSTRAINT `fk_signup_period` FOREIGN KEY (`period_id`) REFERENCES `periods` (`id`) ON DELETE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
@@ -46,12 +54,77 @@ CREATE TABLE `checkins` (
   `checkin_date` date NOT NULL,
   `content` text NOT NULL,
   `checkin_count` int(11) DEFAULT NULL,
+  `minhash` blob DEFAULT NULL,
+  `duplicate_of` int(11) DEFAULT NULL,
   `created_at` datetime DEFAULT CURRENT_TIMESTAMP,
   PRIMARY KEY (`id`),
   KEY `fk_checkin_signup` (`signup_id`),
+  FULLTEXT KEY `ft_checkins_content` (`content`) WITH PARSER ngram,
   CONSTRAINT `fk_checkin_signup` FOREIGN KEY (`signup_id`) REFERENCES `signups` (`id`) ON DELETE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
+-- 已结束期数的冷归档表
+DROP TABLE IF EXISTS `period_archives`;
+CREATE TABLE `period_archives` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `period_id` int(11) NOT NULL,
+  `archived_at` datetime DEFAULT CURRENT_TIMESTAMP,
+  `signup_count` int(11) NOT NULL,
+  `checkin_count` int(11) NOT NULL,
+  `snapshot` text NOT NULL,
+  `payload` longblob NOT NULL,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `period_id` (`period_id`),
+  CONSTRAINT `fk_archive_period` FOREIGN KEY (`period_id`) REFERENCES `periods` (`id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- 定时任务表（期数自动结束、每日提醒、到期归档）
+DROP TABLE IF EXISTS `scheduled_jobs`;
+CREATE TABLE `scheduled_jobs` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `kind` varchar(32) NOT NULL,
+  `period_id` int(11) DEFAULT NULL,
+  `chat_id` varchar(64) DEFAULT NULL,
+  `run_at` datetime NOT NULL,
+  `status` varchar(16) NOT NULL DEFAULT 'pending',
+  `attempts` int(11) NOT NULL DEFAULT 0,
+  `last_error` text,
+  `created_at` datetime DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`),
+  KEY `job_status_run_at` (`status`, `run_at`),
+  CONSTRAINT `fk_job_period` FOREIGN KEY (`period_id`) REFERENCES `periods` (`id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- 群设置表
+DROP TABLE IF EXISTS `chat_settings`;
+CREATE TABLE `chat_settings` (
+  `chat_id` varchar(64) NOT NULL,
+  `feedback_mode` varchar(16) NOT NULL DEFAULT 'instant',
+  `digest_time` varchar(5) DEFAULT NULL,
+  `updated_at` datetime DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`chat_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- LLM 调用用量表（按期数和命令累计）
+DROP TABLE IF EXISTS `llm_usage`;
+CREATE TABLE `llm_usage` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `period_id` int(11) DEFAULT NULL,
+  `command` varchar(32) NOT NULL,
+  `calls` int(11) NOT NULL DEFAULT 0,
+  `prompt_tokens` bigint(20) NOT NULL DEFAULT 0,
+  `completion_tokens` bigint(20) NOT NULL DEFAULT 0,
+  `cache_hit_tokens` bigint(20) NOT NULL DEFAULT 0,
+  `cache_miss_tokens` bigint(20) NOT NULL DEFAULT 0,
+  `local_cache_hits` int(11) NOT NULL DEFAULT 0,
+  `total_latency_ms` bigint(20) NOT NULL DEFAULT 0,
+  `max_latency_ms` int(11) NOT NULL DEFAULT 0,
+  `updated_at` datetime DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `period_command` (`period_id`, `command`),
+  CONSTRAINT `fk_usage_period` FOREIGN KEY (`period_id`) REFERENCES `periods` (`id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
 -- 创建统计视图
 DROP VIEW IF EXISTS `period_stats`;
 CREATE VIEW `period_stats` AS
@@ -62,7 +135,7 @@ SELECT
   MAX(c.checkin_date) as last_checkin_date
 FROM periods p
 JOIN signups s ON p.id = s.period_id
-LEFT JOIN checkins c ON s.id = c.signup_id
+LEFT JOIN checkins c ON s.id = c.signup_id AND c.duplicate_of IS NULL
 GROUP BY p.period_name, s.nickname;
 
 SET FOREIGN_KEY_CHECKS = 1;
\ No newline at end of file
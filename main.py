@@ -1,11 +1,25 @@
 import lark_oapi as lark
 from lark_oapi.api.im.v1 import *
+import asyncio
 import json
 import os
+import signal
+import threading
 from dotenv import load_dotenv
 import logging
-from app.services.message_handler import MessageHandler
-from app.models.database import init_db, get_db
+from sqlalchemy.orm import Session
+from app.services.message_handler import MessageHandler, release_settling_periods
+from app.services.feishu_service import FeishuService
+from app.services.rate_limiter import admit
+from app.services.event_dedup import recent_events
+from app.services.log_utils import clip
+from app.services.job_lanes import job_lanes, classify, LANE_FAST
+from app.services.profiler import profiler, stage, PROFILE_COMMAND
+from app.services.llm_usage import usage_tracker
+from app.services.llm_cache import llm_cache
+from app.services.scheduler import scheduler, SCHEDULER_ENABLED
+from app.services.http_client import http_transport
+from app.models.database import init_db, SessionLocal, engine, replica_engine, DB_ASYNC, async_session_factory, dispose_async_engines
 
 # 配置日志
 logging.basicConfig(level=logging.INFO,
@@ -18,6 +32,8 @@ load_dotenv()
 # 获取配置
 FEISHU_APP_ID = os.getenv("FEISHU_APP_ID")
 FEISHU_APP_SECRET = os.getenv("FEISHU_APP_SECRET")
+# 停机时等待进行中任务（处理与回复）完成的最长时间
+SHUTDOWN_TIMEOUT_SECONDS = float(os.getenv("SHUTDOWN_TIMEOUT_SECONDS", "60"))
 
 if not all([FEISHU_APP_ID, FEISHU_APP_SECRET]):
     raise ValueError(
@@ -26,6 +42,12 @@ if not all([FEISHU_APP_ID, FEISHU_APP_SECRET]):
 try:
     # 初始化数据库
     init_db()
+    # 上次停机时未完成结算的期数恢复为进行中
+    _db = SessionLocal()
+    try:
+        release_settling_periods(_db)
+    finally:
+        _db.close()
     logger.info("数据库初始化成功")
 except Exception as e:
     logger.error(f"数据库初始化失败: {str(e)}")
@@ -36,101 +58,131 @@ except Exception as e:
 # https://open.feishu.cn/document/uAjLw4CM/ukTMukTMukTM/reference/im-v1/message/events/receive
 
 
+# 收到停机信号后置位，不再接收新事件
+shutting_down = threading.Event()
+
+
+class ShutdownRequested(BaseException):
+    """收到 SIGTERM/SIGINT，用于退出长连接的事件循环（继承 BaseException，避免被事件循环内的 except Exception 吞掉）"""
+
+
 def do_p2_im_message_receive_v1(data: P2ImMessageReceiveV1) -> None:
+    if shutting_down.is_set():
+        # 抛出异常使本次事件不被确认，飞书会重新投递（由重启后的实例处理）
+        raise RuntimeError("服务正在停机，拒绝新事件")
     try:
-        # 检查是否已经处理过该消息
         message_id = data.event.message.message_id
         event_id = data.header.event_id
-        
-        # 使用Redis或内存缓存来存储已处理的消息ID
-        processed_events = getattr(do_p2_im_message_receive_v1, 'processed_events', set())
-        if event_id in processed_events:
+
+        # 飞书未及时收到确认时会重复投递，按事件 ID 和消息 ID 去重（只记住最近的，内存占用固定）
+        if recent_events.seen(event_id, message_id):
             logger.info(f"事件 {event_id} 已经处理过，跳过")
             return
-        
-        # 添加到已处理集合
-        processed_events.add(event_id)
-        setattr(do_p2_im_message_receive_v1, 'processed_events', processed_events)
-        
-        # 如果集合太大，清理一下
-        if len(processed_events) > 1000:
-            processed_events.clear()
-        
+
         logger.info("收到新消息")
         res_content = ""
         message_type = data.event.message.message_type
+        chat_id = data.event.message.chat_id
         logger.info(f"消息类型: {message_type}")
 
-        # 使用消息处理器处理消息
-        db = next(get_db())
-        handler = MessageHandler(db)
-        logger.info("开始处理消息...")
-
         if message_type == "text":
             content_json = json.loads(data.event.message.content)
             res_content = content_json.get("text", "")
-            logger.info(f"消息内容: {res_content}")
+            # 普通聊天消息不是命令，不需要数据库和处理器
+            if not res_content.strip().startswith("#"):
+                return
+            logger.info(f"消息内容: {clip(res_content)}")
         else:
             res_content = data.event.message.content
-            logger.info(f"消息内容: {res_content}")
-
-        response = handler.handle_message(
-            res_content, 
-            data.event.message.chat_id, 
-            message_type,
-            message_id
-        )
-        logger.info(f"消息处理结果: {response}")
-
-        if response:
-            content = json.dumps({"text": response})
-            logger.info(f"准备发送回复: {content}")
-
-            if data.event.message.chat_type == "p2p":
-                logger.info("私聊消息，使用 create 接口发送")
-                request = (
-                    CreateMessageRequest.builder()
-                    .receive_id_type("chat_id")
-                    .request_body(
-                        CreateMessageRequestBody.builder()
-                        .receive_id(data.event.message.chat_id)
-                        .msg_type("text")
-                        .content(content)
-                        .build()
-                    )
-                    .build()
-                )
-                # 使用OpenAPI发送消息
-                # Use send OpenAPI to send messages
-                # https://open.feishu.cn/document/uAjLw4CM/ukTMukTMukTM/reference/im-v1/message/create
-                response = client.im.v1.message.create(request)
-            else:
-                logger.info("群聊消息，使用 reply 接口发送")
-                request = (
-                    ReplyMessageRequest.builder()
-                    .message_id(message_id)
-                    .request_body(
-                        ReplyMessageRequestBody.builder()
-                        .content(content)
-                        .msg_type("text")
-                        .build()
-                    )
-                    .build()
-                )
-                # 使用OpenAPI回复消息
-                # Reply to messages using send OpenAPI
-                # https://open.feishu.cn/document/uAjLw4CM/ukTMukTMukTM/reference/im-v1/message/reply
-                response = client.im.v1.message.reply(request)
-
-            if not response.success():
-                logger.error(
-                    f"发送消息失败: {response.msg}, log_id: {response.get_log_id()}")
-            else:
-                logger.info("消息发送成功")
+            logger.info(f"消息内容: {clip(res_content)}")
+
+        # 准入控制：按发送者和会话限流，在占用数据库连接和大模型额度之前丢弃突发流量
+        sender = data.event.sender
+        sender_id = sender.sender_id.open_id if sender and sender.sender_id else None
+        allowed, limited_reply = admit(sender_id, chat_id)
+        if not allowed:
+            logger.warning(f"消息被限流 - 发送者: {sender_id}, 会话: {chat_id}")
+            if limited_reply:
+                # 回复放到快速通道发送，不在长连接线程上等待飞书接口
+                job_lanes.submit(LANE_FAST, feishu_service.reply_message, message_id, limited_reply)
+            return
+
+        # 管理员命令：运行时开关性能分析，不需要数据库
+        if message_type == "text" and res_content.strip().startswith(PROFILE_COMMAND):
+            reply = profiler.handle_command(sender_id, res_content)
+            if reply:
+                job_lanes.submit(LANE_FAST, feishu_service.reply_message, message_id, reply)
+            return
+
+        # 按命令类型分配执行通道：打卡等快速命令与活动结束等长任务互不阻塞
+        lane = classify(message_type, res_content)
+        logger.info(f"提交到 {lane} 通道处理")
+        if DB_ASYNC:
+            job_lanes.submit_async(lane, process_message_async, data, res_content)
+        else:
+            job_lanes.submit(lane, process_message, data, res_content)
     except Exception as e:
         logger.error(f"消息处理失败: {str(e)}", exc_info=True)
 
 
+def process_message(data: P2ImMessageReceiveV1, res_content: str) -> None:
+    """在执行通道的线程中处理消息并发送回复（DB_ASYNC=false）"""
+    db = SessionLocal()
+    try:
+        _process_message(db, data, res_content)
+    finally:
+        db.close()
+
+
+async def process_message_async(data: P2ImMessageReceiveV1, res_content: str) -> None:
+    """在共享事件循环上处理消息：处理逻辑运行在 AsyncSession 的 greenlet 中，
+    数据库、DeepSeek、飞书请求等待期间让出事件循环，多个事件并发处理而不占用线程"""
+    async with async_session_factory()() as session:
+        await session.run_sync(_process_message, data, res_content)
+
+
+def _process_message(db: Session, data: P2ImMessageReceiveV1, res_content: str) -> None:
+    message_id = data.event.message.message_id
+    chat_id = data.event.message.chat_id
+    sender = data.event.sender
+    sender_open_id = sender.sender_id.open_id if sender and sender.sender_id else None
+    with profiler.trace(data.header.event_type, data.header.event_id, res_content[:20]):
+        try:
+            # 使用消息处理器处理消息，长任务的进度直接发到会话
+            handler = MessageHandler(db, notify=lambda text: feishu_service.send_message(chat_id, text),
+                                     feishu_service=feishu_service)
+            logger.info("开始处理消息...")
+
+            with stage("handle"):
+                response = handler.handle_message(
+                    res_content, 
+                    chat_id, 
+                    data.event.message.message_type,
+                    message_id,
+                    sender_open_id
+                )
+            logger.info(f"消息处理结果: {clip(response)}")
+
+            if response:
+                logger.info(f"准备发送回复，共 {len(response)} 字")
+
+                # 回复与 DeepSeek 调用共用同一个连接池
+                with stage("reply"):
+                    if data.event.message.chat_type == "p2p":
+                        logger.info("私聊消息，使用 create 接口发送")
+                        # https://open.feishu.cn/document/uAjLw4CM/ukTMukTMukTM/reference/im-v1/message/create
+                        sent = feishu_service.send_message(chat_id, response)
+                    else:
+                        logger.info("群聊消息，使用 reply 接口发送")
+                        # https://open.feishu.cn/document/uAjLw4CM/ukTMukTMukTM/reference/im-v1/message/reply
+                        sent = feishu_service.reply_message(message_id, response)
+
+                if sent:
+                    logger.info("消息发送成功")
+        except Exception as e:
+            logger.error(f"消息处理失败: {str(e)}", exc_info=True)
+
+
 # 注册事件回调
 # Register event handler.
 event_handler = (
@@ -140,10 +192,10 @@ event_handler = (
 )
 
 
-# 创建 LarkClient 对象，用于请求OpenAPI, 并创建 LarkWSClient 对象，用于使用长连接接收事件。
-# Create LarkClient object for requesting OpenAPI, and create LarkWSClient object for receiving events using long connection.
-client = lark.Client.builder().app_id(
-    FEISHU_APP_ID).app_secret(FEISHU_APP_SECRET).build()
+# 出站 OpenAPI 请求（回复消息、多维表）统一走 FeishuService 的共享连接池；
+# LarkWSClient 只用于通过长连接接收事件。
+# Outbound OpenAPI calls go through FeishuService's shared pool; LarkWSClient only receives events.
+feishu_service = FeishuService()
 wsClient = lark.ws.Client(
     FEISHU_APP_ID,
     FEISHU_APP_SECRET,
@@ -152,12 +204,51 @@ wsClient = lark.ws.Client(
 )
 
 
+def _on_signal(signum, frame) -> None:
+    if shutting_down.is_set():
+        return
+    logger.info(f"收到信号 {signal.Signals(signum).name}，停止接收新事件")
+    shutting_down.set()
+    # 信号在主线程（长连接事件循环所在线程）中处理，抛出异常即可退出 wsClient.start()
+    raise ShutdownRequested()
+
+
+def shutdown() -> bool:
+    """排空执行通道中已接收的任务（含其中的回复与分段报告发送），再关闭连接池"""
+    scheduler.stop()
+    drained = job_lanes.drain(SHUTDOWN_TIMEOUT_SECONDS)
+    try:
+        usage_tracker.flush()
+    except Exception as e:
+        logger.error(f"写入 LLM 用量失败: {str(e)}")
+    try:
+        if DB_ASYNC:
+            asyncio.run_coroutine_threadsafe(dispose_async_engines(), http_transport.loop).result(timeout=10)
+        http_transport.close()
+    except Exception as e:
+        logger.error(f"关闭 HTTP 连接池失败: {str(e)}")
+    engine.dispose()
+    if replica_engine is not None:
+        replica_engine.dispose()
+    logger.info("服务已停止" if drained else "服务已停止（部分任务未完成）")
+    return drained
+
+
 def main():
+    signal.signal(signal.SIGTERM, _on_signal)
+    signal.signal(signal.SIGINT, _on_signal)
     try:
         logger.info("启动飞书机器人服务...")
+        llm_cache.start_sweeper()
+        if SCHEDULER_ENABLED:
+            scheduler.start(feishu_service.send_message)
         #  启动长连接，并注册事件处理器。
         #  Start long connection and register event handler.
         wsClient.start()
+    except ShutdownRequested:
+        if not shutdown():
+            # 未完成的任务仍占着工作线程，直接退出，避免解释器退出时无限等待
+            os._exit(1)
     except Exception as e:
         logger.error(f"服务启动失败: {str(e)}")
         raise